@@ -44,9 +44,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'core.middleware.ReplicaStickinessMiddleware',
+    'core.middleware.TrafficCaptureMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -88,6 +91,13 @@ DATABASES = {
     }
 }
 
+# Read-only queries of the list, retrieve and stats endpoints go to one of the
+# DATABASE_REPLICAS aliases (none by default). A client reads from the primary
+# for REPLICA_STICKINESS_SECONDS after its write, see core.routers
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_STICKINESS_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -127,8 +137,88 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Dispatch index
+# In-memory index of not assigned yet orders kept by every worker, see
+# core.services.dispatch_index
+DISPATCH_INDEX_ENABLED = False
+DISPATCH_INDEX_MAX_AGE = 30  # In seconds
+
+# Strategy choosing the orders for the courier's bag, see
+# core.services.courier.PackingStrategy
+PACKING_STRATEGY = {
+    'BACKEND': 'core.services.courier.GreedyPackingStrategy',
+    'OPTIONS': {},
+}
+
+# Number of processes packing the bags of POST /orders/assign_batch, see
+# core.services.courier.assign_orders_batch
+ASSIGN_BATCH_PROCESSES = 1
+
+# Bulk ingestion, see core.services.bulk.bulk_insert
+BULK_CREATE_BATCH_SIZE = 1000
+BULK_COPY_THRESHOLD = 10000
+NDJSON_IMPORT_CHUNK_SIZE = 1000
+
+# Keyset pagination of GET /couriers and GET /orders, see
+# core.pagination.KeysetPagination
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 1000
+
+# Read endpoints build their responses straight from values() rows instead
+# of the DRF serializers, see core.serializers.fast
+FAST_SERIALIZATION_ENABLED = False
+
+# GET /couriers/<id> and GET /orders/<id> are served by async views running in
+# a thread pool, for the ASGI (uvicorn) profile only, see
+# core.views.asynchronous
+ASYNC_READ_VIEWS_ENABLED = False
+
+REST_FRAMEWORK = {
+    # The same output as JSONRenderer, but rendered with orjson (see
+    # requirements.txt), falls back to JSONRenderer without it
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# The local memory cache is per process, the workers must share the cache
+# (e.g. memcached, see local.example.py) before RESPONSE_CACHE_ENABLED is set
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache of the courier responses, see core.services.response_cache
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 300  # In seconds
+
+# Metrics served at /metrics in the Prometheus format, see
+# core.services.metrics. The gunicorn workers must share METRICS_DIR (emptied
+# when the server starts) to report the metrics of all of them
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1  # In seconds
+
+# Capture of the API traffic for the replays (replay_traffic command), see
+# core.services.traffic
+TRAFFIC_CAPTURE_ENABLED = False
+TRAFFIC_CAPTURE_DIR = BASE_DIR.parent.parent / 'logs/traffic'
+TRAFFIC_CAPTURE_SAMPLE_RATE = 1.0  # The share of the requests recorded
+TRAFFIC_CAPTURE_MAX_BYTES = 10 * 1024 * 1024  # Of a file, then it's rotated
+TRAFFIC_CAPTURE_BACKUP_COUNT = 5
+TRAFFIC_CAPTURE_MAX_BODY_BYTES = 64 * 1024  # Larger bodies aren't recorded
+TRAFFIC_CAPTURE_EXCLUDED_PATHS = ['/admin/', '/metrics', '/static/']
+TRAFFIC_CAPTURE_REDACTED_FIELDS = ['password', 'token', 'secret']
+
 # Logging
 # https://docs.djangoproject.com/en/3.1/topics/logging/
+# DEBUG would log every query when DEBUG is on, see /metrics for those
+LOG_LEVEL = 'INFO'
 LOGFILE_MAX_BYTES = 1 * 1024 * 1024
 LOGFILE_BACKUP_COUNT = 2
 
@@ -142,7 +232,7 @@ LOGGING = {
     },
     'handlers': {
         'django': {
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'class': 'logging.handlers.RotatingFileHandler',
             'filename': BASE_DIR.parent.parent / 'logs/django.log',
             'maxBytes': LOGFILE_MAX_BYTES,
@@ -153,7 +243,7 @@ LOGGING = {
     'loggers': {
         'django': {
             'handlers': ['django'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
         },
     },
 }
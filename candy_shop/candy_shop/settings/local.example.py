@@ -13,3 +13,13 @@ DATABASES = {
 }
 
 ALLOWED_HOSTS = ['0.0.0.0']  # Add IP or domain name of the server
+
+# The cache shared by all the workers (pip install python-memcached), required
+# by the response cache, uncomment in production
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     }
+# }
+# RESPONSE_CACHE_ENABLED = True
@@ -13,8 +13,9 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 
 from rest_framework import routers
 from core import views
@@ -26,15 +27,30 @@ class OptionalSlashRouter(routers.DefaultRouter):
         self.trailing_slash = '/?'
 
 
+def read_view(view):
+    """The polling endpoints are served by async views in the ASGI profile."""
+    if settings.ASYNC_READ_VIEWS_ENABLED:
+        return views.async_read_view(view)
+    return view
+
+
 router = OptionalSlashRouter()
 router.register(r'courier_types', views.CourierTypeViewSet)
 router.register(r'couriers', views.CourierViewSet, basename='Courier')
 router.register(r'orders', views.OrderViewSet, basename='Order')
 
 urlpatterns = [
+    path('orders/import', views.OrderImportView.as_view()),
     path('orders/assign', views.OrderAssignView.as_view()),
+    path('orders/assign_batch', views.OrderAssignBatchView.as_view()),
     path('orders/complete', views.OrderCompleteView.as_view()),
-    path('couriers/<int:pk>', views.CourierDetailView.as_view()),
+    path('orders/complete_batch', views.OrderCompleteBatchView.as_view()),
+    path('couriers/import', views.CourierImportView.as_view()),
+    path('couriers/cache_stats', views.ResponseCacheStatsView.as_view()),
+    path('couriers/<int:pk>', read_view(views.CourierDetailView.as_view())),
+    re_path(r'^orders/(?P<pk>[0-9]+)/?$',
+            read_view(views.OrderViewSet.as_view({'get': 'retrieve', 'delete': 'destroy'}))),
+    path('metrics', views.MetricsView.as_view()),
     path('admin/', admin.site.urls),
     path('', include(router.urls)),
 ]
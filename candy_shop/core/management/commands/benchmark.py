@@ -0,0 +1,287 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from core.management.utils import Rollback, format_interval, percentile, random_interval
+from core.models import Courier, Order, Region, Shipment
+
+SCENARIOS = ('import', 'assign', 'complete', 'stats', 'edit')
+COURIER_TYPES = ('foot', 'bike', 'car')
+
+
+def generate_data(rnd, n_couriers, n_orders, n_regions, max_shifts=3, max_intervals=3):
+    """The couriers and the orders in the request formats of POST /couriers
+    and POST /orders, with the IDs following the existing ones. The couriers
+    work in 1-3 regions 1-`max_shifts` shifts of 1-4 hours a day, most of the
+    orders are light and have 1-`max_intervals` delivery intervals of 30-180
+    minutes.
+    """
+    courier_id = (Courier.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    order_id = (Order.all_objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    region_id = (Region.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    regions = list(range(region_id, region_id + n_regions))
+
+    couriers = [{'courier_id': i,
+                 'courier_type': rnd.choice(COURIER_TYPES),
+                 'regions': rnd.sample(regions, min(len(regions), rnd.randint(1, 3))),
+                 'working_hours': sorted({format_interval(random_interval(rnd, 60, 240))
+                                          for _ in range(rnd.randint(1, max_shifts))})}
+                for i in range(courier_id, courier_id + n_couriers)]
+    orders = [{'order_id': i,
+               # 0.01-50 kg, mostly under 5 kg
+               'weight': round(min(50, max(0.01, rnd.expovariate(1 / 2.5))), 2),
+               'region': rnd.choice(regions),
+               'delivery_hours': sorted({format_interval(random_interval(rnd, 30, 180))
+                                         for _ in range(rnd.randint(1, max_intervals))})}
+              for i in range(order_id, order_id + n_orders)]
+    return couriers, orders, regions
+
+
+class Scenario:
+    """Timings and query counts of the requests of one scenario."""
+    def __init__(self, client):
+        self.client = client
+        self.latencies, self.queries, self.errors = [], [], 0
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, data, content_type='application/json')
+            self.latencies.append((time.perf_counter() - started) * 1000)
+        self.queries.append(len(context.captured_queries))
+        if response.status_code >= 400:
+            self.errors += 1
+        return response
+
+    def result(self):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return {
+            'requests': len(latencies),
+            'errors': self.errors,
+            # The requests are made one by one
+            'rps': len(latencies) / (sum(latencies) / 1000),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1],
+            'queries_per_request': statistics.mean(self.queries),
+            'max_queries': max(self.queries),
+        }
+
+
+def run_import(client, couriers, orders, batch_size):
+    scenario = Scenario(client)
+    for i in range(0, len(couriers), batch_size):
+        scenario.request('post', '/couriers', {'data': couriers[i:i + batch_size]})
+    for i in range(0, len(orders), batch_size):
+        scenario.request('post', '/orders', {'data': orders[i:i + batch_size]})
+    return scenario
+
+
+def run_assign(client, rnd, courier_ids):
+    """Every courier asks for orders (in random order), then asks again."""
+    scenario = Scenario(client)
+    for courier_id in rnd.sample(courier_ids, len(courier_ids)) * 2:
+        scenario.request('post', '/orders/assign', {'courier_id': courier_id})
+    return scenario
+
+
+def run_complete(client, rnd, courier_ids):
+    """The assigned orders are delivered 5-60 minutes apart, in time order
+    across the couriers.
+    """
+    completions = []
+    rows = (Order.objects
+            .filter(shipment__courier__in=courier_ids, shipment__complete_time__isnull=True)
+            .values_list('shipment__courier', 'id', 'shipment__assign_time'))
+    last_times = {}
+    for courier_id, order_id, assign_time in rows:
+        last_times[courier_id] = last_times.get(courier_id, assign_time) + timedelta(minutes=rnd.randint(5, 60))
+        completions.append((last_times[courier_id], courier_id, order_id))
+
+    scenario = Scenario(client)
+    for complete_time, courier_id, order_id in sorted(completions):
+        scenario.request('post', '/orders/complete', {
+                'courier_id': courier_id, 'order_id': order_id, 'complete_time': complete_time.isoformat()})
+    return scenario
+
+
+def run_stats(client, rnd, courier_ids, n_reads):
+    """Polling of the stats of the couriers, the popular ones more often."""
+    scenario = Scenario(client)
+    weights = [1 / (i + 1) for i in range(len(courier_ids))]
+    for courier_id in rnd.choices(courier_ids, weights=weights, k=n_reads):
+        scenario.request('get', f'/couriers/{courier_id}')
+    return scenario
+
+
+def run_edit(client, rnd, courier_ids, regions, n_edits):
+    """Random changes of the type, the regions or the working hours."""
+    scenario = Scenario(client)
+    for courier_id in rnd.choices(courier_ids, k=n_edits):
+        change = rnd.choice(('courier_type', 'regions', 'working_hours'))
+        if change == 'courier_type':
+            data = {'courier_type': rnd.choice(COURIER_TYPES)}
+        elif change == 'regions':
+            data = {'regions': rnd.sample(regions, min(len(regions), rnd.randint(1, 3)))}
+        else:
+            data = {'working_hours': sorted({format_interval(random_interval(rnd, 60, 240))
+                                             for _ in range(rnd.randint(1, 3))})}
+        scenario.request('patch', f'/couriers/{courier_id}', data)
+    return scenario
+
+
+def merge_runs(runs):
+    """The median of every metric of every scenario over the repeated runs
+    (the most of the errors), so a slow run doesn't fail the comparison.
+    """
+    merged = {}
+    for name, result in runs[0].items():
+        results = [run[name] for run in runs if run[name]]
+        if not results:
+            merged[name] = None
+            continue
+        merged[name] = {metric: statistics.median(r[metric] for r in results) for metric in result}
+        merged[name]['errors'] = max(r['errors'] for r in results)
+    return merged
+
+
+PERCENTILES = {'p50_ms': 50, 'p95_ms': 95, 'p99_ms': 99}
+
+
+def compare(results, baseline, thresholds, min_tail_samples=10):
+    """Return the regressions [(scenario, metric, baseline, current), ...]:
+    the latency percentiles and the query counts grown by more than their
+    thresholds (relative), the throughput dropped by more than its one. A
+    percentile is only compared if at least `min_tail_samples` requests of
+    both runs are above it, e.g. the p99 of 40 requests is just the slowest.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not result or not base:
+            continue
+        for metric, p in PERCENTILES.items():
+            if min(result['requests'], base['requests']) * (100 - p) / 100 < min_tail_samples:
+                continue
+            if result[metric] > base[metric] * (1 + thresholds['latency']):
+                regressions.append((name, metric, base[metric], result[metric]))
+        if result['rps'] < base['rps'] * (1 - thresholds['throughput']):
+            regressions.append((name, 'rps', base['rps'], result['rps']))
+        for metric in ('queries_per_request', 'max_queries'):
+            if result[metric] > base[metric] * (1 + thresholds['queries']):
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Runs the import, assign, complete, stats and edit scenarios through the API on a '
+            'generated dataset (rolled back afterwards), reports the throughput, latency '
+            'percentiles and query counts and compares them with a baseline run')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--couriers', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--regions', type=int, default=20)
+        parser.add_argument('--max-shifts', type=int, default=3, help='Maximum shifts per courier')
+        parser.add_argument('--max-intervals', type=int, default=3, help='Maximum delivery intervals per order')
+        parser.add_argument('--batch-size', type=int, default=100, help='Couriers and orders per import request')
+        parser.add_argument('--reads', type=int, default=2000, help='Stats requests')
+        parser.add_argument('--edits', type=int, default=200, help='Courier edit requests')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                            help='The import runs anyway, the data is needed by the others')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs on the same dataset, the median of every metric is reported')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file to record the results to')
+        parser.add_argument('--baseline', help='JSON file of the run to compare with')
+        parser.add_argument('--latency-threshold', type=float, default=0.25,
+                            help='Allowed relative growth of the latency percentiles')
+        parser.add_argument('--throughput-threshold', type=float, default=0.25,
+                            help='Allowed relative drop of the throughput')
+        parser.add_argument('--queries-threshold', type=float, default=0,
+                            help='Allowed relative growth of the query counts')
+        parser.add_argument('--min-tail-samples', type=int, default=10,
+                            help='Requests above a latency percentile needed to compare it')
+
+    def handle(self, *args, **options):
+        if min(options['couriers'], options['orders'], options['regions'], options['batch_size'],
+               options['repeat']) < 1:
+            raise CommandError('--couriers, --orders, --regions, --batch-size and --repeat must be positive.')
+
+        scenarios = options['scenarios']
+        run_results = []
+        # The requests are made in-process by the test client. The runs are
+        # rolled back, so the on_commit bumps of the response cache would
+        # never run
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], RESPONSE_CACHE_ENABLED=False):
+            for _ in range(options['repeat']):
+                # Every run gets the same dataset
+                rnd = random.Random(options['seed'])
+                results = {}
+                try:
+                    with transaction.atomic():
+                        client = Client()
+                        couriers, orders, regions = generate_data(
+                                rnd, options['couriers'], options['orders'], options['regions'],
+                                max_shifts=options['max_shifts'], max_intervals=options['max_intervals'])
+                        courier_ids = [courier['courier_id'] for courier in couriers]
+
+                        runs = {
+                                'import': lambda: run_import(client, couriers, orders, options['batch_size']),
+                                'assign': lambda: run_assign(client, rnd, courier_ids),
+                                'complete': lambda: run_complete(client, rnd, courier_ids),
+                                'stats': lambda: run_stats(client, rnd, courier_ids, options['reads']),
+                                'edit': lambda: run_edit(client, rnd, courier_ids, regions, options['edits'])}
+                        for name in SCENARIOS:
+                            if name in scenarios or name == 'import':
+                                scenario = runs[name]()
+                                if name in scenarios:
+                                    results[name] = scenario.result()
+                        n_shipments = Shipment.objects.filter(courier__in=courier_ids).count()
+                        raise Rollback
+                except Rollback:
+                    pass
+                run_results.append(results)
+        results = merge_runs(run_results)
+
+        self.stdout.write(f'{"scenario":>9} {"requests":>8} {"errors":>6} {"rps":>8} {"p50 ms":>7} '
+                          f'{"p95 ms":>7} {"p99 ms":>7} {"queries":>7}')
+        for name, result in results.items():
+            if result:
+                self.stdout.write(
+                        f'{name:>9} {result["requests"]:>8} {result["errors"]:>6} {result["rps"]:>8.1f} '
+                        f'{result["p50_ms"]:>7.2f} {result["p95_ms"]:>7.2f} {result["p99_ms"]:>7.2f} '
+                        f'{result["queries_per_request"]:>7.1f}')
+        self.stdout.write(f'{n_shipments} shipments assigned')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                recorded_options = {k: options[k] for k in (
+                        'couriers', 'orders', 'regions', 'max_shifts', 'max_intervals', 'batch_size',
+                        'reads', 'edits', 'repeat', 'seed')}
+                json.dump({'vendor': connection.vendor, 'options': recorded_options, 'results': results},
+                          f, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline['results'], {
+                    'latency': options['latency_threshold'],
+                    'throughput': options['throughput_threshold'],
+                    'queries': options['queries_threshold']}, min_tail_samples=options['min_tail_samples'])
+            for name, metric, base, current in regressions:
+                self.stderr.write(f'{name}: {metric} {base:.2f} -> {current:.2f}')
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
@@ -0,0 +1,71 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from core.management.utils import random_interval
+from core.services.courier import GreedyPackingStrategy, KnapsackPackingStrategy
+
+
+def generate_pool(rnd, n_orders, max_weight):
+    """Synthetic candidates {order_id: (weight, [(start, end), ...])}."""
+    pool = {}
+    for order_id in range(1, n_orders + 1):
+        weight = Decimal(rnd.randrange(1, int(max_weight * 100) + 1)) / 100
+        intervals = [random_interval(rnd, 30, 180) for _ in range(rnd.randint(1, 3))]
+        pool[order_id] = (weight, intervals)
+    return pool
+
+
+def generate_shifts(rnd, n_shifts):
+    shifts = sorted(random_interval(rnd, 60, 240) for _ in range(n_shifts))
+    return [{'start': start, 'end': end} for start, end in shifts]
+
+
+def suitable_candidates(pool, capacity, shifts):
+    return {order_id: (weight, intervals)
+            for order_id, (weight, intervals) in pool.items()
+            if weight <= capacity and any(start < shift['end'] and end > shift['start']
+                                          for start, end in intervals
+                                          for shift in shifts)}
+
+
+class Command(BaseCommand):
+    help = 'Compares speed and utilisation of the packing strategies on synthetic pools of orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10000, help='Orders in the pool')
+        parser.add_argument('--runs', type=int, default=20, help='Couriers packed per capacity')
+        parser.add_argument('--max-weight', type=Decimal, default=Decimal('10'),
+                            help='Maximum order weight in kilograms')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        pool = generate_pool(rnd, options['orders'], options['max_weight'])
+        strategies = {
+            'greedy': GreedyPackingStrategy(),
+            'knapsack': KnapsackPackingStrategy(),
+        }
+
+        self.stdout.write(f'{"capacity":>8} {"strategy":>10} {"ms/bag":>8} {"orders":>7} {"utilisation":>11}')
+        for capacity in (Decimal('10'), Decimal('15'), Decimal('50')):
+            couriers = []
+            for _ in range(options['runs']):
+                shifts = generate_shifts(rnd, rnd.randint(1, 3))
+                couriers.append((shifts, suitable_candidates(pool, capacity, shifts)))
+
+            for name, strategy in strategies.items():
+                elapsed, n_orders, weight = 0, 0, 0
+                for shifts, candidates in couriers:
+                    started = time.perf_counter()
+                    bag = strategy.pack(capacity, shifts, candidates)
+                    elapsed += time.perf_counter() - started
+                    n_orders += len(bag)
+                    weight += sum(bag.values())
+
+                runs = len(couriers)
+                self.stdout.write(
+                        f'{capacity:>8} {name:>10} {elapsed / runs * 1000:>8.1f} '
+                        f'{n_orders / runs:>7.1f} {weight / runs / capacity:>11.2%}')
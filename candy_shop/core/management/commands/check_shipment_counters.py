@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from core.models import Shipment
+from core.services.courier import SHIPMENT_COUNTERS, get_expected_shipment_counters
+from core.services.response_cache import invalidate_courier_responses
+
+
+@transaction.atomic
+def check_batch(shipment_ids, fix):
+    """Compare the stored counters of the shipments with the ones calculated
+    from the orders. Return [(shipment_id, stored, expected), ...] of the
+    drifted ones.
+    """
+    # Locked before the orders are counted: a concurrent completion updates
+    # the shipment's counters, so it's either seen by both or by neither
+    stored = {row.pop('id'): row
+              for row in (Shipment.objects
+                          .select_for_update()
+                          .filter(id__in=shipment_ids)
+                          .values('id', 'courier', *SHIPMENT_COUNTERS))}
+    expected = get_expected_shipment_counters(shipment_ids)
+    drift = [(shipment_id, stored[shipment_id], expected[shipment_id])
+             for shipment_id in shipment_ids
+             if shipment_id in stored and any(
+                 stored[shipment_id][c] != expected[shipment_id][c] for c in SHIPMENT_COUNTERS)]
+    if fix:
+        for shipment_id, _, counters in drift:
+            Shipment.objects.filter(id=shipment_id).update(**counters, version=F('version') + 1)
+        invalidate_courier_responses({row['courier'] for _, row, _ in drift})
+    return drift
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the shipment counters from the orders and reports (and fixes) the drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Fix the drifted counters')
+        parser.add_argument('--active', action='store_true', help='Only check the shipments in progress')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        shipments = Shipment.objects.order_by('id')
+        if options['active']:
+            shipments = shipments.filter(complete_time__isnull=True)
+        shipment_ids = list(shipments.values_list('id', flat=True))
+
+        n_drifted = 0
+        for i in range(0, len(shipment_ids), options['batch_size']):
+            drift = check_batch(shipment_ids[i:i + options['batch_size']], options['fix'])
+            for shipment_id, stored, expected in drift:
+                stored = ', '.join(f'{c}={stored[c]}' for c in SHIPMENT_COUNTERS)
+                expected = ', '.join(f'{c}={expected[c]}' for c in SHIPMENT_COUNTERS)
+                self.stdout.write(f'Shipment({shipment_id}): stored {stored}, expected {expected}')
+            n_drifted += len(drift)
+
+        action = 'fixed' if options['fix'] else 'found'
+        self.stdout.write(self.style.SUCCESS(
+                f'{len(shipment_ids)} shipments checked, drift {action} for {n_drifted}'))
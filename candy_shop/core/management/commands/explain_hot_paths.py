@@ -0,0 +1,166 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.utils import timezone
+
+from core.management.utils import Rollback, random_interval
+from core.models import (
+        Courier, CourierRegion, CourierWorkShift, Order, OrderDeliveryInterval, Region, Shipment)
+from core.services.bulk import bulk_insert
+from core.services.courier import _get_courier_snapshot
+
+
+def generate_dataset(rnd, n_couriers, n_shipments, n_pool, n_regions=100):
+    """Couriers with the history of completed shipments (three delivered
+    orders each), every other one with a shipment in progress, and the pool
+    of not assigned yet orders. Most of the orders are delivered, as they are
+    in production.
+    """
+    order_id = (Order.all_objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    shipment_id = (Shipment.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    courier_id = (Courier.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    region_id = (Region.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    now = timezone.now()
+
+    regions = list(range(region_id, region_id + n_regions))
+    bulk_insert(Region(id=i) for i in regions)
+
+    couriers, courier_regions, shifts, shipments, orders = [], [], [], [], []
+    for courier_id in range(courier_id, courier_id + n_couriers):
+        courier_type = rnd.choice(('foot', 'bike', 'car'))
+        couriers.append(Courier(id=courier_id, type_id=courier_type))
+        courier_regions += [CourierRegion(courier_id=courier_id, region_id=i)
+                            for i in rnd.sample(regions, rnd.randint(1, 3))]
+        shifts += [CourierWorkShift(courier_id=courier_id, start=start, end=end)
+                   for start, end in {random_interval(rnd, 60, 240) for _ in range(rnd.randint(1, 2))}]
+
+        for i in range(n_shipments + courier_id % 2):
+            assign_time = now - timedelta(days=n_shipments - i)
+            is_active = i == n_shipments
+            shipment = Shipment(
+                    id=shipment_id, courier_id=courier_id, initial_courier_type_id=courier_type,
+                    assign_time=assign_time,
+                    complete_time=None if is_active else assign_time + timedelta(hours=3))
+            for j in range(3):
+                complete_time = None if is_active and j else assign_time + timedelta(hours=j + 1)
+                order = Order(id=order_id, weight=Decimal(rnd.randrange(1, 500)) / 100,
+                              region_id=rnd.choice(regions), shipment_id=shipment_id,
+                              complete_time=complete_time)
+                shipment.order_count += 1
+                shipment.total_weight += order.weight
+                if not complete_time:
+                    shipment.remaining_count += 1
+                    shipment.remaining_weight += order.weight
+                orders.append(order)
+                order_id += 1
+            shipments.append(shipment)
+            shipment_id += 1
+
+    for order_id in range(order_id, order_id + n_pool):
+        orders.append(Order(id=order_id, weight=Decimal(rnd.randrange(1, 5000)) / 100,
+                            region_id=rnd.choice(regions)))
+
+    bulk_insert(couriers)
+    bulk_insert(courier_regions)
+    bulk_insert(shifts)
+    bulk_insert(shipments)
+    bulk_insert(orders)
+    bulk_insert(OrderDeliveryInterval(order_id=order.id, start=start, end=end)
+                for order in orders
+                for start, end in {random_interval(rnd, 30, 180) for _ in range(rnd.randint(1, 2))})
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def get_hot_path_queries(rnd):
+    """[(name, queryset, index names the plan must use), ...] built the way
+    the service functions build them.
+    """
+    active_shipment = rnd.choice(list(Shipment.objects.filter(complete_time__isnull=True)[:100]))
+    courier = Courier.objects.select_related('type').get(id=active_shipment.courier_id)
+    snapshot = _get_courier_snapshot(courier)
+
+    return [
+        # assign_orders: the candidates from the pool
+        ('candidates',
+         Order.objects.not_assigned_yet().suitable_for_courier_shifts(
+             capacity=snapshot['capacity'], region_ids=snapshot['region_ids'],
+             shifts=snapshot['shifts']),
+         {'order_not_assigned_idx', 'interval_order_range_idx'}),
+        # assign_orders and edit_courier: Courier.active_shipment
+        ('active_shipment',
+         courier.shipments.filter(complete_time__isnull=True).order_by('-pk')[:1],
+         {'shipment_active_idx'}),
+        # assign_orders and complete_order: the undelivered orders of the shipment
+        ('undelivered_orders',
+         Order.objects.filter(shipment=active_shipment).not_delivered_yet(),
+         {'order_shipment_complete_idx'}),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Generates a large dataset (rolled back afterwards), EXPLAINs the hot path queries, '
+            'checks they use the indexes and times them. The indexes are designed for '
+            'PostgreSQL planner, on other databases the missing ones are only reported')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--couriers', type=int, default=2000)
+        parser.add_argument('--shipments', type=int, default=20, help='Completed shipments per courier')
+        parser.add_argument('--pool', type=int, default=5000, help='Not assigned yet orders')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of every query')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file to record the plans and the timings to')
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        results = []
+        # The transaction is rolled back, so its on_commit bumps of the
+        # response cache would never run
+        try:
+            with override_settings(RESPONSE_CACHE_ENABLED=False), transaction.atomic():
+                generate_dataset(rnd, options['couriers'], options['shipments'], options['pool'])
+                for name, queryset, indexes in get_hot_path_queries(rnd):
+                    plan = queryset.explain()
+                    timings = []
+                    for _ in range(options['repeat']):
+                        started = time.perf_counter()
+                        list(queryset.all())
+                        timings.append((time.perf_counter() - started) * 1000)
+                    results.append({
+                        'query': name,
+                        'plan': plan,
+                        'missing_indexes': sorted(i for i in indexes if i not in plan),
+                        'min_ms': min(timings),
+                        'median_ms': statistics.median(timings),
+                    })
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'{"query":>20} {"min ms":>8} {"median ms":>10}  missing indexes')
+        for result in results:
+            self.stdout.write(
+                    f'{result["query"]:>20} {result["min_ms"]:>8.2f} {result["median_ms"]:>10.2f}  '
+                    f'{", ".join(result["missing_indexes"]) or "-"}')
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                recorded_options = {k: options[k] for k in ('couriers', 'shipments', 'pool', 'repeat', 'seed')}
+                json.dump({'vendor': connection.vendor, 'options': recorded_options, 'results': results},
+                          f, indent=2)
+
+        failed = [result['query'] for result in results if result['missing_indexes']]
+        if failed and connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(f'The indexes are not used by: {", ".join(failed)}'))
+        elif failed:
+            for result in results:
+                if result['missing_indexes']:
+                    self.stderr.write(f'{result["query"]}:\n{result["plan"]}')
+            raise CommandError(f'The indexes are not used by: {", ".join(failed)}')
@@ -0,0 +1,39 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.parsers import iter_ndjson
+from core.serializers.importing import IMPORTERS, import_records
+
+
+class Command(BaseCommand):
+    help = 'Imports couriers or orders from a newline delimited JSON file in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help='Path to the file, "-" for stdin')
+        parser.add_argument('--chunk-size', type=int, default=settings.NDJSON_IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+
+        if options['path'] == '-':
+            self._import(options['kind'], sys.stdin, options['chunk_size'])
+        else:
+            with open(options['path'], encoding='utf-8') as f:
+                self._import(options['kind'], f, options['chunk_size'])
+
+    def _import(self, kind, lines, chunk_size):
+        report = None
+        for report in import_records(kind=kind, records=iter_ndjson(lines), chunk_size=chunk_size):
+            self.stdout.write(
+                    f'Chunk {report["chunk"]}: {report["created"]} created, '
+                    f'{len(report["failed"])} failed')
+            if report['failed']:
+                failed_ids = ', '.join(str(i['id']) for i in report['failed'])
+                self.stderr.write(f'Failed IDs: {failed_ids}')
+        if report:
+            self.stdout.write(self.style.SUCCESS(
+                    f'Total: {report["total_created"]} created, {report["total_failed"]} failed'))
@@ -0,0 +1,114 @@
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.management.utils import percentile
+from core.models import Courier, Order
+
+
+def poll(url, paths, concurrency, duration, seed=0):
+    """Poll the `paths` of the server at `url` from `concurrency` threads (a
+    keep-alive connection each) for `duration` seconds. Return the numbers of
+    the requests and the errors, the throughput and the latency percentiles.
+    """
+    parts = urlsplit(url)
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(i):
+        rnd = random.Random(seed * 1000 + i)
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        local_latencies, local_errors = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request('GET', parts.path.rstrip('/') + rnd.choice(paths))
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    local_errors += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                connection.close()
+                continue
+            local_latencies.append((time.perf_counter() - started) * 1000)
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1] if latencies else None,
+    }
+
+
+class Command(BaseCommand):
+    help = ('Polls GET /couriers/<id> and GET /orders/<id> of a running server at the given '
+            'concurrency levels and reports the throughput and the latency, e.g. to compare '
+            'the ASGI profile with the WSGI one (--baseline)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64],
+                            help='Concurrent clients, a run for every level')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of every run')
+        parser.add_argument('--ids', type=int, default=1000, help='Couriers and orders to poll')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file to record the results to')
+        parser.add_argument('--baseline', help='JSON file of the run to compare with')
+
+    def handle(self, *args, **options):
+        if min(options['concurrency']) < 1 or options['duration'] <= 0:
+            raise CommandError('--concurrency and --duration must be positive.')
+
+        # The server must use the same database
+        paths = ([f'/couriers/{i}' for i in Courier.objects.order_by('?').values_list('id', flat=True)[:options['ids']]]
+                 + [f'/orders/{i}' for i in Order.objects.order_by('?').values_list('id', flat=True)[:options['ids']]])
+        if not paths:
+            raise CommandError('There are no couriers and orders to poll.')
+
+        results = [poll(options['url'], paths, concurrency, options['duration'], seed=options['seed'])
+                   for concurrency in options['concurrency']]
+
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = {r['concurrency']: r for r in json.load(f)['results']}
+
+        self.stdout.write(f'{"clients":>8} {"requests":>9} {"errors":>7} {"rps":>9} {"p50 ms":>8} {"p99 ms":>8}'
+                          + ('  vs baseline' if baseline else ''))
+        for result in results:
+            line = (f'{result["concurrency"]:>8} {result["requests"]:>9} {result["errors"]:>7} '
+                    f'{result["rps"]:>9.1f} {result["p50_ms"] or 0:>8.2f} {result["p99_ms"] or 0:>8.2f}')
+            base = baseline.get(result['concurrency'])
+            if base and base['rps'] and base['p99_ms'] and result['p99_ms']:
+                line += (f'  rps x{result["rps"] / base["rps"]:.2f}, '
+                         f'p99 {result["p99_ms"] - base["p99_ms"]:+.2f} ms')
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                recorded_options = {k: options[k] for k in ('url', 'concurrency', 'duration', 'ids', 'seed')}
+                json.dump({'options': recorded_options, 'results': results}, f, indent=2)
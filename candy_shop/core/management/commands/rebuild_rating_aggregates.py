@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Courier
+from core.services.courier import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = ('Recalculates the delivery durations the courier rating is based on from the orders '
+            'and reports (and fixes) the drifted ones')
+
+    def add_arguments(self, parser):
+        parser.add_argument('courier_ids', nargs='*', type=int, help='All the couriers by default')
+        parser.add_argument('--check', action='store_true', help='Only report the drift, do not fix it')
+
+    def handle(self, *args, **options):
+        couriers = Courier.objects.order_by('id')
+        if options['courier_ids']:
+            couriers = couriers.filter(id__in=options['courier_ids'])
+
+        n_couriers, n_drifted = 0, 0
+        for courier in couriers.iterator():
+            drifted_region_ids = rebuild_rating_aggregates(courier, dry_run=options['check'])
+            n_couriers += 1
+            if drifted_region_ids:
+                n_drifted += 1
+                self.stdout.write(f'Courier({courier.id}): drifted in regions {drifted_region_ids}')
+
+        action = 'found' if options['check'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+                f'{n_couriers} couriers checked, drift {action} for {n_drifted}'))
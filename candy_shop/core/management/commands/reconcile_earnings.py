@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+
+from core.models import Courier
+from core.services.courier import get_expected_earnings
+from core.services.response_cache import invalidate_courier_responses
+
+
+@transaction.atomic
+def reconcile_batch(courier_ids, fix):
+    """Compare the stored earnings of the couriers with the ones calculated
+    from the shipments. Return [(courier_id, stored, expected), ...] of the
+    drifted ones.
+    """
+    # Locked before the shipments are read: a concurrent completion closing a
+    # shipment updates the courier's earnings, so it's either seen by both or
+    # by neither
+    stored = dict(Courier.objects
+                  .select_for_update()
+                  .filter(id__in=courier_ids)
+                  .values_list('id', 'earnings'))
+    expected = get_expected_earnings(courier_ids)
+    drift = [(courier_id, stored[courier_id], expected[courier_id])
+             for courier_id in courier_ids
+             if courier_id in stored and stored[courier_id] != expected[courier_id]]
+    if fix:
+        for courier_id, _, earnings in drift:
+            Courier.objects.filter(id=courier_id).update(earnings=earnings, version=F('version') + 1)
+        invalidate_courier_responses(courier_id for courier_id, _, _ in drift)
+    return drift
+
+
+def reconcile_batch_in_thread(courier_ids, fix):
+    try:
+        return reconcile_batch(courier_ids, fix)
+    finally:
+        # Every thread opens its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the couriers earnings from the completed shipments and reports (and fixes) the drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Fix the drifted earnings')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=4, help='Batches processed in parallel')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive.')
+
+        courier_ids = list(Courier.objects.order_by('id').values_list('id', flat=True))
+        batches = [courier_ids[i:i + options['batch_size']]
+                   for i in range(0, len(courier_ids), options['batch_size'])]
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                drifts = list(executor.map(
+                        lambda batch: reconcile_batch_in_thread(batch, options['fix']), batches))
+        else:
+            drifts = [reconcile_batch(batch, options['fix']) for batch in batches]
+
+        n_drifted = 0
+        for drift in drifts:
+            for courier_id, stored, expected in drift:
+                self.stdout.write(f'Courier({courier_id}): stored {stored}, expected {expected}')
+            n_drifted += len(drift)
+
+        action = 'fixed' if options['fix'] else 'found'
+        self.stdout.write(self.style.SUCCESS(
+                f'{len(courier_ids)} couriers checked, drift {action} for {n_drifted}'))
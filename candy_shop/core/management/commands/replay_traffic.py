@@ -0,0 +1,185 @@
+import http.client
+import json
+import queue
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.management.utils import percentile
+from core.services.traffic import read_records
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_route(path):
+    return re.sub(r'/\d+', '/{id}', path)
+
+
+def _strip(value, ignored_fields):
+    if isinstance(value, dict):
+        return {k: _strip(v, ignored_fields) for k, v in value.items() if k not in ignored_fields}
+    if isinstance(value, list):
+        return [_strip(v, ignored_fields) for v in value]
+    return value
+
+
+def replay(records, url, concurrency, speed, think_time):
+    """Send the recorded requests to the server at `url`: at their recorded
+    times compressed `speed` times (as fast as possible with 0), by
+    `concurrency` clients pausing `think_time` seconds after every request.
+    Return [(record, status, body, latency_ms, lag_ms), ...] in the order of
+    the records.
+    """
+    parts = urlsplit(url)
+    requests = queue.Queue()
+    results = [None] * len(records)
+
+    def worker():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        while True:
+            item = requests.get()
+            if item is None:
+                break
+            i, due = item
+            record = records[i]
+            body = record['request_body']
+            if body is not None and not isinstance(body, str):
+                body = json.dumps(body)
+            path = parts.path.rstrip('/') + record['path'] + (f'?{record["query"]}' if record['query'] else '')
+            headers = {'Content-Type': record['content_type']} if record['content_type'] else {}
+
+            started = time.perf_counter()
+            lag = (time.monotonic() - due) * 1000 if due is not None else 0
+            try:
+                connection.request(record['method'], path, body=body, headers=headers)
+                response = connection.getresponse()
+                status, content = response.status, response.read()
+                content_type = response.getheader('Content-Type', '')
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status, content, content_type = None, b'', ''
+            latency = (time.perf_counter() - started) * 1000
+
+            if content_type.startswith('application/json'):
+                try:
+                    content = json.loads(content)
+                except ValueError:
+                    pass
+            results[i] = (record, status, content, latency, lag)
+            if think_time:
+                time.sleep(think_time)
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    started, first_ts = time.monotonic(), records[0]['ts']
+    for i, record in enumerate(records):
+        due = None
+        if speed:
+            due = started + (record['ts'] - first_ts) / speed
+            time.sleep(max(0, due - time.monotonic()))
+        requests.put((i, due))
+    for _ in threads:
+        requests.put(None)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def report(results, ignored_fields, n_examples=5):
+    """The divergence of the replayed responses from the recorded ones and
+    the latencies of both, by route.
+    """
+    routes = defaultdict(lambda: {'requests': 0, 'errors': 0, 'status_diverged': 0, 'body_diverged': 0,
+                                  'recorded_ms': [], 'replayed_ms': [], 'lag_ms': []})
+    examples = []
+    for record, status, body, latency, lag in results:
+        route = routes[f'{record["method"]} {get_route(record["path"])}']
+        route['requests'] += 1
+        route['recorded_ms'].append(record['duration_ms'])
+        route['replayed_ms'].append(latency)
+        route['lag_ms'].append(lag)
+        if status is None:
+            route['errors'] += 1
+            continue
+
+        diverged = None
+        if status != record['status']:
+            route['status_diverged'] += 1
+            diverged = 'status'
+        elif (not record['response_body_truncated'] and record['response_body'] is not None
+                and _strip(body, ignored_fields) != _strip(record['response_body'], ignored_fields)):
+            route['body_diverged'] += 1
+            diverged = 'body'
+        if diverged and len(examples) < n_examples:
+            examples.append({'method': record['method'], 'path': record['path'], 'diverged': diverged,
+                             'recorded': [record['status'], record['response_body']],
+                             'replayed': [status, body]})
+
+    for route in routes.values():
+        for key in ('recorded_ms', 'replayed_ms', 'lag_ms'):
+            values = sorted(route.pop(key))
+            prefix = key[:-3]
+            route[f'{prefix}_p50_ms'] = percentile(values, 50)
+            route[f'{prefix}_p99_ms'] = percentile(values, 99)
+    return dict(sorted(routes.items())), examples
+
+
+class Command(BaseCommand):
+    help = ('Replays the captured API traffic (TRAFFIC_CAPTURE_ENABLED) against a running instance '
+            'and reports the divergence of the responses and the latency from the recorded ones')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Capture files or directories')
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--speed', type=float, default=1,
+                            help='Time compression: 10 replays an hour in 6 minutes, 0 as fast as possible')
+        parser.add_argument('--think-time', type=float, default=0,
+                            help='Seconds every client pauses after a request')
+        parser.add_argument('--read-only', action='store_true', help=f'Replay only {", ".join(SAFE_METHODS)}')
+        parser.add_argument('--ignore-field', action='append', default=['assign_time'], dest='ignored_fields',
+                            help='Response field not compared (repeatable), assign_time by default')
+        parser.add_argument('--output', help='JSON file to record the report to')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['speed'] < 0 or options['think_time'] < 0:
+            raise CommandError('--concurrency must be positive, --speed and --think-time not negative.')
+
+        records, skipped = [], []
+        for record in read_records(options['paths']):
+            if record['request_body_truncated'] or (options['read_only'] and record['method'] not in SAFE_METHODS):
+                skipped.append(record)
+            else:
+                records.append(record)
+        if not records:
+            raise CommandError('There are no records to replay.')
+
+        started = time.monotonic()
+        results = replay(records, options['url'], options['concurrency'], options['speed'], options['think_time'])
+        elapsed = time.monotonic() - started
+        routes, examples = report(results, set(options['ignored_fields']))
+
+        self.stdout.write(f'{"route":>32} {"requests":>8} {"errors":>6} {"status":>6} {"body":>6} '
+                          f'{"p50 ms":>15} {"p99 ms":>15}')
+        for name, route in routes.items():
+            self.stdout.write(
+                    f'{name:>32} {route["requests"]:>8} {route["errors"]:>6} {route["status_diverged"]:>6} '
+                    f'{route["body_diverged"]:>6} '
+                    f'{route["recorded_p50_ms"]:>7.1f}>{route["replayed_p50_ms"]:<7.1f} '
+                    f'{route["recorded_p99_ms"]:>7.1f}>{route["replayed_p99_ms"]:<7.1f}')
+        self.stdout.write(f'{len(records)} requests replayed in {elapsed:.1f} s '
+                          f'({len(records) / elapsed:.1f} rps), {len(skipped)} skipped')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                recorded_options = {k: options[k] for k in (
+                        'url', 'concurrency', 'speed', 'think_time', 'read_only', 'ignored_fields')}
+                json.dump({'options': recorded_options, 'replayed': len(records), 'skipped': len(skipped),
+                           'seconds': elapsed, 'routes': routes, 'examples': examples}, f, indent=2)
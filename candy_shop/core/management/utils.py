@@ -0,0 +1,26 @@
+"""Helpers shared by the measuring commands."""
+from datetime import time
+
+
+class Rollback(Exception):
+    """Raised at the end of the atomic block to roll the generated data back."""
+
+
+def random_interval(rnd, min_minutes, max_minutes):
+    """A random (start, end) of `min_minutes`-`max_minutes` between 6:00 and 22:00."""
+    start = rnd.randrange(6 * 60, 22 * 60 - max_minutes)
+    end = start + rnd.randrange(min_minutes, max_minutes)
+    return time(start // 60, start % 60), time(end // 60, end % 60)
+
+
+def format_interval(interval):
+    """The interval in the format of the API: 'HH:MM-HH:MM'."""
+    start, end = interval
+    return f'{start:%H:%M}-{end:%H:%M}'
+
+
+def percentile(sorted_values, p):
+    """The `p`th percentile of the sorted values, None if there are none."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
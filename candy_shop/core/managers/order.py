@@ -1,4 +1,8 @@
+from functools import reduce
+from operator import or_
+
 from django.db import models
+from django.db.models import Q
 
 
 class OrderQueryset(models.QuerySet):
@@ -16,3 +20,18 @@ class OrderQueryset(models.QuerySet):
                     .filter(region__in=region_ids)
                     .filter(delivery_intervals__start__lt=shift_end,
                             delivery_intervals__end__gt=shift_start))
+
+    def suitable_for_courier_shifts(self, capacity, region_ids, shifts):
+        """Orders suitable for any of the courier's shifts together with the
+        delivery intervals that overlap them, one row per such interval:
+        (order_id, weight, interval_start, interval_end).
+        """
+        overlaps_any_shift = reduce(or_, (
+                Q(delivery_intervals__start__lt=shift['end'],
+                  delivery_intervals__end__gt=shift['start'])
+                for shift in shifts), Q(pk__in=[]))
+        return (self.exclude(weight__gt=capacity)
+                    .filter(region__in=region_ids)
+                    .filter(overlaps_any_shift)
+                    .values_list('id', 'weight', 'delivery_intervals__start',
+                                 'delivery_intervals__end'))
@@ -0,0 +1,125 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core.routers import pinned_to_primary
+from core.services.metrics import collect_request_stats, registry
+from core.services.traffic import sanitize_body, write_record
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaStickinessMiddleware:
+    """Pin the client's reads to the primary database for
+    `REPLICA_STICKINESS_SECONDS` after its successful write. The client is
+    recognized by the cookie holding the end of the window, set on the
+    response to the write.
+    """
+    cookie_name = 'primary_until'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def __call__(self, request):
+        if not getattr(settings, 'DATABASE_REPLICAS', []):
+            return self.get_response(request)
+
+        if self.is_pinned(request):
+            with pinned_to_primary():
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            seconds = getattr(settings, 'REPLICA_STICKINESS_SECONDS', 5)
+            response.set_cookie(self.cookie_name, f'{time.time() + seconds:.3f}', max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class MetricsMiddleware:
+    """Record the latency, the number and the time of the database queries,
+    the rendering time and the response size of every request by URL route,
+    see `core.services.metrics`. Should be the first middleware to see the
+    whole request.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with collect_request_stats() as stats:
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        labels = {'route': match.route if match else '<unmatched>', 'method': request.method}
+        registry.inc('candy_shop_http_requests_total', {**labels, 'status': response.status_code})
+        registry.observe('candy_shop_http_request_duration_seconds', labels, duration)
+        registry.observe('candy_shop_http_db_queries', labels, stats.queries)
+        registry.observe('candy_shop_http_db_duration_seconds', labels, stats.db_time)
+        registry.observe('candy_shop_http_render_duration_seconds', labels, stats.render_time)
+        if not response.streaming:
+            registry.observe('candy_shop_http_response_size_bytes', labels, len(response.content))
+        registry.flush()
+        return response
+
+
+class TrafficCaptureMiddleware:
+    """Record the sampled (`TRAFFIC_CAPTURE_SAMPLE_RATE`) API requests and
+    their responses for the replays, see `core.services.traffic`. Only used
+    with `TRAFFIC_CAPTURE_ENABLED`.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'TRAFFIC_CAPTURE_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'TRAFFIC_CAPTURE_SAMPLE_RATE', 1)
+        self.max_body_bytes = getattr(settings, 'TRAFFIC_CAPTURE_MAX_BODY_BYTES', 64 * 1024)
+        self.excluded_paths = tuple(getattr(settings, 'TRAFFIC_CAPTURE_EXCLUDED_PATHS', []))
+
+    def __call__(self, request):
+        if request.path.startswith(self.excluded_paths) or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        # The large bodies (e.g. the streaming imports) aren't read into memory,
+        # nor those of unknown length (a chunked upload has no Content-Length)
+        content_type = request.META.get('CONTENT_TYPE', '')
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = None
+        if 'HTTP_TRANSFER_ENCODING' in request.META:
+            content_length = None
+        request_body_truncated = content_length is None or content_length > self.max_body_bytes
+        request_body = None if request_body_truncated else sanitize_body(request.body, content_type)
+
+        ts = time.time()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        response_body_truncated = response.streaming or len(response.content) > self.max_body_bytes
+        write_record({
+            'ts': ts,
+            'method': request.method,
+            'path': request.path,
+            'query': request.META.get('QUERY_STRING', ''),
+            'content_type': content_type,
+            'request_body': request_body,
+            'request_body_truncated': request_body_truncated,
+            'status': response.status_code,
+            'response_body': None if response_body_truncated else sanitize_body(
+                    response.content, response.get('Content-Type', '')),
+            'response_body_truncated': response_body_truncated,
+            'duration_ms': duration * 1000,
+        })
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_auto_20210320_1701'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourierRegionDurations',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('duration_sum', models.BigIntegerField(default=0)),
+                ('duration_count', models.PositiveIntegerField(default=0)),
+                ('pending_duration_sum', models.BigIntegerField(default=0)),
+                ('pending_duration_count', models.PositiveIntegerField(default=0)),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='region_durations', to='core.courier')),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='courier_durations', to='core.region')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='courierregiondurations',
+            constraint=models.UniqueConstraint(fields=('courier', 'region'), name='unique_courier_region_durations'),
+        ),
+    ]
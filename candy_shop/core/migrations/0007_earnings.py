@@ -0,0 +1,43 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:30
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_in_earnings(apps, schema_editor):
+    CourierType = apps.get_model('core', 'CourierType')
+    Courier = apps.get_model('core', 'Courier')
+    Shipment = apps.get_model('core', 'Shipment')
+
+    for code, coefficient in (('foot', 2), ('bike', 5), ('car', 9)):
+        CourierType.objects.filter(code=code).update(earnings_coefficient=coefficient)
+
+    shipments_earnings = (
+            Shipment.objects
+            .filter(complete_time__isnull=False)
+            .values('courier')
+            .annotate(coefficients=Sum('initial_courier_type__earnings_coefficient'))
+            .values_list('courier', 'coefficients'))
+    for courier_id, coefficients in shipments_earnings:
+        Courier.objects.filter(id=courier_id).update(earnings=500 * coefficients)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_courier_region_durations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courier',
+            name='earnings',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='couriertype',
+            name='earnings_coefficient',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_in_earnings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_earnings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courier',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='shipment',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_versions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='shipment',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='core.shipment'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(shipment__isnull=True), fields=['region', 'weight'], name='order_not_assigned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['shipment', 'complete_time'], name='order_shipment_complete_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderdeliveryinterval',
+            index=models.Index(fields=['order', 'start', 'end'], name='interval_order_range_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(condition=models.Q(complete_time__isnull=True), fields=['courier'], name='shipment_active_idx'),
+        ),
+    ]
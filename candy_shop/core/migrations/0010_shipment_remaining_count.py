@@ -0,0 +1,34 @@
+# Generated by Django 3.1.7 on 2026-10-18 20:15
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_in_remaining_count(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    Shipment = apps.get_model('core', 'Shipment')
+
+    remaining_counts = (
+            Order.all_objects
+            .filter(shipment__isnull=False, complete_time__isnull=True)
+            .values('shipment')
+            .annotate(remaining_count=Count('id'))
+            .values_list('shipment', 'remaining_count'))
+    for shipment_id, remaining_count in remaining_counts:
+        Shipment.objects.filter(id=shipment_id).update(remaining_count=remaining_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shipment',
+            name='remaining_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_in_remaining_count, migrations.RunPython.noop),
+    ]
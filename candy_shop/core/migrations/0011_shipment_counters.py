@@ -0,0 +1,47 @@
+# Generated by Django 3.1.7 on 2026-10-18 21:05
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_in_counters(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    Shipment = apps.get_model('core', 'Shipment')
+
+    counters = (
+            Order.all_objects
+            .filter(shipment__isnull=False)
+            .values('shipment')
+            .annotate(order_count=Count('id'),
+                      total_weight=Sum('weight'),
+                      remaining_weight=Sum('weight', filter=Q(complete_time__isnull=True)))
+            .values_list('shipment', 'order_count', 'total_weight', 'remaining_weight'))
+    for shipment_id, order_count, total_weight, remaining_weight in counters:
+        Shipment.objects.filter(id=shipment_id).update(
+                order_count=order_count, total_weight=total_weight, remaining_weight=remaining_weight or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_shipment_remaining_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shipment',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shipment',
+            name='remaining_weight',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='shipment',
+            name='total_weight',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.RunPython(fill_in_counters, migrations.RunPython.noop),
+    ]
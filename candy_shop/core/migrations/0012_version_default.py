@@ -0,0 +1,25 @@
+# Generated by Django 3.1.7 on 2026-10-18 23:40
+
+import time
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_shipment_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='courier',
+            name='version',
+            field=models.PositiveBigIntegerField(default=time.time_ns),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='version',
+            field=models.PositiveBigIntegerField(default=time.time_ns),
+        ),
+    ]
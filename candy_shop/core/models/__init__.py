@@ -2,3 +2,4 @@ from .region import *
 from .courier import *
 from .order import *
 from .shipment import *
+from .rating import *
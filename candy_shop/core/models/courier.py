@@ -1,11 +1,19 @@
+import time
+from datetime import datetime
+
 from django.db import models, transaction
 
 from core.models import Region
 
 
+def _to_time(value):
+    return value.time() if isinstance(value, datetime) else value
+
+
 class CourierType(models.Model):
     code = models.CharField(primary_key=True, max_length=10)
     capacity = models.DecimalField(max_digits=6, decimal_places=2)  # In kilograms
+    earnings_coefficient = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f'{self.code}'
@@ -15,6 +23,14 @@ class Courier(models.Model):
     id = models.PositiveBigIntegerField(primary_key=True)
     type = models.ForeignKey(
             'core.CourierType', on_delete=models.CASCADE, related_name='couriers')
+    # Maintained by core.services.courier.complete_order, None until the first
+    # shipment is completed
+    earnings = models.PositiveBigIntegerField(blank=True, null=True)
+    # Bumped by the service functions changing the courier's representation,
+    # the ETag of GET /couriers/<id> is derived from it
+    # Starts from the creation time, not from 1, so that a deleted and
+    # created again row never repeats the ETags of the old one
+    version = models.PositiveBigIntegerField(default=time.time_ns)
 
     def __str__(self):
         return f'{self.id}'
@@ -28,27 +44,50 @@ class Courier(models.Model):
         return self.courier_regions.order_by('region').values_list('region', flat=True)
 
     @region_ids.setter
-    @transaction.atomic
     def region_ids(self, ids):
-        if set(ids) != set(self.courier_regions.values_list('region', flat=True)):
-            self.courier_regions.all().delete()
-            for region_id in ids:
-                region, created = Region.objects.get_or_create(id=region_id)
-                region.courier_regions.create(courier_id=self.id)
+        self.set_region_ids(ids)
+
+    @transaction.atomic
+    def set_region_ids(self, ids):
+        """Update only the added and the removed regions. Return whether
+        anything has changed.
+        """
+        new_ids = set(ids)
+        old_ids = set(self.courier_regions.values_list('region', flat=True))
+
+        if old_ids - new_ids:
+            self.courier_regions.filter(region__in=old_ids - new_ids).delete()
+        if new_ids - old_ids:
+            Region.objects.bulk_create([Region(id=i) for i in new_ids - old_ids], ignore_conflicts=True)
+            CourierRegion.objects.bulk_create(
+                    CourierRegion(courier_id=self.id, region_id=i) for i in new_ids - old_ids)
+        return new_ids != old_ids
 
     @property
     def work_shift_intervals(self):
         return self.work_shifts.order_by('start').values('start', 'end')
 
     @work_shift_intervals.setter
-    @transaction.atomic
     def work_shift_intervals(self, intervals):
-        new_intervals = sorted(intervals, key=lambda i: i['start'])
-        old_intervals = sorted(self.work_shift_intervals, key=lambda i: i['start'])
-        if new_intervals != old_intervals:
-            self.work_shifts.all().delete()
-            for interval in new_intervals:
-                self.work_shifts.get_or_create(start=interval['start'], end=interval['end'])
+        self.set_work_shift_intervals(intervals)
+
+    @transaction.atomic
+    def set_work_shift_intervals(self, intervals):
+        """Update only the added and the removed work shifts. Return whether
+        anything has changed.
+        """
+        new_intervals = {(_to_time(i['start']), _to_time(i['end'])) for i in intervals}
+        old_intervals = {(s.start, s.end): s.id for s in self.work_shifts.all()}
+
+        removed_ids = [i for interval, i in old_intervals.items() if interval not in new_intervals]
+        if removed_ids:
+            self.work_shifts.filter(id__in=removed_ids).delete()
+        added_intervals = new_intervals - old_intervals.keys()
+        if added_intervals:
+            CourierWorkShift.objects.bulk_create(
+                    CourierWorkShift(courier_id=self.id, start=start, end=end)
+                    for start, end in added_intervals)
+        return bool(removed_ids or added_intervals)
 
     @property
     def active_shipment(self):
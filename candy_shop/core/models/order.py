@@ -1,4 +1,7 @@
+import time
+
 from django.db import models
+from django.db.models import Q
 
 from core.managers.order import OrderQueryset
 
@@ -10,12 +13,29 @@ class Order(models.Model):
             'core.Region', on_delete=models.CASCADE, related_name='orders')
     shipment = models.ForeignKey(
             'core.Shipment', blank=True, null=True, on_delete=models.SET_NULL,
-            related_name='orders')
+            related_name='orders', db_index=False)  # See order_shipment_complete_idx
     complete_time = models.DateTimeField(blank=True, null=True)
+    # Bumped by the service functions changing the order, the ETag of
+    # GET /orders/<id> is derived from it
+    # Starts from the creation time, not from 1, so that a deleted and
+    # created again row never repeats the ETags of the old one
+    version = models.PositiveBigIntegerField(default=time.time_ns)
 
     all_objects = models.Manager()
     objects = OrderQueryset.as_manager()
 
+    class Meta:
+        indexes = [
+            # The pool of not assigned yet orders (a small part of the table)
+            # filtered by region and weight, see OrderQueryset.not_assigned_yet
+            models.Index(fields=['region', 'weight'], condition=Q(shipment__isnull=True),
+                         name='order_not_assigned_idx'),
+            # The orders of a shipment: the undelivered ones (complete_order,
+            # assign_orders) and the delivered ones in the order of delivery
+            # (the rating), it replaces the index of the foreign key
+            models.Index(fields=['shipment', 'complete_time'], name='order_shipment_complete_idx'),
+        ]
+
     def __str__(self):
         return f'{self.id}'
 
@@ -26,5 +46,12 @@ class OrderDeliveryInterval(models.Model):
     start = models.TimeField()
     end = models.TimeField()
 
+    class Meta:
+        indexes = [
+            # The intervals of the orders joined by the candidates query,
+            # filtered by the shifts without going to the table
+            models.Index(fields=['order', 'start', 'end'], name='interval_order_range_idx'),
+        ]
+
     def __str__(self):
         return f'{self.id} ({self.order}, {self.start:%H:%M}-{self.end:%H:%M})'
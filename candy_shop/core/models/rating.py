@@ -0,0 +1,25 @@
+from django.db import models
+
+
+class CourierRegionDurations(models.Model):
+    """Running sum and count of the delivery durations (in seconds) of the
+    courier's orders in the region, see core.services.courier.complete_order.
+    Durations of the shipment in progress are kept apart (pending) until it's
+    completed, as the rating counts completed shipments only.
+    """
+    courier = models.ForeignKey(
+            'core.Courier', on_delete=models.CASCADE, related_name='region_durations')
+    region = models.ForeignKey(
+            'core.Region', on_delete=models.CASCADE, related_name='courier_durations')
+    duration_sum = models.BigIntegerField(default=0)
+    duration_count = models.PositiveIntegerField(default=0)
+    pending_duration_sum = models.BigIntegerField(default=0)
+    pending_duration_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['courier', 'region'], name='unique_courier_region_durations')
+        ]
+
+    def __str__(self):
+        return f'{self.id} ({self.courier}, {self.region})'
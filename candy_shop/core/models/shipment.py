@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 
 
 class Shipment(models.Model):
@@ -8,3 +9,19 @@ class Shipment(models.Model):
             'core.CourierType', on_delete=models.CASCADE, related_name='shipments')
     assign_time = models.DateTimeField(blank=True, null=True)
     complete_time = models.DateTimeField(blank=True, null=True)
+    # The counters of the orders in the shipment and of the undelivered ones,
+    # maintained by the service functions (the shipment is completed with the
+    # last order, see complete_order) and checked by check_shipment_counters
+    order_count = models.PositiveIntegerField(default=0)
+    remaining_count = models.PositiveIntegerField(default=0)
+    total_weight = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    remaining_weight = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    # Bumped by the service functions changing the shipment or its orders
+    version = models.PositiveBigIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            # The courier's active shipment, see Courier.active_shipment
+            models.Index(fields=['courier'], condition=Q(complete_time__isnull=True),
+                         name='shipment_active_idx'),
+        ]
@@ -0,0 +1,15 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Pages of the rows ordered by the primary key: the cursor holds the last
+    seen ID, so every page is fetched with `WHERE id > ... LIMIT ...` however
+    deep it is.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'LIST_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'LIST_MAX_PAGE_SIZE', 1000)
@@ -0,0 +1,30 @@
+import json
+
+from rest_framework.parsers import BaseParser
+
+
+def iter_ndjson(lines, encoding='utf-8'):
+    """Yield the records of newline delimited JSON lines (str or bytes)
+    lazily. Lines that are not valid JSON give `None`, blank ones are skipped.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode(encoding)
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+class NDJSONParser(BaseParser):
+    """Parses newline delimited JSON lazily: `request.data` is an iterator over
+    the records which reads the request stream line by line.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        return iter_ndjson(stream or [], encoding=encoding)
@@ -0,0 +1,69 @@
+"""Routing of the read-only queries of the read endpoints to the replicas.
+
+Only the code explicitly marked with `read_from_replica` (the list, retrieve
+and stats views) reads from the `DATABASE_REPLICAS` aliases, everything else
+(the service functions, the ingestion, the transactions) stays on the
+primary `default` database. A client that has written something reads from
+the primary for `REPLICA_STICKINESS_SECONDS` afterwards, so it sees its own
+writes despite the replication lag, see `core.middleware`.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+
+
+@contextmanager
+def _set(var, value):
+    token = var.set(value)
+    try:
+        yield
+    finally:
+        var.reset(token)
+
+
+def replica_reads():
+    """Let the reads inside go to a replica (unless pinned to the primary)."""
+    return _set(_replica_reads, True)
+
+
+def pinned_to_primary():
+    """Keep the reads inside on the primary, even in `replica_reads()`."""
+    return _set(_pinned_to_primary, True)
+
+
+def read_from_replica(view):
+    """Decorator of the read-only views (functions and methods)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if (not replicas or not _replica_reads.get() or _pinned_to_primary.get()
+                # The reads of a transaction must see its writes
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas have the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replicas get the schema by replication
+        return db not in getattr(settings, 'DATABASE_REPLICAS', [])
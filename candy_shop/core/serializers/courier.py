@@ -1,10 +1,57 @@
+from collections import Counter
+
+from django.db import transaction
 from rest_framework import serializers
 
-from core.models import CourierType, Courier, Region
+from core.models import CourierType, Courier, CourierRegion, CourierWorkShift, Region
 from core.serializers.utils import TimeIntervalSerializer
+from core.services.bulk import bulk_insert
 from core.services.courier import edit_courier, calculate_rating, calculate_earnings
 
 
+class CourierTypeField(serializers.PrimaryKeyRelatedField):
+    """Loads all the courier types once per (root) serializer instead of
+    querying the type of every courier.
+    """
+    def to_internal_value(self, data):
+        if 'courier_types' not in self.context:
+            self.context['courier_types'] = {t.pk: t for t in self.get_queryset()}
+        try:
+            return self.context['courier_types'][data]
+        except (KeyError, TypeError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class CourierListSerializer(serializers.ListSerializer):
+    @transaction.atomic
+    def create(self, validated_data):
+        """Create all the couriers in a fixed number of queries: existing
+        couriers check, regions, couriers, their regions and work shifts.
+        """
+        courier_ids = [item['id'] for item in validated_data]
+        existing_ids = {i for i, count in Counter(courier_ids).items() if count > 1}
+        existing_ids.update(Courier.objects.filter(id__in=courier_ids).values_list('id', flat=True))
+        if existing_ids:
+            raise serializers.ValidationError(
+                    [f'Courier({courier_id}) already exists.' for courier_id in sorted(existing_ids)])
+
+        region_ids = {region_id for item in validated_data for region_id in item['regions']}
+        Region.objects.bulk_create([Region(id=i) for i in region_ids], ignore_conflicts=True)
+
+        couriers = bulk_insert(Courier(id=item['id'], type=item['type']) for item in validated_data)
+        bulk_insert(
+                CourierRegion(courier_id=item['id'], region_id=region_id)
+                for item in validated_data
+                for region_id in dict.fromkeys(item['regions']))
+        bulk_insert(
+                CourierWorkShift(courier_id=item['id'], start=start, end=end)
+                for item in validated_data
+                for start, end in dict.fromkeys(
+                    (s['start'].time(), s['end'].time()) for s in item['working_hours']))
+
+        return couriers
+
+
 class CourierTypeSerializer(serializers.ModelSerializer):
     class Meta:
         model = CourierType
@@ -13,18 +60,22 @@ class CourierTypeSerializer(serializers.ModelSerializer):
 
 class CourierSerializer(serializers.Serializer):
     courier_id = serializers.IntegerField(source='id', min_value=1)
-    courier_type = serializers.PrimaryKeyRelatedField(source='type', queryset=CourierType.objects.all())
+    courier_type = CourierTypeField(source='type', queryset=CourierType.objects.all())
     regions = serializers.ListSerializer(child=serializers.IntegerField(min_value=1), write_only=True, allow_empty=False)
     working_hours = serializers.ListSerializer(child=TimeIntervalSerializer(), write_only=True, allow_empty=False)
 
     class Meta:
         model = Courier
         fields = ['courier_id', 'courier_type', 'regions', 'working_hours']
+        list_serializer_class = CourierListSerializer
 
     def to_representation(self, instance):
+        # The related rows are read with .all() to use the prefetched ones
+        # (see CourierViewSet.list), so they're sorted here
         ret = super().to_representation(instance)
-        ret['regions'] = instance.region_ids
-        shifts = instance.work_shifts.order_by('start').values('start', 'end')
+        ret['regions'] = sorted(r.region_id for r in instance.courier_regions.all())
+        shifts = sorted(({'start': s.start, 'end': s.end} for s in instance.work_shifts.all()),
+                        key=lambda s: s['start'])
         ret['working_hours'] = TimeIntervalSerializer(shifts, many=True).data
         return ret
 
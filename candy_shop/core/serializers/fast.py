@@ -0,0 +1,96 @@
+"""Read-only representations built straight from `values()` rows, without
+the DRF field machinery. They give exactly the same data as `CourierSerializer`,
+`OrderSerializer` and `OrdersAssignSerializer` (see core.tests.fast) and are
+used by the views when `FAST_SERIALIZATION_ENABLED` is set.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import CourierRegion, CourierWorkShift, OrderDeliveryInterval
+
+
+def is_fast_serialization_enabled():
+    return getattr(settings, 'FAST_SERIALIZATION_ENABLED', False)
+
+
+@lru_cache(maxsize=None)
+def format_interval(start, end):
+    """The same as `TimeIntervalSerializer.to_representation`. There are not
+    many distinct intervals, so every one is formatted once.
+    """
+    return f'{start:%H:%M}-{end:%H:%M}'
+
+
+def format_datetime(value):
+    """The same as DRF's `DateTimeField.to_representation` with ISO 8601."""
+    if not value:
+        return None
+    value = timezone.localtime(value) if timezone.is_aware(value) else value
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _get_intervals(model, fk_name, ids):
+    intervals = {i: [] for i in ids}
+    rows = (model.objects
+            .filter(**{f'{fk_name}__in': ids})
+            .order_by(fk_name, 'start', 'id')
+            .values_list(fk_name, 'start', 'end'))
+    for owner_id, start, end in rows:
+        intervals[owner_id].append(format_interval(start, end))
+    return intervals
+
+
+def couriers_to_dicts(rows):
+    """`rows` are {'id', 'type_id'} dicts (the courier `values()`). Two more
+    queries are made: regions and work shifts.
+    """
+    ids = [row['id'] for row in rows]
+    regions = {i: [] for i in ids}
+    for courier_id, region_id in (CourierRegion.objects
+                                  .filter(courier__in=ids)
+                                  .order_by('courier', 'region')
+                                  .values_list('courier', 'region')):
+        regions[courier_id].append(region_id)
+    shifts = _get_intervals(CourierWorkShift, 'courier_id', ids)
+
+    return [{'courier_id': row['id'],
+             'courier_type': row['type_id'],
+             'regions': regions[row['id']],
+             'working_hours': shifts[row['id']]}
+            for row in rows]
+
+
+def orders_to_dicts(rows):
+    """`rows` are {'id', 'weight', 'region_id'} dicts (the order `values()`).
+    One more query is made: delivery intervals.
+    """
+    intervals = _get_intervals(OrderDeliveryInterval, 'order_id', [row['id'] for row in rows])
+
+    # The weights have two decimal places already, DRF's JSON encoder would
+    # turn the Decimal into float anyway
+    return [{'order_id': row['id'],
+             'weight': float(row['weight']),
+             'region': row['region_id'],
+             'delivery_hours': intervals[row['id']]}
+            for row in rows]
+
+
+def shipment_to_dict(assignment):
+    """`assignment` is {'orders': [{'id'}, ...], 'assign_time'} as returned
+    by `OrdersAssignSerializer.save`.
+    """
+    return {'orders': [{'id': order['id']} for order in assignment['orders']],
+            'assign_time': format_datetime(assignment['assign_time'])}
+
+
+def shipments_to_dict(assignments):
+    """`assignments` are {'couriers': [{'courier_id', 'orders', 'assign_time'},
+    ...]} as returned by `OrdersAssignBatchSerializer.save`.
+    """
+    return {'couriers': [{'courier_id': assignment['courier_id'], **shipment_to_dict(assignment)}
+                         for assignment in assignments['couriers']]}
@@ -0,0 +1,75 @@
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+
+from core.models import Courier, Order
+from core.serializers.courier import CourierSerializer
+from core.serializers.order import OrderSerializer
+
+IMPORTERS = {
+    'couriers': (CourierSerializer, Courier.objects, 'courier_id'),
+    'orders': (OrderSerializer, Order.all_objects, 'order_id'),
+}
+
+
+def _get_id(record, id_field):
+    return record.get(id_field, -1) if isinstance(record, dict) else -1
+
+
+def _import_chunk(kind, records):
+    serializer_class, manager, id_field = IMPORTERS[kind]
+    serializer = serializer_class(many=True)
+
+    validated_data = []
+    failed_ids = []
+    for record in records:
+        try:
+            validated_data.append(serializer.child.run_validation(record))
+        except serializers.ValidationError:
+            failed_ids.append(_get_id(record, id_field))
+
+    # Existing (e.g. imported by the previous run) and repeated IDs fail too
+    new_data = []
+    try:
+        with transaction.atomic():
+            existing_ids = set(manager.filter(id__in=[item['id'] for item in validated_data])
+                               .values_list('id', flat=True))
+            for item in validated_data:
+                if item['id'] in existing_ids:
+                    failed_ids.append(item['id'])
+                else:
+                    existing_ids.add(item['id'])
+                    new_data.append(item)
+
+            if new_data:
+                serializer.create(new_data)
+    except (serializers.ValidationError, IntegrityError):
+        # Created concurrently after the check: the whole chunk is rolled back
+        failed_ids.extend(item['id'] for item in new_data)
+        new_data = []
+    return [item['id'] for item in new_data], failed_ids
+
+
+def import_records(kind, records, chunk_size):
+    """Validate and create the records ('couriers' or 'orders', in the same
+    format as the items of `data` of POST /couriers and POST /orders) in
+    chunks of `chunk_size`, every chunk in its own transaction. The records
+    are consumed lazily, so memory is bounded by the chunk size. Invalid and
+    existing records are skipped, and so is the whole chunk if its records
+    are created concurrently. Yield the report for every chunk.
+    """
+    records = iter(records)
+    created, failed = 0, 0
+    for chunk_number, chunk in enumerate(iter(lambda: list(islice(records, chunk_size)), []), 1):
+        created_ids, failed_ids = _import_chunk(kind, chunk)
+        created += len(created_ids)
+        failed += len(failed_ids)
+        yield {
+            'chunk': chunk_number,
+            'records': len(chunk),
+            'created': len(created_ids),
+            'failed': [{'id': i} for i in failed_ids],
+            'total_created': created,
+            'total_failed': failed,
+        }
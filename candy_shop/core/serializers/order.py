@@ -1,21 +1,65 @@
+from collections import Counter
 from decimal import Decimal
 
+from django.db import transaction
 from rest_framework import serializers
 
-from core.models import Order, Courier, Region
+from core.models import Order, OrderDeliveryInterval, Courier, Region
 from core.serializers.utils import TimeIntervalSerializer
-from core.services.courier import assign_orders, complete_order
+from core.services.bulk import bulk_insert
+from core.services.courier import assign_orders, assign_orders_batch, complete_order, complete_orders_batch
+from core.services.dispatch_index import notify_orders_changed
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    @transaction.atomic
+    def create(self, validated_data):
+        """Create all the orders in a fixed number of queries: existing orders
+        check, regions, orders and delivery intervals.
+        """
+        order_ids = [item['id'] for item in validated_data]
+        existing_ids = {i for i, count in Counter(order_ids).items() if count > 1}
+        existing_ids.update(Order.all_objects.filter(id__in=order_ids).values_list('id', flat=True))
+        if existing_ids:
+            raise serializers.ValidationError(
+                    [f'Order({order_id}) already exists.' for order_id in sorted(existing_ids)])
+
+        region_ids = {item['region']['id'] for item in validated_data}
+        Region.objects.bulk_create([Region(id=i) for i in region_ids], ignore_conflicts=True)
+
+        orders = bulk_insert(
+                Order(id=item['id'], weight=item['weight'], region_id=item['region']['id'])
+                for item in validated_data)
+        bulk_insert(
+                OrderDeliveryInterval(order_id=item['id'], start=start, end=end)
+                for item in validated_data
+                for start, end in dict.fromkeys(
+                    (i['start'].time(), i['end'].time()) for i in item['delivery_hours']))
+
+        notify_orders_changed(order_ids)
+        return orders
+
+
+class RegionIdField(serializers.IntegerField):
+    """Writes to `region.id`, but reads `region_id` not to fetch the region."""
+    def get_attribute(self, instance):
+        return instance.region_id
 
 
 class OrderSerializer(serializers.Serializer):
     order_id = serializers.IntegerField(source='id', min_value=1)
     weight = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=Decimal('0.01'), coerce_to_string=False)
-    region = serializers.IntegerField(source='region.id', min_value=1)
+    region = RegionIdField(source='region.id', min_value=1)
     delivery_hours = serializers.ListSerializer(child=TimeIntervalSerializer(), write_only=True, allow_empty=False)
 
+    class Meta:
+        list_serializer_class = OrderListSerializer
+
     def to_representation(self, instance):
         ret = super().to_representation(instance)
-        intervals = instance.delivery_intervals.order_by('start').values('start', 'end')
+        # Read with .all() to use the prefetched intervals (see OrderViewSet.list)
+        intervals = sorted(({'start': i.start, 'end': i.end} for i in instance.delivery_intervals.all()),
+                           key=lambda i: i['start'])
         ret['delivery_hours'] = TimeIntervalSerializer(intervals, many=True).data
         return ret
 
@@ -62,6 +106,34 @@ class OrdersAssignSerializer(serializers.Serializer):
         return {'orders': [{'id': i} for i in order_ids], 'assign_time': assign_time}
 
 
+class CourierAssignmentSerializer(serializers.Serializer):
+    courier_id = serializers.IntegerField()
+    orders = OrderResponseSerializer(many=True)
+    assign_time = serializers.DateTimeField()
+
+
+class OrdersAssignBatchSerializer(serializers.Serializer):
+    courier_ids = serializers.ListField(
+            child=serializers.IntegerField(min_value=1), write_only=True, allow_empty=False)
+    couriers = CourierAssignmentSerializer(many=True, read_only=True)
+
+    @staticmethod
+    def validate_courier_ids(value):
+        existing_ids = set(Courier.objects.filter(id__in=value).values_list('id', flat=True))
+        missing_ids = sorted(set(value) - existing_ids)
+        if missing_ids:
+            raise serializers.ValidationError(f'Couriers do not exist: {missing_ids}.')
+        return value
+
+    def create(self, validated_data):
+        assignments = assign_orders_batch(courier_ids=validated_data['courier_ids'])
+        return {'couriers': [
+            {'courier_id': courier_id,
+             'orders': [{'id': i} for i in order_ids],
+             'assign_time': assign_time}
+            for courier_id, (order_ids, assign_time) in sorted(assignments.items())]}
+
+
 class OrderCompleteSerializer(serializers.Serializer):
     courier_id = serializers.PrimaryKeyRelatedField(write_only=True, queryset=Courier.objects.all())
     order_id = serializers.PrimaryKeyRelatedField(queryset=Order.objects.all())
@@ -89,3 +161,23 @@ class OrderCompleteSerializer(serializers.Serializer):
         complete_time = validated_data['complete_time']
         complete_order(order_id=order_id, complete_time=complete_time)
         return {'order_id': validated_data['order_id']}
+
+
+class OrderCompletionSerializer(serializers.Serializer):
+    courier_id = serializers.IntegerField(min_value=1)
+    order_id = serializers.IntegerField(min_value=1)
+    complete_time = serializers.DateTimeField()
+
+
+class OrderCompletionResultSerializer(serializers.Serializer):
+    order_id = serializers.IntegerField()
+    status = serializers.CharField()
+    errors = serializers.DictField(child=serializers.CharField(), required=False)
+
+
+class OrdersCompleteBatchSerializer(serializers.Serializer):
+    data = OrderCompletionSerializer(many=True, write_only=True, allow_empty=False)
+    orders = OrderCompletionResultSerializer(many=True, read_only=True)
+
+    def create(self, validated_data):
+        return {'orders': complete_orders_batch(completions=validated_data['data'])}
@@ -0,0 +1,41 @@
+import csv
+import io
+
+from django.conf import settings
+from django.db import connection
+
+
+def _copy(objs):
+    model = type(objs[0])
+    fields = [f for f in model._meta.concrete_fields
+              if not (f.primary_key and getattr(objs[0], f.attname) is None)]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for obj in objs:
+        writer.writerow([f.get_db_prep_save(getattr(obj, f.attname), connection) for f in fields])
+    buffer.seek(0)
+
+    columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+                f'COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) '
+                f'FROM STDIN WITH (FORMAT csv)',
+                buffer)
+
+
+def bulk_insert(objs):
+    """Insert the new instances of the same model in as few statements as
+    possible: with COPY on PostgreSQL for batches of BULK_COPY_THRESHOLD
+    objects and more, with bulk_create otherwise. Neither sends model signals
+    nor sets the auto-generated primary keys on the objects.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+
+    if connection.vendor == 'postgresql' and len(objs) >= settings.BULK_COPY_THRESHOLD:
+        _copy(objs)
+    else:
+        type(objs[0]).objects.bulk_create(objs, batch_size=settings.BULK_CREATE_BATCH_SIZE)
+    return objs
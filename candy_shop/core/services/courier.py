@@ -1,35 +1,174 @@
+import atexit
+import multiprocessing
+import threading
+import time
+from bisect import bisect_left
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-from django.db import transaction, IntegrityError
-from django.db.models import Count
+import django
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Count, F, Q, Subquery, Sum, Window
+from django.db.models.functions import Coalesce, Lag
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from core.models import (
+        Courier, CourierRegion, CourierRegionDurations, CourierType, CourierWorkShift,
+        Order, Shipment)
+from core.services.dispatch_index import (
+        RegionIndex, dispatch_index, is_dispatch_index_enabled,
+        notify_orders_assigned, notify_orders_changed)
+from core.services.metrics import timed
+from core.services.response_cache import invalidate_courier_responses
+
+
+def _get_courier_snapshot(courier):
+    """Return the courier's capacity, region IDs and work shifts (ordered by
+    start), loaded once so that the packing doesn't go back to the database.
+    """
+    return {
+        'capacity': courier.capacity,
+        'region_ids': list(courier.region_ids),
+        'shifts': list(courier.work_shift_intervals),
+    }
 
-from core.models import Courier, Order, Shipment
 
+def _get_candidates(snapshot, filtered_orders):
+    """Return {order_id: (weight, [(interval_start, interval_end), ...])} for
+    the orders suitable for any of the courier's work shifts. Only the delivery
+    intervals overlapping some of the shifts are kept.
+    """
+    candidates = {}
+    rows = filtered_orders.suitable_for_courier_shifts(
+            capacity=snapshot['capacity'],
+            region_ids=snapshot['region_ids'],
+            shifts=snapshot['shifts'])
 
-def _pack_a_bag(courier, filtered_orders):
-    bag = {}
+    for order_id, weight, start, end in rows:
+        candidates.setdefault(order_id, (weight, []))[1].append((start, end))
+
+    return candidates
 
-    for shift in courier.work_shift_intervals:
-        orders = (
-                filtered_orders
-                .suitable_for_courier(
-                    capacity=courier.capacity,
-                    region_ids=courier.region_ids,
-                    shift_start=shift['start'],
-                    shift_end=shift['end'])
-                .exclude(id__in=bag.keys())
-                .order_by('weight')
-                .values_list('id', 'weight'))
-
-        for order_id, order_weight in orders:
-            if order_weight + sum(bag.values()) > courier.capacity:
+
+def _fill_the_bag(capacity, shifts, candidates):
+    """Go through the shifts in order and put the lightest orders suitable for
+    the shift into the bag until the next one doesn't fit.
+    """
+    bag = {}
+    bag_weight = 0
+
+    for shift in shifts:
+        orders = sorted(
+                (weight, order_id)
+                for order_id, (weight, intervals) in candidates.items()
+                if order_id not in bag and any(
+                    start < shift['end'] and end > shift['start']
+                    for start, end in intervals))
+
+        for order_weight, order_id in orders:
+            if order_weight + bag_weight > capacity:
                 break
             bag[order_id] = order_weight
+            bag_weight += order_weight
 
     return bag
 
 
+class PackingStrategy:
+    """Chooses the orders for the courier's bag among the candidates
+    {order_id: (weight, [(interval_start, interval_end), ...])} suitable for
+    the courier's shifts. Returns the bag {order_id: weight}.
+    """
+    def pack(self, capacity, shifts, candidates):
+        raise NotImplementedError
+
+
+class GreedyPackingStrategy(PackingStrategy):
+    def pack(self, capacity, shifts, candidates):
+        return _fill_the_bag(capacity=capacity, shifts=shifts, candidates=candidates)
+
+
+class KnapsackPackingStrategy(PackingStrategy):
+    """Maximizes the number of orders in the bag and then its total weight
+    over all the shifts together (0/1 knapsack over the weights in
+    centigrams). Falls back to the greedy strategy if the pool needs more than
+    `max_cells` cells of the dynamic programming table or the packing takes
+    more than `max_seconds`.
+    """
+    def __init__(self, max_cells=2_000_000, max_seconds=0.5):
+        self.max_cells = max_cells
+        self.max_seconds = max_seconds
+        self.fallback = GreedyPackingStrategy()
+
+    def pack(self, capacity, shifts, candidates):
+        deadline = time.monotonic() + self.max_seconds
+        limit = int(capacity * 100)
+        items = sorted((int(weight * 100), order_id) for order_id, (weight, _) in candidates.items())
+
+        # The maximum number of orders in the bag is the number of the lightest
+        # ones that fit into it
+        n_max, lightest_weight = 0, 0
+        for weight, _ in items:
+            if lightest_weight + weight > limit:
+                break
+            n_max += 1
+            lightest_weight += weight
+        if n_max == 0:
+            return {}
+        if n_max == len(items):
+            return {order_id: candidates[order_id][0] for _, order_id in items}
+
+        # Only the orders fitting together with the n_max - 1 lightest ones may
+        # be in the bag with n_max orders
+        margin = limit - (lightest_weight - items[n_max - 1][0])
+        items = [item for item in items if item[0] <= margin]
+        if len(items) * (limit + 1) > self.max_cells:
+            return self.fallback.pack(capacity, shifts, candidates)
+
+        # best[c] encodes (number of orders, total weight) of the best bag not
+        # heavier than c, taken[i][c] tells if the i-th order is in that bag
+        best = [0] * (limit + 1)
+        taken = []
+        for weight, _ in items:
+            value = limit + 1 + weight
+            row = bytearray(limit + 1)
+            for c in range(limit, weight - 1, -1):
+                if best[c - weight] + value > best[c]:
+                    best[c] = best[c - weight] + value
+                    row[c] = 1
+            taken.append(row)
+            if time.monotonic() > deadline:
+                return self.fallback.pack(capacity, shifts, candidates)
+
+        bag = {}
+        c = limit
+        for (weight, order_id), row in zip(reversed(items), reversed(taken)):
+            if row[c]:
+                bag[order_id] = candidates[order_id][0]
+                c -= weight
+        return bag
+
+
+def get_packing_strategy():
+    strategy = getattr(settings, 'PACKING_STRATEGY', {})
+    strategy_class = import_string(strategy.get('BACKEND', 'core.services.courier.GreedyPackingStrategy'))
+    return strategy_class(**strategy.get('OPTIONS', {}))
+
+
+@timed
+def _pack_a_bag(courier, filtered_orders):
+    snapshot = _get_courier_snapshot(courier)
+    candidates = _get_candidates(snapshot=snapshot, filtered_orders=filtered_orders)
+    return get_packing_strategy().pack(
+            capacity=snapshot['capacity'],
+            shifts=snapshot['shifts'],
+            candidates=candidates)
+
+
+@timed
 @transaction.atomic
 def assign_orders(courier_id):
     """Assign to the courier maximum number of available orders that'll fit in
@@ -38,118 +177,748 @@ def assign_orders(courier_id):
 
     If the courier's delivery is in progress, return only undelivered orders.
     """
-    courier = Courier.objects.get(id=courier_id)
+    # The courier's row is locked to serialize the assignments for the same
+    # courier only
+    courier = (Courier.objects
+               .select_for_update(of=('self',))
+               .select_related('type')
+               .get(id=courier_id))
 
     # If delivery is in progress, we should return only not (yet) delivered orders
-    if courier.active_shipment:
+    active_shipment = courier.active_shipment
+    if active_shipment:
         orders = (Order.objects
-                  .assigned_to_courier(courier)
+                  .filter(shipment=active_shipment)
                   .not_delivered_yet()
+                  .order_by('id')
                   .values_list('id', flat=True))
-        return sorted(orders), courier.active_shipment.assign_time
+        return list(orders), active_shipment.assign_time
+
+    # No active delivery, so we should create one, using not assigned yet
+    # orders: from the dispatch index (if enabled) or from the database
+    snapshot = _get_courier_snapshot(courier)
+    if is_dispatch_index_enabled():
+        candidates = dispatch_index.get_candidates(snapshot)
+    else:
+        candidates = _get_candidates(snapshot=snapshot, filtered_orders=Order.objects.not_assigned_yet())
 
-    # No active delivery, so we should create one, using not assigned yet orders
-    bag = _pack_a_bag(courier=courier, filtered_orders=Order.objects.not_assigned_yet())
+    bag = _claim_a_bag(snapshot, candidates)
     if bag:
-        shipment = Shipment.objects.create(courier=courier, initial_courier_type=courier.type)
-        fitting_orders = Order.objects.filter(id__in=bag.keys())
-        fitting_orders.update(shipment=shipment)
-        shipment.assign_time = timezone.now()
-        shipment.save()
+        shipment = _new_shipment(courier, bag, assign_time=timezone.now())
+        shipment.save(force_insert=True)
+        Order.objects.filter(id__in=bag.keys()).update(shipment=shipment, version=F('version') + 1)
+        notify_orders_assigned(bag.keys())
+        invalidate_courier_responses([courier.id])
         return sorted(bag.keys()), shipment.assign_time
 
     # No active deliveries, no suitable orders for this courier
     return [], None
 
 
+def _new_shipment(courier, bag, assign_time):
+    """The shipment of the bag {order_id: weight} with the counters set."""
+    total_weight = sum(bag.values())
+    return Shipment(courier=courier, initial_courier_type=courier.type, assign_time=assign_time,
+                    order_count=len(bag), remaining_count=len(bag),
+                    total_weight=total_weight, remaining_weight=total_weight)
+
+
+@timed
+def _claim_a_bag(snapshot, candidates):
+    """Pack the bag and lock its orders. The orders locked by the concurrent
+    assignments (SKIP LOCKED) or already assigned are thrown out of the
+    candidates and the bag is repacked, until all the orders in it are locked.
+    Only the orders of the final bag stay locked.
+    """
+    candidates = dict(candidates)
+    lost_order_ids = set()
+    packing_strategy = get_packing_strategy()
+
+    while True:
+        bag = packing_strategy.pack(
+                capacity=snapshot['capacity'],
+                shifts=snapshot['shifts'],
+                candidates=candidates)
+        # Rolling back to the savepoint releases the row locks taken after it,
+        # so the orders dropped by the repacking are free for the others
+        savepoint = transaction.savepoint()
+        claimed_order_ids = set(
+                Order.objects
+                .not_assigned_yet()
+                .filter(id__in=bag.keys())
+                .select_for_update(skip_locked=True)
+                .values_list('id', flat=True))
+        if len(claimed_order_ids) == len(bag):
+            transaction.savepoint_commit(savepoint)
+            break
+        transaction.savepoint_rollback(savepoint)
+        for order_id in bag.keys() - claimed_order_ids:
+            lost_order_ids.add(order_id)
+            del candidates[order_id]
+
+    # Some of the candidates may have come from the dispatch index which has
+    # drifted from the database
+    notify_orders_changed(lost_order_ids)
+    return bag
+
+
+def _get_courier_snapshots(couriers):
+    """The same as `_get_courier_snapshot` for many couriers at once."""
+    snapshots = {
+        courier.id: {'capacity': courier.capacity, 'region_ids': [], 'shifts': []}
+        for courier in couriers}
+
+    courier_regions = (CourierRegion.objects
+                       .filter(courier__in=snapshots.keys())
+                       .order_by('region')
+                       .values_list('courier', 'region'))
+    for courier_id, region_id in courier_regions:
+        snapshots[courier_id]['region_ids'].append(region_id)
+
+    shifts = (CourierWorkShift.objects
+              .filter(courier__in=snapshots.keys())
+              .order_by('start')
+              .values('courier', 'start', 'end'))
+    for shift in shifts:
+        snapshots[shift.pop('courier')]['shifts'].append(shift)
+
+    return snapshots
+
+
+def _group_by_regions(snapshots):
+    """Split the couriers into the groups that don't share any region, so the
+    groups don't compete for the orders. Return [(region_ids, courier_ids)].
+    """
+    groups = []
+    for courier_id, snapshot in snapshots.items():
+        region_ids, courier_ids = set(snapshot['region_ids']), [courier_id]
+        for group in [g for g in groups if g[0] & region_ids]:
+            groups.remove(group)
+            region_ids |= group[0]
+            courier_ids += group[1]
+        groups.append((region_ids, courier_ids))
+    return groups
+
+
+def _pack_region_group(snapshots, orders):
+    """Pack the bags for the couriers sharing the pool of orders
+    {order_id: (weight, region_id, [(interval_start, interval_end), ...])}.
+    The couriers with fewer candidates go first, as they have fewer options,
+    the ties are broken by courier ID, so the result doesn't depend on the
+    order of the requests. Return {courier_id: bag}.
+    """
+    regions = defaultdict(RegionIndex)
+    for order_id, (weight, region_id, intervals) in orders.items():
+        regions[region_id].add(order_id, weight, intervals)
+
+    def get_candidates(snapshot):
+        candidates = {}
+        if snapshot['shifts']:
+            for region_id in snapshot['region_ids']:
+                if region_id in regions:
+                    regions[region_id].get_candidates(
+                            snapshot['capacity'], snapshot['shifts'], candidates)
+        return candidates
+
+    courier_ids = sorted(
+            snapshots,
+            key=lambda courier_id: (len(get_candidates(snapshots[courier_id])), courier_id))
+
+    bags = {}
+    packing_strategy = get_packing_strategy()
+    for courier_id in courier_ids:
+        snapshot = snapshots[courier_id]
+        bags[courier_id] = packing_strategy.pack(
+                capacity=snapshot['capacity'],
+                shifts=snapshot['shifts'],
+                candidates=get_candidates(snapshot))
+        for order_id in bags[courier_id]:
+            regions[orders[order_id][1]].remove(order_id)
+
+    return bags
+
+
+_pack_pools = {}
+_pack_pools_lock = threading.Lock()
+
+
+def _get_pack_pool(processes):
+    """The pool of `processes` packing processes, started once per server
+    process and shut down when it exits: spawning them and setting Django up
+    in every one of them would cost more than the packing, with the couriers
+    and the orders locked.
+    """
+    with _pack_pools_lock:
+        if processes not in _pack_pools:
+            # Forked children would share the database connections of the parent
+            pool = ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=django.setup)
+            atexit.register(pool.shutdown)
+            _pack_pools[processes] = pool
+        return _pack_pools[processes]
+
+
+def _pack_region_groups(tasks):
+    """Run `_pack_region_group` for every (snapshots, orders) task, in a pool
+    of ASSIGN_BATCH_PROCESSES processes if there is more than one task.
+    """
+    processes = getattr(settings, 'ASSIGN_BATCH_PROCESSES', 1)
+    if processes <= 1 or len(tasks) <= 1:
+        return [_pack_region_group(*task) for task in tasks]
+    return list(_get_pack_pool(processes).map(_pack_region_group, *zip(*tasks)))
+
+
+@timed
 @transaction.atomic
-def complete_order(order_id, complete_time):
-    order = Order.objects.get(id=order_id)
+def assign_orders_batch(courier_ids):
+    """The same as `assign_orders` for many couriers at once. All the bags are
+    packed in one pass over the pool of not assigned yet orders (independent
+    groups of regions may be packed in parallel) and written with bulk
+    queries. Return {courier_id: (order_ids, assign_time)}.
+    """
+    couriers = list(Courier.objects
+                    .select_for_update(of=('self',))
+                    .select_related('type')
+                    .filter(id__in=courier_ids)
+                    .order_by('id'))
+    result = {}
+
+    # Couriers with the deliveries in progress get their undelivered orders
+    active_shipments = {
+        shipment.courier_id: shipment
+        for shipment in Shipment.objects.filter(courier__in=couriers, complete_time__isnull=True)}
+    for courier_id in active_shipments:
+        result[courier_id] = ([], active_shipments[courier_id].assign_time)
+    undelivered_orders = (Order.objects
+                          .filter(shipment__in=active_shipments.values())
+                          .not_delivered_yet()
+                          .order_by('id')
+                          .values_list('shipment__courier', 'id'))
+    for courier_id, order_id in undelivered_orders:
+        result[courier_id][0].append(order_id)
+
+    # The rest of couriers share the pool of not assigned yet orders
+    snapshots = _get_courier_snapshots(c for c in couriers if c.id not in active_shipments)
+    groups = _group_by_regions(snapshots)
+
+    orders = {}
+    pool = (Order.objects
+            .not_assigned_yet()
+            .filter(region__in=set().union(*(region_ids for region_ids, _ in groups)))
+            .select_for_update(skip_locked=True, of=('self',))
+            .values_list('id', 'weight', 'region', 'delivery_intervals__start',
+                         'delivery_intervals__end'))
+    for order_id, weight, region_id, start, end in pool:
+        _, _, intervals = orders.setdefault(order_id, (weight, region_id, []))
+        if start is not None:
+            intervals.append((start, end))
+
+    bags = {}
+    tasks = [({courier_id: snapshots[courier_id] for courier_id in group_courier_ids},
+              {order_id: order for order_id, order in orders.items() if order[1] in region_ids})
+             for region_ids, group_courier_ids in groups]
+    for group_bags in _pack_region_groups(tasks):
+        bags.update(group_bags)
+
+    assign_time = timezone.now()
+    couriers = {courier.id: courier for courier in couriers}
+    bags = {courier_id: bag for courier_id, bag in bags.items() if bag}
+    shipments = Shipment.objects.bulk_create(
+            _new_shipment(couriers[courier_id], bags[courier_id], assign_time=assign_time)
+            for courier_id in bags)
+    shipment_ids = {shipment.courier_id: shipment.id for shipment in shipments}
+    if not connection.features.can_return_rows_from_bulk_insert:
+        # The IDs of the new shipments aren't returned, the couriers are
+        # locked, so theirs are the only ones in progress
+        shipment_ids = dict(Shipment.objects
+                            .filter(courier__in=bags.keys(), complete_time__isnull=True)
+                            .values_list('courier', 'id'))
+    Order.objects.bulk_update(
+            [Order(id=order_id, shipment_id=shipment_ids[courier_id], version=F('version') + 1)
+             for courier_id, bag in bags.items() for order_id in bag],
+            fields=['shipment', 'version'])
+    notify_orders_assigned(order_id for bag in bags.values() for order_id in bag)
+    invalidate_courier_responses(bags.keys())
+
+    for courier_id in snapshots:
+        if courier_id in bags:
+            result[courier_id] = (sorted(bags[courier_id]), assign_time)
+        else:
+            result[courier_id] = ([], None)
+
+    return result
+
+
+def _to_datetime(value):
+    """Datetimes fetched with a raw cursor: PostgreSQL gives them aware, SQLite
+    gives them as stored (naive UTC, or strings for the computed columns).
+    """
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def _add_pending_durations(courier_id, region_id, duration_sum, duration_count):
+    durations = CourierRegionDurations.objects.filter(courier_id=courier_id, region_id=region_id)
+    if not durations.update(pending_duration_sum=F('pending_duration_sum') + duration_sum,
+                            pending_duration_count=F('pending_duration_count') + duration_count):
+        CourierRegionDurations.objects.create(
+                courier_id=courier_id, region_id=region_id,
+                pending_duration_sum=duration_sum, pending_duration_count=duration_count)
 
-    if not order.complete_time:
-        shipment = order.shipment
-        if order.shipment.orders.filter(complete_time__isnull=True).count() == 1:
-            # This is the last (or the only one) order in the shipment
-            shipment.complete_time = complete_time
-            shipment.save()
-        order.complete_time = complete_time
-        order.save()
 
+def _commit_delivery_durations(courier_id):
+    """Count the pending durations of the completed shipment in the rating."""
+    (CourierRegionDurations.objects
+     .filter(courier_id=courier_id, pending_duration_count__gt=0)
+     .update(duration_sum=F('duration_sum') + F('pending_duration_sum'),
+             duration_count=F('duration_count') + F('pending_duration_count'),
+             pending_duration_sum=0,
+             pending_duration_count=0))
 
+
+@timed
+@transaction.atomic
+def complete_order(order_id, complete_time):
+    """Mark the assigned order delivered (if it isn't yet) in three statements:
+    the conditional update of the order, the update of the shipment's
+    remaining orders counters (completing the shipment with its last order)
+    and the update of the courier's pending delivery durations. Completing
+    the shipment takes two more: the courier's rating and earnings. Completing
+    it earlier than an order delivered already takes one more: the next
+    delivery's duration gets shorter.
+
+    Both updates return what the next steps need, so nothing is loaded
+    beforehand (requires UPDATE ... RETURNING: PostgreSQL, SQLite 3.35+).
+    """
+    qn = connection.ops.quote_name
+    db_complete_time = connection.ops.adapt_datetimefield_value(complete_time)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+                f'UPDATE {qn(Order._meta.db_table)} '
+                f'SET complete_time = %s, version = version + 1 '
+                f'WHERE id = %s AND shipment_id IS NOT NULL AND complete_time IS NULL '
+                f'RETURNING shipment_id, region_id, weight',
+                [db_complete_time, order_id])
+        row = cursor.fetchone()
+        if row is None:
+            # Delivered already
+            return
+        shipment_id, region_id, weight = row
+
+        # The delivery duration is the time since the previous delivery in the
+        # shipment or since the shipment's assign time. The deliveries are
+        # ordered by complete_time and id as in `_get_durations_and_regions`:
+        # an order may be completed earlier than the ones delivered already,
+        # then the next of those is delivered since this one.
+        orders_table = qn(Order._meta.db_table)
+        before = 'o.shipment_id = %s AND (o.complete_time < %s OR (o.complete_time = %s AND o.id < %s))'
+        after = 'o.shipment_id = %s AND (o.complete_time > %s OR (o.complete_time = %s AND o.id > %s))'
+        position = [shipment_id, db_complete_time, db_complete_time, order_id]
+        cursor.execute(
+                f'UPDATE {qn(Shipment._meta.db_table)} '
+                f'SET remaining_count = remaining_count - 1, '
+                f'    remaining_weight = CASE WHEN remaining_count = 1 THEN 0 ELSE remaining_weight - %s END, '
+                f'    complete_time = CASE WHEN remaining_count = 1 THEN %s ELSE complete_time END, '
+                f'    version = version + 1 '
+                f'WHERE id = %s '
+                f'RETURNING courier_id, initial_courier_type_id, remaining_count, assign_time, '
+                f'    (SELECT MAX(o.complete_time) FROM {orders_table} o WHERE {before}), '
+                f'    (SELECT o.complete_time FROM {orders_table} o WHERE {after} '
+                f'     ORDER BY o.complete_time, o.id LIMIT 1), '
+                f'    (SELECT o.region_id FROM {orders_table} o WHERE {after} '
+                f'     ORDER BY o.complete_time, o.id LIMIT 1)',
+                [weight, db_complete_time, shipment_id, *position, *position, *position])
+        (courier_id, courier_type_id, remaining_count, assign_time,
+         prev_complete_time, next_complete_time, next_region_id) = cursor.fetchone()
+
+    prev_complete_time = _to_datetime(prev_complete_time) or _to_datetime(assign_time)
+    duration = int((complete_time - prev_complete_time).total_seconds())
+    _add_pending_durations(courier_id, region_id, duration_sum=duration, duration_count=1)
+    if next_complete_time is not None:
+        next_complete_time = _to_datetime(next_complete_time)
+        _add_pending_durations(courier_id, next_region_id, duration_count=0, duration_sum=(
+                int((next_complete_time - complete_time).total_seconds())
+                - int((next_complete_time - prev_complete_time).total_seconds())))
+
+    if not remaining_count:
+        # This was the last order in the shipment, the courier's rating and
+        # earnings change
+        _commit_delivery_durations(courier_id=courier_id)
+        _add_shipment_earnings(courier_id=courier_id, courier_type_id=courier_type_id)
+    invalidate_courier_responses([courier_id])
+
+
+def _validate_completion(completion, courier_ids, orders, shipments):
+    if completion['courier_id'] not in courier_ids:
+        return {'courier_id': 'Courier does not exist.'}
+    order = orders.get(completion['order_id'])
+    if not order:
+        return {'order_id': 'Order does not exist.'}
+    shipment_id, _, _ = order
+    if not shipment_id:
+        return {'order_id': 'Order was not assigned to any of the couriers.'}
+    if shipments[shipment_id]['courier_id'] != completion['courier_id']:
+        return {'order_id': 'Order was assigned to the other courier.'}
+    if completion['complete_time'] < shipments[shipment_id]['assign_time']:
+        return {'complete_time': 'Can not be less than assign_time'}
+    return None
+
+
+@timed
+@transaction.atomic
+def complete_orders_batch(completions):
+    """The same as `complete_order` for many completions at once, e.g. the ones
+    queued by a courier's app while offline. `completions` are
+    [{'courier_id', 'order_id', 'complete_time'}, ...].
+
+    The completions are validated with a few set-based queries and applied in
+    the order of their complete times, the shipments whose last order is
+    delivered are closed. Return [{'order_id', 'status'[, 'errors']}, ...] in
+    the order of `completions`, the status is 'completed', 'already_completed'
+    (also for the orders repeated in the batch) or 'rejected'.
+    """
+    courier_ids = set(Courier.objects
+                      .filter(id__in={c['courier_id'] for c in completions})
+                      .values_list('id', flat=True))
+    orders = {}
+    rows = (Order.objects
+            .select_for_update(of=('self',))
+            .filter(id__in={c['order_id'] for c in completions})
+            .values_list('id', 'shipment', 'region', 'weight'))
+    for order_id, shipment_id, region_id, weight in rows:
+        orders[order_id] = (shipment_id, region_id, weight)
+
+    # The shipments are locked before their orders are counted, so the
+    # concurrent completions of their other orders wait for this batch
+    remaining_counts = dict(Shipment.objects
+                            .select_for_update()
+                            .filter(id__in={shipment_id for shipment_id, _, _ in orders.values() if shipment_id})
+                            .values_list('id', 'remaining_count'))
+
+    # The orders of the shipments, the delivered and the undelivered ones
+    shipments = {}
+    rows = (Order.objects
+            .filter(shipment__in=remaining_counts.keys())
+            .values_list('shipment', 'shipment__courier', 'shipment__initial_courier_type',
+                         'shipment__assign_time', 'id', 'region', 'complete_time'))
+    for shipment_id, courier_id, courier_type_id, assign_time, order_id, region_id, complete_time in rows:
+        shipment = shipments.setdefault(shipment_id, {
+                'courier_id': courier_id, 'courier_type_id': courier_type_id,
+                'assign_time': assign_time, 'complete_times': {}, 'regions': {},
+                'remaining': remaining_counts[shipment_id]})
+        shipment['complete_times'][order_id] = complete_time
+        shipment['regions'][order_id] = region_id
+
+    results = []
+    for completion in completions:
+        errors = _validate_completion(completion, courier_ids, orders, shipments)
+        result = {'order_id': completion['order_id'], 'status': 'rejected' if errors else None}
+        if errors:
+            result['errors'] = errors
+        results.append(result)
+
+    # Apply the valid completions in time order, the same way complete_order
+    # does one by one. The durations are added to the database per courier
+    # and region, before the shipment closure commits them.
+    completed_orders = {}
+    durations = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    closed_shipments = {}
+
+    def add_pending_durations(courier_id):
+        for region_id, (duration_sum, duration_count) in durations.pop(courier_id, {}).items():
+            _add_pending_durations(courier_id, region_id, duration_sum, duration_count)
+
+    valid = sorted((completion['complete_time'], i) for i, completion in enumerate(completions)
+                   if results[i]['status'] is None)
+    for complete_time, i in valid:
+        order_id = completions[i]['order_id']
+        shipment_id, region_id, _ = orders[order_id]
+        shipment = shipments[shipment_id]
+        if shipment['complete_times'][order_id]:
+            results[i]['status'] = 'already_completed'
+            continue
+
+        # Ordered by complete_time and id, see complete_order
+        delivered_times = sorted((t, i) for i, t in shipment['complete_times'].items() if t)
+        position = bisect_left(delivered_times, (complete_time, order_id))
+        prev_complete_time = delivered_times[position - 1][0] if position else shipment['assign_time']
+        region_durations = durations[shipment['courier_id']][region_id]
+        region_durations[0] += int((complete_time - prev_complete_time).total_seconds())
+        region_durations[1] += 1
+        if position < len(delivered_times):
+            next_complete_time, next_order_id = delivered_times[position]
+            next_region_durations = durations[shipment['courier_id']][shipment['regions'][next_order_id]]
+            next_region_durations[0] += (int((next_complete_time - complete_time).total_seconds())
+                                         - int((next_complete_time - prev_complete_time).total_seconds()))
+        shipment['complete_times'][order_id] = complete_time
+        shipment['remaining'] -= 1
+        if not shipment['remaining']:
+            closed_shipments[shipment_id] = complete_time
+            add_pending_durations(shipment['courier_id'])
+            _commit_delivery_durations(courier_id=shipment['courier_id'])
+        completed_orders[order_id] = complete_time
+        results[i]['status'] = 'completed'
+
+    Order.objects.bulk_update(
+            [Order(id=order_id, complete_time=complete_time, version=F('version') + 1)
+             for order_id, complete_time in completed_orders.items()],
+            fields=['complete_time', 'version'])
+    for courier_id in list(durations):
+        add_pending_durations(courier_id)
+
+    delivered = defaultdict(lambda: [0, 0])
+    for order_id in completed_orders:
+        shipment_id, _, weight = orders[order_id]
+        delivered[shipment_id][0] += 1
+        delivered[shipment_id][1] += weight
+    updated_shipments = [
+            Shipment(id=shipment_id,
+                     remaining_count=F('remaining_count') - delivered_count,
+                     remaining_weight=F('remaining_weight') - delivered_weight,
+                     complete_time=closed_shipments.get(shipment_id),
+                     version=F('version') + 1)
+            for shipment_id, (delivered_count, delivered_weight) in delivered.items()]
+    fields = ['remaining_count', 'remaining_weight', 'version']
+    # Only the closed shipments get their complete_time
+    Shipment.objects.bulk_update([s for s in updated_shipments if s.complete_time], fields=[*fields, 'complete_time'])
+    Shipment.objects.bulk_update([s for s in updated_shipments if not s.complete_time], fields=fields)
+    for shipment_id in closed_shipments:
+        _add_shipment_earnings(
+                courier_id=shipments[shipment_id]['courier_id'],
+                courier_type_id=shipments[shipment_id]['courier_type_id'])
+
+    invalidate_courier_responses({shipments[orders[order_id][0]]['courier_id'] for order_id in completed_orders})
+    return results
+
+
+def _evict_invalidated_orders(shipment, old_snapshot, new_snapshot):
+    """Throw out of the shipment only those undelivered orders which the
+    change of the courier has invalidated: the orders in the dropped regions,
+    the orders not suitable for the remaining shifts and, if the bag doesn't
+    fit the lowered capacity any more, the orders not fitting into it.
+    Return the IDs of the thrown out orders.
+    """
+    dropped_region_ids = set(old_snapshot['region_ids']) - set(new_snapshot['region_ids'])
+    shifts_removed = any(s not in new_snapshot['shifts'] for s in old_snapshot['shifts'])
+    # Whether the undelivered orders fit the capacity is known without
+    # loading them
+    overloaded = shipment.remaining_weight > new_snapshot['capacity']
+    if not (dropped_region_ids or shifts_removed or overloaded):
+        return []
+
+    orders = {}
+    rows = (Order.objects
+            .filter(shipment=shipment)
+            .not_delivered_yet()
+            .values_list('id', 'weight', 'region', 'delivery_intervals__start',
+                         'delivery_intervals__end'))
+    for order_id, weight, region_id, start, end in rows:
+        _, _, intervals = orders.setdefault(order_id, (weight, region_id, []))
+        if start is not None and any(start < shift['end'] and end > shift['start']
+                                     for shift in new_snapshot['shifts']):
+            intervals.append((start, end))
+
+    evicted_order_ids = []
+    candidates = {}
+    for order_id, (weight, region_id, intervals) in orders.items():
+        if region_id in dropped_region_ids or not intervals:
+            evicted_order_ids.append(order_id)
+        else:
+            candidates[order_id] = (weight, intervals)
+
+    if sum(weight for weight, _ in candidates.values()) > new_snapshot['capacity']:
+        bag = get_packing_strategy().pack(
+                capacity=new_snapshot['capacity'],
+                shifts=new_snapshot['shifts'],
+                candidates=candidates)
+        evicted_order_ids += [order_id for order_id in candidates if order_id not in bag]
+
+    if evicted_order_ids:
+        evicted_weight = sum(orders[order_id][0] for order_id in evicted_order_ids)
+        Order.objects.filter(id__in=evicted_order_ids).update(shipment=None, version=F('version') + 1)
+        Shipment.objects.filter(id=shipment.id).update(
+                order_count=F('order_count') - len(evicted_order_ids),
+                remaining_count=F('remaining_count') - len(evicted_order_ids),
+                total_weight=F('total_weight') - evicted_weight,
+                remaining_weight=F('remaining_weight') - evicted_weight,
+                version=F('version') + 1)
+        notify_orders_changed(evicted_order_ids)
+    return evicted_order_ids
+
+
+@timed
 @transaction.atomic
 def edit_courier(courier, courier_type=None, region_ids=None, work_shift_intervals=None):
     try:
-        courier.type = courier_type or courier.type
-        courier.region_ids = region_ids or courier.region_ids
-        courier.work_shift_intervals = work_shift_intervals or courier.work_shift_intervals
-        courier.save()
-
-        # Find suitable (for new parameters) orders among assigned but not yet
-        # delivered orders and throw out unsuitable or non-fitting into the bag
-        # ones
-        if courier.active_shipment:
-            orders = Order.objects.assigned_to_courier(courier).not_delivered_yet()
-            bag = _pack_a_bag(courier=courier, filtered_orders=orders)
-            non_fitting_orders = courier.active_shipment.orders.exclude(id__in=bag.keys())
-            non_fitting_orders.update(shipment=None)
+        active_shipment = courier.active_shipment
+        if active_shipment:
+            old_snapshot = _get_courier_snapshot(courier)
+
+        # Only the added and the removed rows are updated
+        changed = False
+        if courier_type and courier_type.pk != courier.type_id:
+            courier.type = courier_type
+            courier.save(update_fields=['type'])
+            changed = True
+        if region_ids:
+            changed |= courier.set_region_ids(region_ids)
+        if work_shift_intervals:
+            changed |= courier.set_work_shift_intervals(work_shift_intervals)
+        if not changed:
+            return courier
+        Courier.objects.filter(id=courier.id).update(version=F('version') + 1)
+
+        # Throw out of the bag the undelivered orders the change has made
+        # unsuitable or non-fitting into the bag
+        if active_shipment:
+            new_snapshot = _get_courier_snapshot(courier)
+            _evict_invalidated_orders(active_shipment, old_snapshot, new_snapshot)
     except IntegrityError:
         raise
+    invalidate_courier_responses([courier.id])
     return courier
 
 
-def _get_durations_and_regions(shipment):
-    result = []
+def _get_durations_and_regions(courier):
+    """Return [(duration, region_id, is_shipment_completed), ...] for all the
+    delivered orders of the courier in one query. The delivery duration of an
+    order is the time since the previous order of the shipment has been
+    delivered (found with LAG() over the shipment's delivered orders) or since
+    the assign time for the first one, in whole seconds.
+    """
+    rows = (Order.objects
+            .filter(shipment__courier=courier, complete_time__isnull=False)
+            .annotate(prev_complete_time=Window(
+                expression=Lag('complete_time'),
+                partition_by=[F('shipment')],
+                order_by=[F('complete_time').asc(), F('id').asc()]))
+            .values_list('complete_time', 'prev_complete_time', 'shipment__assign_time', 'region',
+                         'shipment__complete_time'))
+
+    return [(int((complete_time - (prev_complete_time or assign_time)).total_seconds()), region,
+             shipment_complete_time is not None)
+            for complete_time, prev_complete_time, assign_time, region, shipment_complete_time in rows]
 
-    complete_times_and_regions = (
-            shipment.orders
-            .order_by('complete_time')
-            .values_list('complete_time', 'region'))
 
-    for i, (complete_time, region) in enumerate(complete_times_and_regions):
-        if i > 0:
-            prev_complete_time, _ = complete_times_and_regions[i - 1]
-            duration = complete_time - prev_complete_time
+@transaction.atomic
+def rebuild_rating_aggregates(courier, dry_run=False):
+    """Recalculate the courier's `CourierRegionDurations` from the orders.
+    Return the regions whose stored durations have drifted (and unless
+    `dry_run` are fixed).
+    """
+    # The completions change the durations along with the shipment in
+    # progress, then the courier's earnings: both are locked in that order
+    # before the orders are read, the new assignments wait for the courier
+    list(Shipment.objects.select_for_update().filter(courier=courier, complete_time__isnull=True))
+    list(Courier.objects.select_for_update().filter(id=courier.id).values_list('id'))
+
+    durations = defaultdict(lambda: CourierRegionDurations(courier=courier))
+    for d, r, is_shipment_completed in _get_durations_and_regions(courier=courier):
+        region_durations = durations[r]
+        region_durations.region_id = r
+        if is_shipment_completed:
+            region_durations.duration_sum += d
+            region_durations.duration_count += 1
         else:
-            duration = complete_time - shipment.assign_time
-        result.append((int(duration.total_seconds()), region))
+            region_durations.pending_duration_sum += d
+            region_durations.pending_duration_count += 1
 
-    return result
+    fields = ['duration_sum', 'duration_count', 'pending_duration_sum', 'pending_duration_count']
+    stored = {d.region_id: d for d in courier.region_durations.select_for_update()}
+    drifted_region_ids = sorted(
+            region_id for region_id in stored.keys() | durations.keys()
+            if region_id not in stored or region_id not in durations or any(
+                getattr(stored[region_id], f) != getattr(durations[region_id], f) for f in fields))
 
+    if drifted_region_ids and not dry_run:
+        courier.region_durations.all().delete()
+        CourierRegionDurations.objects.bulk_create(durations.values())
+        Courier.objects.filter(id=courier.id).update(version=F('version') + 1)
+        invalidate_courier_responses([courier.id])
+    return drifted_region_ids
 
+
+@timed
 def calculate_rating(courier):
-    if courier.completed_shipments.exists():
-        regions_and_durations = defaultdict(list)
+    """Calculate the rating from the average delivery durations by regions
+    kept up to date by `complete_order`.
+    """
+    avg_durations = [
+            duration_sum / duration_count
+            for duration_sum, duration_count in (
+                courier.region_durations
+                .filter(duration_count__gt=0)
+                .values_list('duration_sum', 'duration_count'))]
+
+    if avg_durations:
+        t = min(avg_durations)
+        rating = (60 * 60 - min(t, 60 * 60)) / (60 * 60) * 5
+        return round(rating, 2)
 
-        for shipment in courier.completed_shipments:
-            durations_and_regions = _get_durations_and_regions(shipment=shipment)
-            for d, r in durations_and_regions:
-                regions_and_durations[r].append(d)
+    return None
 
-        avg_durations = [sum(ds) / len(ds) for ds in regions_and_durations.values()]
 
-        if avg_durations:
-            t = min(avg_durations)
-            rating = (60 * 60 - min(t, 60 * 60)) / (60 * 60) * 5
-            return round(rating, 2)
+EARNINGS_PER_SHIPMENT = 500
 
-    return None
 
+def _add_shipment_earnings(courier_id, courier_type_id):
+    """Pay the courier for the completed shipment according to the type the
+    courier had when the orders were assigned (`courier_type_id`).
+    """
+    coefficient = CourierType.objects.filter(code=courier_type_id).values('earnings_coefficient')
+    (Courier.objects
+     .filter(id=courier_id)
+     .update(earnings=Coalesce('earnings', 0) + EARNINGS_PER_SHIPMENT * Subquery(coefficient),
+             version=F('version') + 1))
 
-def calculate_earnings(courier):
-    def get_coefficient(courier_type_id):
-        if courier_type_id == 'foot':
-            return 2
-        elif courier_type_id == 'bike':
-            return 5
-        elif courier_type_id == 'car':
-            return 9
-        return 0
-
-    if courier.completed_shipments.exists():
-        types_and_counts = (
-                courier.completed_shipments
-                .values_list('initial_courier_type')
-                .annotate(count=Count('initial_courier_type')))
-        return 500 * sum(get_coefficient(t) * c for t, c in types_and_counts)
 
-    return None
+def get_expected_earnings(courier_ids):
+    """Calculate the earnings of the couriers from their completed shipments
+    in one query. Return {courier_id: earnings}, None for the couriers without
+    completed shipments.
+    """
+    earnings = dict.fromkeys(courier_ids)
+    shipments_earnings = (
+            Shipment.objects
+            .filter(courier__in=courier_ids, complete_time__isnull=False)
+            .values('courier')
+            .annotate(coefficients=Sum('initial_courier_type__earnings_coefficient'))
+            .values_list('courier', 'coefficients'))
+    for courier_id, coefficients in shipments_earnings:
+        earnings[courier_id] = EARNINGS_PER_SHIPMENT * coefficients
+    return earnings
+
+
+SHIPMENT_COUNTERS = ('order_count', 'remaining_count', 'total_weight', 'remaining_weight')
+
+
+def get_expected_shipment_counters(shipment_ids):
+    """Calculate the counters of the shipments from their orders in one query.
+    Return {shipment_id: {counter: value}}.
+    """
+    counters = {shipment_id: dict.fromkeys(SHIPMENT_COUNTERS, 0) for shipment_id in shipment_ids}
+    not_delivered = Q(complete_time__isnull=True)
+    rows = (Order.objects
+            .filter(shipment__in=shipment_ids)
+            .values('shipment')
+            .annotate(order_count=Count('id'),
+                      remaining_count=Count('id', filter=not_delivered),
+                      total_weight=Sum('weight'),
+                      remaining_weight=Sum('weight', filter=not_delivered))
+            .values('shipment', *SHIPMENT_COUNTERS))
+    for row in rows:
+        row['remaining_weight'] = row['remaining_weight'] or 0
+        counters[row.pop('shipment')] = row
+    return counters
+
+
+@timed
+def calculate_earnings(courier):
+    """Return the earnings kept up to date by `complete_order`."""
+    return courier.earnings
@@ -0,0 +1,180 @@
+"""Per-worker in-memory index of not assigned yet orders.
+
+The index is keyed by region. Every region keeps its orders sorted by weight
+and their delivery intervals (in minutes since midnight) sorted by start, so
+the candidates for a courier are found without going to the database. Only
+the final claim of the bag is done in the database, see
+`core.services.courier.assign_orders`.
+
+The index is only a cache: it is kept up to date by the signals in
+`core.signals` and by the service functions (which use queryset updates that
+don't send signals), and it is rebuilt from the database on the first use in
+the worker and after `DISPATCH_INDEX_MAX_AGE` seconds (other workers don't
+notify this one). The orders that the claim finds drifted are reloaded.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+
+from django.conf import settings
+from django.db import transaction
+
+from core.models import Order
+
+
+def _to_minutes(t):
+    return t.hour * 60 + t.minute
+
+
+class RegionIndex:
+    def __init__(self):
+        self.orders = {}      # order_id -> (weight, [(start, end), ...])
+        self.by_weight = []   # [(weight, order_id), ...]
+        self.intervals = []   # [(start_minute, end_minute, order_id), ...]
+
+    def add(self, order_id, weight, intervals):
+        self.orders[order_id] = (weight, intervals)
+        insort(self.by_weight, (weight, order_id))
+        for start, end in intervals:
+            insort(self.intervals, (_to_minutes(start), _to_minutes(end), order_id))
+
+    def remove(self, order_id):
+        weight, intervals = self.orders.pop(order_id)
+        del self.by_weight[bisect_left(self.by_weight, (weight, order_id))]
+        for start, end in intervals:
+            item = (_to_minutes(start), _to_minutes(end), order_id)
+            del self.intervals[bisect_left(self.intervals, item)]
+
+    def get_candidates(self, capacity, shifts, candidates):
+        """Add to `candidates` the orders not heavier than `capacity` with the
+        delivery intervals overlapping the shifts.
+        """
+        shifts = [(_to_minutes(s['start']), _to_minutes(s['end'])) for s in shifts]
+        latest_end = max(end for _, end in shifts)
+        n_fitting = bisect_right(self.by_weight, (capacity, float('inf')))
+        n_early = bisect_left(self.intervals, (latest_end,))
+
+        # Go through the shorter of the two lists, checking the other condition
+        if n_fitting < n_early:
+            order_ids = (order_id for _, order_id in self.by_weight[:n_fitting])
+        else:
+            order_ids = {order_id for _, _, order_id in self.intervals[:n_early]
+                         if self.orders[order_id][0] <= capacity}
+
+        for order_id in order_ids:
+            weight, intervals = self.orders[order_id]
+            overlapping = [
+                    (start, end) for start, end in intervals
+                    if any(_to_minutes(start) < shift_end and _to_minutes(end) > shift_start
+                           for shift_start, shift_end in shifts)]
+            if overlapping:
+                candidates[order_id] = (weight, overlapping)
+
+
+class DispatchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._regions = {}
+        self._order_regions = {}
+        self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def rebuild(self):
+        rows = (Order.objects
+                .not_assigned_yet()
+                .values_list('id', 'weight', 'region', 'delivery_intervals__start',
+                             'delivery_intervals__end'))
+        with self._lock:
+            self._regions = {}
+            self._order_regions = {}
+            self._add_rows(rows)
+            self._built_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        max_age = getattr(settings, 'DISPATCH_INDEX_MAX_AGE', 30)
+        if not self.is_built or time.monotonic() - self._built_at > max_age:
+            self.rebuild()
+
+    def _add_rows(self, rows):
+        orders = {}
+        for order_id, weight, region_id, start, end in rows:
+            _, _, intervals = orders.setdefault(order_id, (weight, region_id, []))
+            if start is not None:
+                intervals.append((start, end))
+
+        for order_id, (weight, region_id, intervals) in orders.items():
+            self._discard(order_id)
+            self._regions.setdefault(region_id, RegionIndex()).add(order_id, weight, intervals)
+            self._order_regions[order_id] = region_id
+
+    def _discard(self, order_id):
+        region_id = self._order_regions.pop(order_id, None)
+        if region_id is not None:
+            self._regions[region_id].remove(order_id)
+
+    def remove_orders(self, order_ids):
+        with self._lock:
+            for order_id in order_ids:
+                self._discard(order_id)
+
+    def refresh_orders(self, order_ids):
+        """Reload the orders from the database: the assigned and the deleted
+        ones are dropped from the index, the rest are (re)added.
+        """
+        if not self.is_built:
+            return
+        order_ids = set(order_ids)
+        rows = (Order.objects
+                .not_assigned_yet()
+                .filter(id__in=order_ids)
+                .values_list('id', 'weight', 'region', 'delivery_intervals__start',
+                             'delivery_intervals__end'))
+        with self._lock:
+            self.remove_orders(order_ids)
+            self._add_rows(rows)
+
+    def get_candidates(self, snapshot):
+        """The same as `core.services.courier._get_candidates` for not
+        assigned yet orders, but without querying the database.
+        """
+        candidates = {}
+        if not snapshot['shifts']:
+            return candidates
+
+        with self._lock:
+            self._ensure_fresh()
+            for region_id in snapshot['region_ids']:
+                region = self._regions.get(region_id)
+                if region:
+                    region.get_candidates(snapshot['capacity'], snapshot['shifts'], candidates)
+        return candidates
+
+
+dispatch_index = DispatchIndex()
+
+
+def is_dispatch_index_enabled():
+    return getattr(settings, 'DISPATCH_INDEX_ENABLED', False)
+
+
+def notify_orders_changed(order_ids):
+    """Refresh the orders in the index once the current transaction commits.
+    Must be called by the code changing orders without sending model signals
+    (queryset updates, bulk creates).
+    """
+    if is_dispatch_index_enabled() and dispatch_index.is_built:
+        order_ids = list(order_ids)
+        transaction.on_commit(lambda: dispatch_index.refresh_orders(order_ids))
+
+
+def notify_orders_assigned(order_ids):
+    if is_dispatch_index_enabled() and dispatch_index.is_built:
+        order_ids = list(order_ids)
+        transaction.on_commit(lambda: dispatch_index.remove_orders(order_ids))
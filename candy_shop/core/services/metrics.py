@@ -0,0 +1,208 @@
+"""Performance metrics in the Prometheus text format.
+
+Every process keeps its counters and histograms in memory. With `METRICS_DIR`
+set (the gunicorn workers must share it) the process also writes their
+snapshot to `METRICS_DIR/metrics-<pid>.json` at most every
+`METRICS_FLUSH_INTERVAL` seconds, and `GET /metrics` served by any of the
+workers sums the snapshots of all of them (including the ones that have
+exited, so the counters never go back). The directory should be emptied when
+the server starts.
+
+What is measured per request (see `core.middleware.MetricsMiddleware`) is
+accumulated in a context variable, so the queries run in the thread pool of
+the async views are counted as well.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+HISTOGRAMS = {
+    # name: (buckets, help)
+    'candy_shop_http_request_duration_seconds': (LATENCY_BUCKETS, 'Request latency'),
+    'candy_shop_http_db_queries': (COUNT_BUCKETS, 'Database queries per request'),
+    'candy_shop_http_db_duration_seconds': (LATENCY_BUCKETS, 'Database time per request'),
+    'candy_shop_http_render_duration_seconds': (LATENCY_BUCKETS, 'Response rendering (JSON) time per request'),
+    'candy_shop_http_response_size_bytes': (SIZE_BUCKETS, 'Response body size'),
+    'candy_shop_service_duration_seconds': (LATENCY_BUCKETS, 'Service function latency'),
+}
+COUNTERS = {
+    'candy_shop_http_requests_total': 'Requests by route, method and status',
+}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}    # (name, labels) -> value
+            self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+            self._flushed_at = 0
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][0]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(buckets) + 2)
+            # Not cumulative here, see render
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(values)]
+                               for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """Write the snapshot of this process to `METRICS_DIR`."""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        now = time.monotonic()
+        if not directory or (not force and now - self._flushed_at < getattr(settings, 'METRICS_FLUSH_INTERVAL', 1)):
+            return
+        self._flushed_at = now
+        path = Path(directory) / f'metrics-{os.getpid()}.json'
+        tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        tmp_path.write_text(json.dumps(self.snapshot()))
+        # The readers never see a half written file
+        os.replace(tmp_path, path)
+
+
+registry = Registry()
+
+
+def _collect():
+    """The snapshots of all the processes summed up: this one's live and the
+    others' from `METRICS_DIR`.
+    """
+    snapshots = [registry.snapshot()]
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory:
+        own_file = f'metrics-{os.getpid()}.json'
+        for path in sorted(Path(directory).glob('metrics-*.json')):
+            if path.name != own_file:
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    # Deleted or being replaced
+                    continue
+
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+def _format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def render_metrics():
+    """All the metrics in the Prometheus text exposition format 0.0.4."""
+    counters, histograms = _collect()
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    for name, (buckets, help_text) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (histogram_name, labels), values in sorted(histograms.items()):
+            if histogram_name != name:
+                continue
+            cumulative = 0
+            for bucket, count in zip(list(buckets) + ['+Inf'], values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, le=bucket)} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {values[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+@contextmanager
+def collect_request_stats():
+    stats = RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+def record_queries(execute, sql, params, many, context):
+    """Execute wrapper of all the database connections, see core.signals."""
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def record_render_time(seconds):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.render_time += seconds
+
+
+def timed(func):
+    """Record the latency of the service function."""
+    labels = {'function': func.__name__}
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registry.observe('candy_shop_service_duration_seconds', labels, time.perf_counter() - started)
+
+    return wrapper
@@ -0,0 +1,112 @@
+"""Cache of the courier responses.
+
+Every courier has a version in the cache, the responses are cached under the
+keys containing it. The service functions changing the courier bump the
+version once their transaction commits, so a response built from the old
+data can only be stored under the old key and is never read again (it expires
+after `RESPONSE_CACHE_TIMEOUT`).
+
+The cache is only used with `RESPONSE_CACHE_ENABLED`. Its backend is the
+`RESPONSE_CACHE_ALIAS` cache of the `CACHES` setting, which all the workers
+must share (e.g. memcached) to see each other's bumps: with a local memory
+cache per worker the others would serve the old responses until they expire.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from core.routers import pinned_to_primary
+
+_STATS = ('hits', 'misses', 'invalidations')
+
+
+def is_response_cache_enabled():
+    return getattr(settings, 'RESPONSE_CACHE_ENABLED', False)
+
+
+def get_response_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _incr(cache, key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The key is missing (has never been set or has been evicted)
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+
+
+def _version_key(courier_id):
+    return f'courier:{courier_id}:version'
+
+
+def get_courier_version(courier_id):
+    cache = get_response_cache()
+    version = cache.get(_version_key(courier_id))
+    if version is None:
+        # Start from the current time, not from zero, so that an evicted
+        # version never goes back to the one of the cached responses
+        cache.add(_version_key(courier_id), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(courier_id))
+    return version
+
+
+def _bump_courier_versions(courier_ids):
+    cache = get_response_cache()
+    for courier_id in courier_ids:
+        try:
+            cache.incr(_version_key(courier_id))
+        except ValueError:
+            cache.set(_version_key(courier_id), time.time_ns(), timeout=None)
+        _incr(cache, 'response_cache:invalidations')
+
+
+def invalidate_courier_responses(courier_ids):
+    """Bump the versions of the couriers once the current transaction commits.
+    Must be called by the code changing the couriers, their shipments and
+    orders.
+    """
+    courier_ids = list(courier_ids)
+    if courier_ids and is_response_cache_enabled():
+        transaction.on_commit(lambda: _bump_courier_versions(courier_ids))
+
+
+def get_cached_courier_response(name, courier_id, build, version=None):
+    """Return the cached response data `name` of the courier or the one
+    returned by `build()`, caching it. `build` may return None (e.g. for
+    not found couriers) which isn't cached.
+
+    `version` is the courier's version in the database the response's ETag
+    is derived from. The data is cached along with it and only returned for
+    the same version, so that a stale entry (e.g. read before the bump of
+    the cache version) never gets the new ETag.
+    """
+    if not is_response_cache_enabled():
+        return build()
+
+    cache = get_response_cache()
+    # The version is read before the data to never cache the old data under
+    # the new version
+    key = f'courier:{courier_id}:{get_courier_version(courier_id)}:{name}'
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        _incr(cache, 'response_cache:hits')
+        return entry[1]
+
+    _incr(cache, 'response_cache:misses')
+    # A lagging replica could still have the data older than the version
+    with pinned_to_primary():
+        data = build()
+    if data is not None:
+        # The data is at least as new as the version read before it
+        cache.set(key, (version, data), timeout=getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+    return data
+
+
+def get_response_cache_stats():
+    cache = get_response_cache()
+    stats = cache.get_many([f'response_cache:{s}' for s in _STATS])
+    return {s: stats.get(f'response_cache:{s}', 0) for s in _STATS}
@@ -0,0 +1,90 @@
+"""Capture of the API traffic for the offline replays, see
+`core.middleware.TrafficCaptureMiddleware` and the replay_traffic command.
+
+Every process appends its records to `TRAFFIC_CAPTURE_DIR/traffic-<pid>.ndjson`
+(rotated by size, the same way the log files are), so the gunicorn workers
+never write to the same file. A record is a JSON object per line:
+{'ts', 'method', 'path', 'query', 'content_type', 'request_body', 'status',
+'response_body', 'duration_ms'}, the bodies are the parsed JSON (or the text
+of the other types) with the `TRAFFIC_CAPTURE_REDACTED_FIELDS` values masked,
+or None with `'*_truncated': True` if they are larger than
+`TRAFFIC_CAPTURE_MAX_BODY_BYTES`. No headers but the content type are kept.
+"""
+import json
+import logging
+import os
+import threading
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from django.conf import settings
+
+REDACTED = '***'
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+def _get_capture_logger():
+    path = Path(settings.TRAFFIC_CAPTURE_DIR) / f'traffic-{os.getpid()}.ndjson'
+    with _loggers_lock:
+        if path not in _loggers:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(
+                    path, maxBytes=getattr(settings, 'TRAFFIC_CAPTURE_MAX_BYTES', 10 * 1024 * 1024),
+                    backupCount=getattr(settings, 'TRAFFIC_CAPTURE_BACKUP_COUNT', 5), delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger = logging.getLogger(f'core.traffic.{path}')
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            _loggers[path] = logger
+        return _loggers[path]
+
+
+def redact(value, fields):
+    if isinstance(value, dict):
+        return {k: REDACTED if k in fields else redact(v, fields) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v, fields) for v in value]
+    return value
+
+
+def sanitize_body(body, content_type):
+    """The body as recorded: parsed JSON with the sensitive fields masked,
+    the text of the other types.
+    """
+    if not body:
+        return None
+    fields = set(getattr(settings, 'TRAFFIC_CAPTURE_REDACTED_FIELDS', []))
+    if content_type.split(';')[0].strip() == 'application/json':
+        try:
+            return redact(json.loads(body), fields)
+        except ValueError:
+            pass
+    try:
+        return body.decode()
+    except UnicodeDecodeError:
+        return None
+
+
+def write_record(record):
+    _get_capture_logger().info(json.dumps(record, separators=(',', ':'), default=str))
+
+
+def read_records(paths):
+    """The records of the capture files (and of the files of the capture
+    directories) merged in the order of time.
+    """
+    files = []
+    for path in map(Path, paths):
+        files += sorted(path.glob('traffic-*.ndjson*')) if path.is_dir() else [path]
+
+    records = []
+    for file in files:
+        with open(file) as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record['ts'])
+    return records
@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import Courier, Order, OrderDeliveryInterval, Shipment
+from core.services.dispatch_index import dispatch_index, is_dispatch_index_enabled
+from core.services.metrics import record_queries
+from core.services.response_cache import invalidate_courier_responses
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def refresh_order_in_dispatch_index(sender, instance, **kwargs):
+    if is_dispatch_index_enabled() and dispatch_index.is_built:
+        transaction.on_commit(lambda: dispatch_index.refresh_orders([instance.id]))
+
+
+@receiver(post_delete, sender=Order)
+def update_shipment_counters(sender, instance, **kwargs):
+    if instance.shipment_id:
+        counters = {'order_count': F('order_count') - 1,
+                    'total_weight': F('total_weight') - instance.weight}
+        if not instance.complete_time:
+            counters.update(remaining_count=F('remaining_count') - 1,
+                            remaining_weight=F('remaining_weight') - instance.weight)
+        Shipment.objects.filter(id=instance.shipment_id).update(**counters, version=F('version') + 1)
+
+
+@receiver(post_save, sender=OrderDeliveryInterval)
+@receiver(post_delete, sender=OrderDeliveryInterval)
+def refresh_interval_order_in_dispatch_index(sender, instance, **kwargs):
+    if is_dispatch_index_enabled() and dispatch_index.is_built:
+        transaction.on_commit(lambda: dispatch_index.refresh_orders([instance.order_id]))
+
+
+@receiver(post_delete, sender=Shipment)
+def invalidate_dispatch_index(sender, instance, **kwargs):
+    # Orders of the deleted shipment are released by a bulk SET NULL
+    if is_dispatch_index_enabled():
+        transaction.on_commit(dispatch_index.invalidate)
+
+
+@receiver(post_delete, sender=Courier)
+def invalidate_courier_responses_on_delete(sender, instance, **kwargs):
+    invalidate_courier_responses([instance.id])
+
+
+@receiver(connection_created)
+def install_query_metrics(sender, connection, **kwargs):
+    # The wrapper object outlives the reconnections
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
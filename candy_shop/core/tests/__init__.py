@@ -1 +1,10 @@
 from .services import *
+from .dispatch_index import *
+from .views import *
+from .rating import *
+from .response_cache import *
+from .fast import *
+from .asynchronous import *
+from .replicas import *
+from .metrics import *
+from .traffic import *
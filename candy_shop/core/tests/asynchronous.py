@@ -0,0 +1,103 @@
+import json
+import tempfile
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.test import AsyncRequestFactory, LiveServerTestCase, TransactionTestCase
+
+from core.models import Courier, Order
+from core.views import CourierDetailView, OrderViewSet, async_read_view
+
+
+class AsyncReadViewTestCase(TransactionTestCase):
+    # The reads run in the pool threads with their own connections, so the
+    # data must be committed (and the courier types restored)
+    fixtures = ['test_set1']
+    serialized_rollback = True
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    async def test_read(self):
+        view = async_read_view(OrderViewSet.as_view({'get': 'retrieve'}))
+        response = await view(self.factory.get('/orders/3'), pk='3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['order_id'], 3)
+
+        response = await view(self.factory.get('/orders/70'), pk='70')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_conditional_read(self):
+        view = async_read_view(CourierDetailView.as_view())
+        response = await view(self.factory.get('/couriers/1'), pk=1)
+        self.assertEqual(response.status_code, 200)
+
+        # The async factory takes the header names, not the META keys
+        request = self.factory.get('/couriers/1', **{'If-None-Match': response['ETag']})
+        response = await view(request, pk=1)
+        self.assertEqual(response.status_code, 304)
+
+    async def test_write(self):
+        view = async_read_view(CourierDetailView.as_view())
+        request = self.factory.patch('/couriers/1', {'regions': [33]}, content_type='application/json')
+        response = await view(request, pk=1)
+        self.assertEqual(response.status_code, 200)
+
+        response = await view(self.factory.get('/couriers/1'), pk=1)
+        self.assertEqual(json.loads(response.content)['regions'], [33])
+
+
+class LoadTestCommandTestCase(LiveServerTestCase):
+    fixtures = ['test_set1']
+    serialized_rollback = True
+
+    def test_load_test(self):
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.json') as output:
+            call_command('load_test', f'--url={self.live_server_url}', '--concurrency', '1', '2',
+                         '--duration=0.3', f'--output={output.name}', stdout=StringIO())
+            results = json.load(output)['results']
+
+            out = StringIO()
+            call_command('load_test', f'--url={self.live_server_url}', '--concurrency', '2',
+                         '--duration=0.3', f'--baseline={output.name}', stdout=out)
+
+        self.assertEqual([r['concurrency'] for r in results], [1, 2])
+        for result in results:
+            self.assertGreater(result['requests'], 0)
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertIn('vs baseline', out.getvalue())
+        self.assertEqual(Courier.objects.count(), 3)
+
+
+class ASGIImportTestCase(TransactionTestCase):
+    fixtures = ['test_set1']
+    serialized_rollback = True
+
+    async def test_import(self):
+        body = '\n'.join(json.dumps({'order_id': i, 'weight': 1, 'region': 12, 'delivery_hours': ['09:00-18:00']})
+                         for i in range(10, 15)).encode()
+        communicator = ApplicationCommunicator(get_asgi_application(), {
+                'type': 'http', 'asgi': {'version': '3'}, 'http_version': '1.1', 'method': 'POST',
+                'scheme': 'http', 'path': '/orders/import', 'raw_path': b'/orders/import',
+                'query_string': b'chunk_size=2', 'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'content-type', b'application/x-ndjson'),
+                            (b'content-length', str(len(body)).encode())],
+                'client': ('127.0.0.1', 1), 'server': ('testserver', 80)})
+        await communicator.send_input({'type': 'http.request', 'body': body})
+
+        start = await communicator.receive_output(timeout=10)
+        self.assertEqual(start['status'], 200)
+        content = b''
+        while True:
+            message = await communicator.receive_output(timeout=10)
+            content += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        reports = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([report['created'] for report in reports], [2, 2, 1])
+        self.assertEqual(reports[-1]['total_created'], 5)
+        self.assertEqual(await sync_to_async(Order.objects.filter(id__gte=10).count)(), 5)
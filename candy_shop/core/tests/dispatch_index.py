@@ -0,0 +1,41 @@
+from django.test import TestCase, override_settings
+
+from core.models import Courier, Order
+from core.services import courier as courier_service
+from core.services.dispatch_index import dispatch_index
+
+
+@override_settings(DISPATCH_INDEX_ENABLED=True)
+class DispatchIndexTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def setUp(self):
+        dispatch_index.rebuild()
+
+    def tearDown(self):
+        dispatch_index.invalidate()
+
+    def test_candidates_match_database(self):
+        for courier in Courier.objects.all():
+            snapshot = courier_service._get_courier_snapshot(courier)
+            candidates = courier_service._get_candidates(
+                    snapshot=snapshot, filtered_orders=Order.objects.not_assigned_yet())
+            self.assertEqual(dispatch_index.get_candidates(snapshot), candidates)
+
+    def test_assign_orders(self):
+        order_ids, _ = courier_service.assign_orders(courier_id=1)
+        self.assertEqual(order_ids, [1, 3])
+
+        dispatch_index.refresh_orders(order_ids)
+        snapshot = courier_service._get_courier_snapshot(Courier.objects.get(id=3))
+        self.assertEqual(dispatch_index.get_candidates(snapshot), {})
+
+    def test_drift(self):
+        # The order is assigned behind the index's back, e.g. by the other worker
+        shipment = Courier.objects.get(id=3).shipments.create(initial_courier_type_id='car')
+        Order.objects.filter(id=3).update(shipment=shipment)
+
+        order_ids, _ = courier_service.assign_orders(courier_id=1)
+        self.assertEqual(order_ids, [1])
+        self.assertEqual(Order.objects.get(id=3).shipment, shipment)
+        self.assertFalse(Courier.objects.get(id=1).shipments.filter(orders=None).exists())
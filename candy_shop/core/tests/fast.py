@@ -0,0 +1,93 @@
+import random
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from core.renderers import FastJSONRenderer
+from core.services.response_cache import get_response_cache
+
+
+def generate_data(client, n_couriers, n_orders, seed=0):
+    rnd = random.Random(seed)
+
+    def intervals():
+        return [f'{h:02d}:{rnd.choice((0, 5, 30)):02d}-{h + rnd.randint(1, 3):02d}:{rnd.choice((0, 45)):02d}'
+                for h in rnd.sample(range(8, 20), rnd.randint(1, 3))]
+
+    couriers = client.post('/couriers', {'data': [
+        {'courier_id': i, 'courier_type': rnd.choice(('foot', 'bike', 'car')),
+         'regions': rnd.sample(range(1, 10), rnd.randint(1, 4)), 'working_hours': intervals()}
+        for i in range(10, 10 + n_couriers)]}, format='json')
+    orders = client.post('/orders', {'data': [
+        {'order_id': i, 'weight': rnd.randint(1, 5000) / 100, 'region': rnd.randint(1, 9),
+         'delivery_hours': intervals()}
+        for i in range(10, 10 + n_orders)]}, format='json')
+    assert couriers.status_code == orders.status_code == 201
+
+
+class FastSerializationTestCase(APITestCase):
+    """The fast path gives byte for byte the same responses as the DRF
+    serializers and the JSON renderer.
+    """
+    fixtures = ['test_set1']
+
+    def setUp(self):
+        get_response_cache().clear()
+        generate_data(self.client, n_couriers=30, n_orders=200)
+
+    def assertSameContent(self, method, url, data=None):
+        responses = []
+        for enabled in (False, True):
+            get_response_cache().clear()
+            with self.settings(FAST_SERIALIZATION_ENABLED=enabled):
+                responses.append(getattr(self.client, method)(url, data, format='json'))
+        drf, fast = responses
+        self.assertEqual(drf.status_code, fast.status_code)
+        self.assertEqual(drf.content, fast.content)
+        self.assertEqual(JSONRenderer().render(drf.data), drf.content)
+        return fast
+
+    def test_orders(self):
+        self.assertSameContent('get', '/orders/3')
+        self.assertSameContent('get', '/orders/100')
+        self.assertSameContent('get', '/orders/1000')
+        url = '/orders?page_size=37'
+        while url:
+            url = self.assertSameContent('get', url).json()['next']
+
+    def test_couriers(self):
+        self.assertSameContent('get', '/couriers/1/')
+        self.assertSameContent('get', '/couriers/25/')
+        self.assertSameContent('get', '/couriers/1000/')
+        url = '/couriers?page_size=7'
+        while url:
+            url = self.assertSameContent('get', url).json()['next']
+
+    def test_shipments(self):
+        with self.settings(FAST_SERIALIZATION_ENABLED=True):
+            fast = self.client.post('/orders/assign', {'courier_id': 10}, format='json')
+            self.client.post('/orders/assign_batch', {'courier_ids': [11, 12]}, format='json')
+        # Delivery is in progress, so the same orders are returned again
+        drf = self.client.post('/orders/assign', {'courier_id': 10}, format='json')
+        self.assertEqual(drf.content, fast.content)
+        self.assertSameContent('post', '/orders/assign', {'courier_id': 10})
+        self.assertSameContent('post', '/orders/assign', {'courier_id': 2})
+        self.assertSameContent('post', '/orders/assign_batch', {'courier_ids': [11, 12, 13]})
+
+
+class FastJSONRendererTestCase(APITestCase):
+    def test_same_bytes(self):
+        data = [
+            {'a': Decimal('0.23'), 'b': 15.0, 'c': None, 'd': True, 'e': 'Задача ', 2: [1, 2]},
+            {'time': datetime(2021, 3, 1, 9, 5, 3, 123456, tzinfo=timezone.utc),
+             'naive': datetime(2021, 3, 1, 9), 'date': datetime(2021, 3, 1).date(),
+             'duration': timedelta(minutes=5), 'big': 2 ** 70},
+            [], {}, 'string', 0,
+        ]
+        for item in data:
+            self.assertEqual(FastJSONRenderer().render(item), JSONRenderer().render(item))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        self.assertEqual(FastJSONRenderer().render({'a': [1]}, 'application/json; indent=2'),
+                         JSONRenderer().render({'a': [1]}, 'application/json; indent=2'))
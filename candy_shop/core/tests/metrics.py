@@ -0,0 +1,64 @@
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from rest_framework.test import APITestCase
+
+from core.models import Courier
+from core.services import courier as courier_service
+from core.services.metrics import registry, render_metrics
+
+
+def get_sample(text, name, **labels):
+    """The value of the sample `name` with (at least) the `labels`."""
+    for line in text.splitlines():
+        match = re.fullmatch(rf'{name}(?:{{(.*)}})? (\S+)', line)
+        if match:
+            sample_labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(1) or ''))
+            if all(sample_labels.get(k) == str(v) for k, v in labels.items()):
+                return float(match.group(2))
+    return None
+
+
+class MetricsTestCase(APITestCase):
+    fixtures = ['test_set1']
+
+    def setUp(self):
+        registry.reset()
+
+    def test_requests(self):
+        self.client.get('/couriers/1')
+        self.client.get('/couriers/2')
+        self.client.get('/couriers/70')
+        text = self.client.get('/metrics').content.decode()
+
+        route = {'route': 'couriers/<int:pk>', 'method': 'GET'}
+        self.assertEqual(get_sample(text, 'candy_shop_http_requests_total', **route, status=200), 2)
+        self.assertEqual(get_sample(text, 'candy_shop_http_requests_total', **route, status=404), 1)
+        self.assertEqual(get_sample(text, 'candy_shop_http_request_duration_seconds_count', **route), 3)
+        self.assertEqual(get_sample(text, 'candy_shop_http_request_duration_seconds_bucket', **route, le='+Inf'), 3)
+        self.assertGreater(get_sample(text, 'candy_shop_http_db_queries_sum', **route), 0)
+        self.assertGreater(get_sample(text, 'candy_shop_http_db_duration_seconds_sum', **route), 0)
+        self.assertGreater(get_sample(text, 'candy_shop_http_render_duration_seconds_sum', **route), 0)
+        self.assertGreater(get_sample(text, 'candy_shop_http_response_size_bytes_sum', **route), 0)
+
+    def test_services(self):
+        courier_service.assign_orders(courier_id=1)
+        courier_service.calculate_rating(Courier.objects.get(id=1))
+        text = render_metrics()
+        for function in ('assign_orders', '_claim_a_bag', 'calculate_rating'):
+            self.assertEqual(get_sample(text, 'candy_shop_service_duration_seconds_count', function=function), 1)
+
+    def test_processes(self):
+        registry.inc('candy_shop_http_requests_total', {'route': 'orders', 'method': 'GET', 'status': 200})
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            registry.flush(force=True)
+            snapshot = json.loads(next(Path(directory).glob('metrics-*.json')).read_text())
+            # The snapshot of the other worker
+            (Path(directory) / f'metrics-{os.getpid() + 1}.json').write_text(json.dumps(snapshot))
+            text = render_metrics()
+
+        self.assertEqual(
+                get_sample(text, 'candy_shop_http_requests_total', route='orders', method='GET', status=200), 2)
@@ -0,0 +1,339 @@
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.management.commands import check_shipment_counters
+from core.models import Courier, CourierRegionDurations, Order, Region, Shipment
+from core.services import courier as courier_service
+
+
+def _reference_durations_and_regions(shipment):
+    result = []
+
+    complete_times_and_regions = (
+            shipment.orders
+            .order_by('complete_time', 'id')
+            .values_list('complete_time', 'region'))
+
+    for i, (complete_time, region) in enumerate(complete_times_and_regions):
+        if i > 0:
+            prev_complete_time, _ = complete_times_and_regions[i - 1]
+            duration = complete_time - prev_complete_time
+        else:
+            duration = complete_time - shipment.assign_time
+        result.append((int(duration.total_seconds()), region))
+
+    return result
+
+
+def undo_deliveries():
+    """Make all the orders undelivered and the shipments in progress."""
+    Order.objects.update(complete_time=None)
+    Shipment.objects.update(complete_time=None, remaining_count=F('order_count'),
+                            remaining_weight=F('total_weight'))
+
+
+def get_counters_drift():
+    shipment_ids = list(Shipment.objects.values_list('id', flat=True))
+    return check_shipment_counters.check_batch(shipment_ids, fix=False)
+
+
+def reference_rating(courier):
+    """The rating calculated shipment by shipment in Python."""
+    if courier.completed_shipments.exists():
+        regions_and_durations = defaultdict(list)
+
+        for shipment in courier.completed_shipments:
+            durations_and_regions = _reference_durations_and_regions(shipment=shipment)
+            for d, r in durations_and_regions:
+                regions_and_durations[r].append(d)
+
+        avg_durations = [sum(ds) / len(ds) for ds in regions_and_durations.values()]
+
+        if avg_durations:
+            t = min(avg_durations)
+            rating = (60 * 60 - min(t, 60 * 60)) / (60 * 60) * 5
+            return round(rating, 2)
+
+    return None
+
+
+def generate_deliveries(couriers, n_shipments, max_orders, regions, seed=0):
+    """Create the shipments of random sizes with orders delivered at random
+    intervals. The last shipment of every courier stays in progress.
+    """
+    rnd = random.Random(seed)
+    order_id = Order.all_objects.order_by('-id').values_list('id', flat=True).first() or 0
+    start = datetime(2021, 3, 1, 9, tzinfo=timezone.utc)
+    orders = []
+
+    for courier in couriers:
+        for i in range(n_shipments):
+            assign_time = start + timedelta(days=i, seconds=rnd.randrange(3600))
+            shipment = Shipment.objects.create(
+                    courier=courier, initial_courier_type=courier.type, assign_time=assign_time)
+            complete_time = assign_time
+            for _ in range(rnd.randint(1, max_orders)):
+                order_id += 1
+                complete_time += timedelta(seconds=rnd.randrange(1, 2 * 3600))
+                orders.append(Order(id=order_id, weight=Decimal('0.5'), region=rnd.choice(regions),
+                                    shipment=shipment, complete_time=complete_time))
+            if i < n_shipments - 1:
+                shipment.complete_time = complete_time
+                shipment.save()
+            else:
+                orders[-1].complete_time = None
+
+    Order.objects.bulk_create(orders)
+    shipment_ids = {order.shipment_id for order in orders}
+    for shipment_id, counters in courier_service.get_expected_shipment_counters(shipment_ids).items():
+        Shipment.objects.filter(id=shipment_id).update(**counters)
+
+
+class CalculateRatingTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def test_test_set1(self):
+        courier_service.assign_orders(courier_id=1)
+        now = datetime.now(timezone.utc)
+        courier_service.complete_order(order_id=3, complete_time=now + timedelta(minutes=10))
+        courier = Courier.objects.get(id=1)
+        self.assertIsNone(courier_service.calculate_rating(courier))
+
+        courier_service.complete_order(order_id=1, complete_time=now + timedelta(minutes=40))
+        for courier in Courier.objects.all():
+            self.assertEqual(courier_service.calculate_rating(courier), reference_rating(courier))
+        self.assertIsNotNone(courier_service.calculate_rating(Courier.objects.get(id=1)))
+
+    def test_completions(self):
+        """The durations maintained by complete_order give the same rating."""
+        regions = Region.objects.bulk_create(Region(id=i) for i in range(100, 105))
+        couriers = Courier.objects.bulk_create(Courier(id=i, type_id='car') for i in range(100, 105))
+        generate_deliveries(couriers, n_shipments=5, max_orders=8, regions=regions)
+
+        completions = list(Order.objects
+                           .filter(complete_time__isnull=False)
+                           .order_by('complete_time')
+                           .values_list('id', 'complete_time'))
+        undo_deliveries()
+        for order_id, complete_time in completions:
+            courier_service.complete_order(order_id=order_id, complete_time=complete_time)
+
+        self.assertEqual(get_counters_drift(), [])
+        for courier in couriers:
+            self.assertEqual(courier_service.rebuild_rating_aggregates(courier, dry_run=True), [])
+            self.assertEqual(courier_service.calculate_rating(courier), reference_rating(courier))
+
+    def test_rebuild(self):
+        regions = Region.objects.bulk_create(Region(id=i) for i in range(100, 110))
+        couriers = Courier.objects.bulk_create(Courier(id=i, type_id='car') for i in range(100, 120))
+        generate_deliveries(couriers, n_shipments=8, max_orders=12, regions=regions)
+
+        for courier in couriers:
+            self.assertIsNone(courier_service.calculate_rating(courier))
+            self.assertTrue(courier_service.rebuild_rating_aggregates(courier, dry_run=True))
+            self.assertTrue(courier_service.rebuild_rating_aggregates(courier))
+            self.assertEqual(courier_service.rebuild_rating_aggregates(courier), [])
+
+            rating = courier_service.calculate_rating(courier)
+            self.assertIsNotNone(rating)
+            self.assertEqual(rating, reference_rating(courier))
+
+    def test_queries(self):
+        regions = Region.objects.bulk_create(Region(id=i) for i in range(100, 103))
+        couriers = Courier.objects.bulk_create(Courier(id=i, type_id='car') for i in range(100, 101))
+        generate_deliveries(couriers, n_shipments=20, max_orders=20, regions=regions)
+        courier_service.rebuild_rating_aggregates(couriers[0])
+
+        with self.assertNumQueries(1):
+            courier_service.calculate_rating(couriers[0])
+
+
+class CompleteOrderTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def assertNumStatements(self, num, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            func(*args, **kwargs)
+        statements = [q['sql'] for q in context.captured_queries
+                      if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+        self.assertEqual(len(statements), num, '\n'.join(statements))
+
+    def test_queries(self):
+        courier_service.assign_orders(courier_id=1)
+        CourierRegionDurations.objects.bulk_create(
+                CourierRegionDurations(courier_id=1, region_id=i) for i in Region.objects.values_list('id', flat=True))
+        now = datetime.now(timezone.utc)
+
+        # The order, the shipment's counter and the pending durations
+        self.assertNumStatements(
+                3, courier_service.complete_order, order_id=3, complete_time=now + timedelta(minutes=10))
+        # The last order: the rating and the earnings as well
+        self.assertNumStatements(
+                5, courier_service.complete_order, order_id=1, complete_time=now + timedelta(minutes=40))
+        # Delivered already
+        self.assertNumStatements(
+                1, courier_service.complete_order, order_id=1, complete_time=now + timedelta(minutes=50))
+
+        shipment = Shipment.objects.get(courier=1)
+        self.assertEqual(shipment.remaining_count, 0)
+        self.assertEqual(shipment.complete_time, now + timedelta(minutes=40))
+        self.assertEqual(Order.objects.get(id=1).complete_time, now + timedelta(minutes=40))
+        self.assertEqual(courier_service.calculate_rating(Courier.objects.get(id=1)),
+                         reference_rating(Courier.objects.get(id=1)))
+        self.assertEqual(Courier.objects.get(id=1).earnings, 1000)
+
+    def test_out_of_order(self):
+        """An order completed earlier than the ones delivered already
+        shortens the delivery duration of the next of them.
+        """
+        courier_service.assign_orders(courier_id=1)
+        now = datetime.now(timezone.utc)
+        courier_service.complete_order(order_id=3, complete_time=now + timedelta(minutes=40))
+        courier_service.complete_order(order_id=1, complete_time=now + timedelta(minutes=10))
+
+        courier = Courier.objects.get(id=1)
+        self.assertEqual(courier_service.rebuild_rating_aggregates(courier, dry_run=True), [])
+        self.assertEqual(courier_service.calculate_rating(courier), reference_rating(courier))
+
+    def test_reversed_completions(self):
+        regions = Region.objects.bulk_create(Region(id=i) for i in range(100, 103))
+        couriers = Courier.objects.bulk_create(
+                Courier(id=i, type_id=t) for i, t in zip(range(100, 103), ('foot', 'bike', 'car')))
+        generate_deliveries(couriers, n_shipments=3, max_orders=5, regions=regions)
+
+        # Reversed within every shipment, a courier has one in progress at a time
+        completions = list(Order.objects
+                           .filter(complete_time__isnull=False)
+                           .order_by('shipment__assign_time', '-complete_time', '-id')
+                           .values_list('id', 'complete_time'))
+        undo_deliveries()
+        for order_id, complete_time in completions:
+            courier_service.complete_order(order_id=order_id, complete_time=complete_time)
+
+        for courier in Courier.objects.filter(id__in=[c.id for c in couriers]):
+            self.assertEqual(courier_service.rebuild_rating_aggregates(courier, dry_run=True), [])
+            self.assertEqual(courier_service.calculate_rating(courier), reference_rating(courier))
+
+
+class CalculateEarningsTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def test_test_set1(self):
+        courier_service.assign_orders(courier_id=1)
+        now = datetime.now(timezone.utc)
+        courier_service.complete_order(order_id=3, complete_time=now + timedelta(minutes=10))
+        self.assertIsNone(courier_service.calculate_earnings(Courier.objects.get(id=1)))
+
+        courier_service.complete_order(order_id=1, complete_time=now + timedelta(minutes=40))
+        courier_service.complete_order(order_id=1, complete_time=now + timedelta(minutes=50))
+        self.assertEqual(courier_service.calculate_earnings(Courier.objects.get(id=1)), 1000)
+        self.assertEqual(courier_service.get_expected_earnings([1, 2]), {1: 1000, 2: None})
+
+    def test_completions(self):
+        """The earnings maintained by complete_order match the shipments."""
+        regions = Region.objects.bulk_create(Region(id=i) for i in range(100, 103))
+        couriers = Courier.objects.bulk_create(
+                Courier(id=i, type_id=t) for i, t in zip(range(100, 103), ('foot', 'bike', 'car')))
+        generate_deliveries(couriers, n_shipments=4, max_orders=3, regions=regions)
+
+        completions = list(Order.objects
+                           .filter(complete_time__isnull=False)
+                           .order_by('complete_time')
+                           .values_list('id', 'complete_time'))
+        undo_deliveries()
+        for order_id, complete_time in completions:
+            courier_service.complete_order(order_id=order_id, complete_time=complete_time)
+
+        expected = courier_service.get_expected_earnings([c.id for c in couriers])
+        self.assertEqual(expected, {100: 3 * 1000, 101: 3 * 2500, 102: 3 * 4500})
+        for courier in Courier.objects.filter(id__in=expected):
+            self.assertEqual(courier_service.calculate_earnings(courier), expected[courier.id])
+
+    def test_reconcile(self):
+        Courier.objects.filter(id=2).update(earnings=100)
+        out = StringIO()
+        call_command('reconcile_earnings', '--fix', '--workers=1', stdout=out)
+        self.assertIn('Courier(2): stored 100, expected None', out.getvalue())
+        self.assertIsNone(Courier.objects.get(id=2).earnings)
+
+
+class CompleteOrdersBatchTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def test_same_as_one_by_one(self):
+        regions = Region.objects.bulk_create(Region(id=i) for i in range(100, 105))
+        couriers = Courier.objects.bulk_create(
+                Courier(id=i, type_id=('foot', 'bike', 'car')[i % 3]) for i in range(100, 106))
+        generate_deliveries(couriers, n_shipments=5, max_orders=8, regions=regions)
+
+        completions = list(Order.objects
+                           .filter(complete_time__isnull=False)
+                           .values('shipment__courier', 'id', 'complete_time'))
+        completions = [{'courier_id': c['shipment__courier'], 'order_id': c['id'],
+                        'complete_time': c['complete_time']} for c in completions]
+        random.Random(0).shuffle(completions)
+        undo_deliveries()
+        results = courier_service.complete_orders_batch(completions + completions[:3])
+
+        self.assertEqual([r['order_id'] for r in results], [c['order_id'] for c in completions + completions[:3]])
+        self.assertEqual({r['status'] for r in results[:-3]}, {'completed'})
+        self.assertEqual({r['status'] for r in results[-3:]}, {'already_completed'})
+        self.assertEqual(Shipment.objects.filter(complete_time__isnull=True).count(), len(couriers))
+        self.assertEqual(get_counters_drift(), [])
+        for courier in Courier.objects.filter(id__in=[c.id for c in couriers]):
+            self.assertEqual(courier_service.rebuild_rating_aggregates(courier, dry_run=True), [])
+            self.assertEqual(courier_service.calculate_rating(courier), reference_rating(courier))
+            self.assertEqual(courier.earnings, courier_service.get_expected_earnings([courier.id])[courier.id])
+
+    def test_out_of_order(self):
+        courier_service.assign_orders(courier_id=1)
+        now = datetime.now(timezone.utc)
+        courier_service.complete_order(order_id=3, complete_time=now + timedelta(minutes=40))
+        results = courier_service.complete_orders_batch(
+                [{'courier_id': 1, 'order_id': 1, 'complete_time': now + timedelta(minutes=10)}])
+
+        self.assertEqual(results, [{'order_id': 1, 'status': 'completed'}])
+        courier = Courier.objects.get(id=1)
+        self.assertEqual(courier_service.rebuild_rating_aggregates(courier, dry_run=True), [])
+        self.assertEqual(courier_service.calculate_rating(courier), reference_rating(courier))
+
+    def test_endpoint(self):
+        courier_service.assign_orders(courier_id=1)
+        now = datetime.now(timezone.utc)
+        data = [
+            {'courier_id': 1, 'order_id': 3, 'complete_time': (now + timedelta(minutes=20)).isoformat()},
+            {'courier_id': 1, 'order_id': 1, 'complete_time': (now + timedelta(minutes=10)).isoformat()},
+            {'courier_id': 1, 'order_id': 2, 'complete_time': now.isoformat()},
+            {'courier_id': 2, 'order_id': 1, 'complete_time': now.isoformat()},
+            {'courier_id': 7, 'order_id': 1, 'complete_time': now.isoformat()},
+            {'courier_id': 1, 'order_id': 70, 'complete_time': now.isoformat()},
+            {'courier_id': 1, 'order_id': 1, 'complete_time': (now - timedelta(days=1)).isoformat()},
+        ]
+        response = self.client.post('/orders/complete_batch', {'data': data}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'orders': [
+            {'order_id': 3, 'status': 'completed'},
+            {'order_id': 1, 'status': 'completed'},
+            {'order_id': 2, 'status': 'rejected',
+             'errors': {'order_id': 'Order was not assigned to any of the couriers.'}},
+            {'order_id': 1, 'status': 'rejected', 'errors': {'order_id': 'Order was assigned to the other courier.'}},
+            {'order_id': 1, 'status': 'rejected', 'errors': {'courier_id': 'Courier does not exist.'}},
+            {'order_id': 70, 'status': 'rejected', 'errors': {'order_id': 'Order does not exist.'}},
+            {'order_id': 1, 'status': 'rejected', 'errors': {'complete_time': 'Can not be less than assign_time'}},
+        ]})
+        self.assertIsNotNone(Shipment.objects.get(courier=1).complete_time)
+        self.assertEqual(Courier.objects.get(id=1).earnings, 1000)
+
+        response = self.client.post('/orders/complete_batch', {'data': [{'order_id': 1}]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
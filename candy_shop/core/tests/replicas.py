@@ -0,0 +1,84 @@
+import time
+from unittest import skipUnless
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITransactionTestCase
+
+from core.middleware import ReplicaStickinessMiddleware
+from core.models import Courier
+from core.routers import ReplicaRouter, pinned_to_primary, replica_reads
+
+REPLICAS = [alias for alias in settings.DATABASES if alias != 'default']
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_routing(self):
+        self.assertEqual(self.router.db_for_read(Courier), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Courier), 'replica')
+            self.assertEqual(self.router.db_for_write(Courier), 'default')
+            with pinned_to_primary():
+                self.assertEqual(self.router.db_for_read(Courier), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'core'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Courier), 'default')
+
+    def test_stickiness(self):
+        def get_response(request):
+            # Only the read views read from the replicas
+            if request.method == 'GET':
+                with replica_reads():
+                    return HttpResponse(self.router.db_for_read(Courier))
+            return HttpResponse(self.router.db_for_read(Courier))
+
+        middleware = ReplicaStickinessMiddleware(get_response)
+        factory = RequestFactory()
+
+        response = middleware(factory.get('/couriers/1'))
+        self.assertEqual(response.content, b'replica')
+        self.assertNotIn(middleware.cookie_name, response.cookies)
+
+        response = middleware(factory.post('/orders/assign'))
+        self.assertEqual(response.content, b'default')
+        cookie = response.cookies[middleware.cookie_name]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_STICKINESS_SECONDS)
+
+        factory.cookies[middleware.cookie_name] = cookie.value
+        self.assertEqual(middleware(factory.get('/couriers/1')).content, b'default')
+        factory.cookies[middleware.cookie_name] = str(time.time() - 1)
+        self.assertEqual(middleware(factory.get('/couriers/1')).content, b'replica')
+
+
+@skipUnless(REPLICAS, 'Requires a replica database alias (e.g. a test mirror of default)')
+class ReplicaReadsTestCase(APITransactionTestCase):
+    # The router keeps the reads of a transaction on the primary
+    databases = '__all__'
+    fixtures = ['test_set1']
+    serialized_rollback = True
+
+    def replica_queries(self, method, *args, **kwargs):
+        with CaptureQueriesContext(connections[REPLICAS[0]]) as context:
+            getattr(self.client, method)(*args, **kwargs)
+        return context.captured_queries
+
+    def test_read_your_writes(self):
+        with self.settings(DATABASE_REPLICAS=REPLICAS[:1]):
+            self.assertTrue(self.replica_queries('get', '/couriers'))
+            self.assertTrue(self.replica_queries('get', '/orders/1'))
+            self.assertFalse(self.replica_queries('post', '/orders/assign', {'courier_id': 1}, format='json'))
+            # The client is pinned to the primary now
+            self.assertFalse(self.replica_queries('get', '/couriers/1'))
+
+            self.client.cookies.clear()
+            self.assertTrue(self.replica_queries('get', '/couriers'))
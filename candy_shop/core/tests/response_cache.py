@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import F
+from django.test import override_settings
+from rest_framework.test import APITransactionTestCase
+
+from core.models import Courier
+from core.services import courier as courier_service
+from core.services.response_cache import get_response_cache, get_response_cache_stats
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTestCase(APITransactionTestCase):
+    # The versions are bumped on commit, so the transactions must commit (and
+    # the courier types created by the migrations must be restored)
+    fixtures = ['test_set1']
+    serialized_rollback = True
+
+    def setUp(self):
+        get_response_cache().clear()
+
+    def test_hits(self):
+        first = self.client.get('/couriers/1').json()
+        # Only the version lookup for the ETag
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/couriers/1').json(), first)
+        self.client.get('/couriers/1/')
+        self.client.get('/couriers/1/')
+        self.assertEqual(get_response_cache_stats(), {'hits': 2, 'misses': 2, 'invalidations': 0})
+
+    def test_edit_courier(self):
+        self.client.get('/couriers/1')
+        self.client.patch('/couriers/1', {'regions': [33]}, format='json')
+        self.assertEqual(self.client.get('/couriers/1').json()['regions'], [33])
+        self.assertEqual(self.client.get('/couriers/1/').json()['regions'], [33])
+        self.assertEqual(get_response_cache_stats()['invalidations'], 1)
+
+    def test_complete_order(self):
+        self.assertIsNone(self.client.get('/couriers/1').json().get('earnings'))
+        courier_service.assign_orders(courier_id=1)
+        now = datetime.now(timezone.utc)
+        courier_service.complete_order(order_id=1, complete_time=now + timedelta(minutes=10))
+        courier_service.complete_order(order_id=3, complete_time=now + timedelta(minutes=20))
+        self.assertEqual(self.client.get('/couriers/1').json()['earnings'], 1000)
+
+    def test_stale_entry(self):
+        etag = self.client.get('/couriers/1')['ETag']
+        # Changed, but the cache version isn't bumped (yet)
+        Courier.objects.filter(id=1).update(type_id='car', version=F('version') + 1)
+        response = self.client.get('/couriers/1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['courier_type'], 'car')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_delete(self):
+        self.client.get('/couriers/2/')
+        Courier.objects.filter(id=2).delete()
+        self.assertEqual(self.client.get('/couriers/2/').status_code, 404)
+
+    def test_stats_endpoint(self):
+        self.client.get('/couriers/3')
+        self.assertEqual(self.client.get('/couriers/cache_stats').json(),
+                         {'hits': 0, 'misses': 1, 'invalidations': 0})
+
+    def test_disabled(self):
+        with self.settings(RESPONSE_CACHE_ENABLED=False):
+            self.client.get('/couriers/1')
+            self.client.patch('/couriers/1', {'regions': [33]}, format='json')
+            self.assertEqual(self.client.get('/couriers/1').json()['regions'], [33])
+        self.assertEqual(get_response_cache_stats(), {'hits': 0, 'misses': 0, 'invalidations': 0})
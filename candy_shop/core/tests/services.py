@@ -1,8 +1,20 @@
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time
 from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from core.models import Courier, Order
+from core.management.commands import benchmark
+from core.models import Courier, CourierType, Order, OrderDeliveryInterval, Region, Shipment
 from core.services import courier as courier_service
 
 
@@ -49,3 +61,294 @@ class AssignOrdersTestCase(TestCase):
         orders = Order.objects.not_assigned_yet()
         bag = courier_service._pack_a_bag(courier=courier, filtered_orders=orders)
         self.assertEqual(bag, {1: Decimal('0.23'), 3: Decimal('0.01')})
+
+    def test_fill_the_bag_queries_do_not_depend_on_shifts(self):
+        courier = Courier.objects.select_related('type').get(id=1)
+        for hour in range(14, 22):
+            courier.work_shifts.create(start=f'{hour}:10', end=f'{hour}:50')
+        orders = Order.objects.not_assigned_yet()
+        # Regions, work shifts and candidate orders with their intervals
+        with self.assertNumQueries(3):
+            bag = courier_service._pack_a_bag(courier=courier, filtered_orders=orders)
+        self.assertEqual(bag, {1: Decimal('0.23'), 3: Decimal('0.01')})
+
+    def test_assign_orders(self):
+        order_ids, assign_time = courier_service.assign_orders(courier_id=1)
+        self.assertEqual(order_ids, [1, 3])
+        self.assertIsNotNone(assign_time)
+        self.assertEqual(courier_service.assign_orders(courier_id=1), (order_ids, assign_time))
+
+
+class PackingStrategyTestCase(TestCase):
+    shifts = [{'start': time(9), 'end': time(12)}, {'start': time(14), 'end': time(18)}]
+    candidates = {
+        1: (Decimal('0.50'), [(time(10), time(11))]),
+        2: (Decimal('0.30'), [(time(9), time(10))]),
+        3: (Decimal('0.30'), [(time(15), time(16))]),
+        4: (Decimal('0.45'), [(time(11), time(15))]),
+    }
+
+    def test_greedy(self):
+        bag = courier_service.GreedyPackingStrategy().pack(Decimal('1'), self.shifts, self.candidates)
+        self.assertEqual(bag, {2: Decimal('0.30'), 4: Decimal('0.45')})
+
+    def test_knapsack(self):
+        bag = courier_service.KnapsackPackingStrategy().pack(Decimal('1'), self.shifts, self.candidates)
+        self.assertEqual(bag, {1: Decimal('0.50'), 4: Decimal('0.45')})
+
+        bag = courier_service.KnapsackPackingStrategy().pack(Decimal('2'), self.shifts, self.candidates)
+        self.assertEqual(set(bag), {1, 2, 3, 4})
+
+    def test_knapsack_fallback(self):
+        strategy = courier_service.KnapsackPackingStrategy(max_cells=100)
+        bag = strategy.pack(Decimal('1'), self.shifts, self.candidates)
+        self.assertEqual(bag, {2: Decimal('0.30'), 4: Decimal('0.45')})
+
+    @override_settings(PACKING_STRATEGY={
+        'BACKEND': 'core.services.courier.KnapsackPackingStrategy',
+        'OPTIONS': {'max_seconds': 1}})
+    def test_get_packing_strategy(self):
+        strategy = courier_service.get_packing_strategy()
+        self.assertIsInstance(strategy, courier_service.KnapsackPackingStrategy)
+        self.assertEqual(strategy.max_seconds, 1)
+
+
+class AssignOrdersBatchTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def test_assign_orders_batch(self):
+        result = courier_service.assign_orders_batch(courier_ids=[1, 2, 3])
+        self.assertEqual(set(result), {1, 2, 3})
+
+        # Courier 2 has the fewest candidates (order 3 only), so it goes first,
+        # then courier 1 wins the tie with courier 3 by ID
+        self.assertEqual(result[2][0], [3])
+        self.assertEqual(result[1][0], [1])
+        self.assertEqual(result[3], ([], None))
+        self.assertEqual(result[1][1], result[2][1])
+        for courier_id in (1, 2):
+            self.assertEqual(
+                    list(Order.objects.assigned_to_courier(courier_id).values_list('id', flat=True)),
+                    result[courier_id][0])
+
+        # Deliveries are in progress now
+        self.assertEqual(courier_service.assign_orders_batch(courier_ids=[1, 2]),
+                         {1: result[1], 2: result[2]})
+
+    def test_shipment_ids_not_returned(self):
+        # Django 3.1 returns the IDs from bulk_create on PostgreSQL only
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            result = courier_service.assign_orders_batch(courier_ids=[1, 2])
+        for courier_id in (1, 2):
+            self.assertEqual(
+                    list(Order.objects.assigned_to_courier(courier_id).values_list('id', flat=True)),
+                    result[courier_id][0])
+
+    @override_settings(ASSIGN_BATCH_PROCESSES=2)
+    def test_independent_region_groups(self):
+        Courier.objects.get(id=2).courier_regions.update(region_id=33)
+        Order.objects.filter(id=2).update(region_id=33, weight=Decimal('5'))
+        result = courier_service.assign_orders_batch(courier_ids=[1, 2])
+        self.assertEqual(result[1][0], [1, 3])
+        self.assertEqual(result[2][0], [2])
+
+
+class EditCourierTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def setUp(self):
+        courier_service.assign_orders(courier_id=1)
+        self.courier = Courier.objects.get(id=1)
+
+    def assigned_order_ids(self):
+        return set(Order.objects.assigned_to_courier(self.courier).values_list('id', flat=True))
+
+    def test_widening_keeps_orders(self):
+        courier_service.edit_courier(
+                self.courier, region_ids=[1, 12, 22, 33],
+                work_shift_intervals=[{'start': time(9), 'end': time(11)},
+                                      {'start': time(11, 35), 'end': time(14, 5)},
+                                      {'start': time(18), 'end': time(20)}])
+        self.assertEqual(list(self.courier.region_ids), [1, 12, 22, 33])
+        self.assertEqual(len(self.courier.work_shift_intervals), 3)
+        self.assertEqual(self.assigned_order_ids(), {1, 3})
+
+    def test_unchanged_courier_costs_no_writes(self):
+        with CaptureQueriesContext(connection) as context:
+            courier_service.edit_courier(
+                    self.courier, region_ids=[22, 12, 1],
+                    work_shift_intervals=[{'start': datetime(1900, 1, 1, 9), 'end': datetime(1900, 1, 1, 11)},
+                                          {'start': time(11, 35), 'end': time(14, 5)}])
+        statements = [q['sql'].split()[0] for q in context.captured_queries]
+        self.assertNotIn('INSERT', statements)
+        self.assertNotIn('UPDATE', statements)
+        self.assertNotIn('DELETE', statements)
+
+    def test_dropped_region(self):
+        courier_service.edit_courier(self.courier, region_ids=[1, 12])
+        self.assertEqual(list(self.courier.region_ids), [1, 12])
+        self.assertEqual(self.assigned_order_ids(), {1})
+
+    def test_removed_shift(self):
+        courier_service.edit_courier(
+                self.courier, work_shift_intervals=[{'start': time(12), 'end': time(14)}])
+        self.assertEqual(list(self.courier.work_shift_intervals), [{'start': time(12), 'end': time(14)}])
+        self.assertEqual(self.assigned_order_ids(), {1})
+
+    def test_lowered_capacity(self):
+        courier_type = CourierType.objects.create(code='scooter', capacity=Decimal('0.1'))
+        courier_service.edit_courier(self.courier, courier_type=courier_type)
+        self.assertEqual(self.assigned_order_ids(), {3})
+
+        courier_type = CourierType.objects.create(code='cart', capacity=Decimal('0.05'))
+        courier_service.edit_courier(self.courier, courier_type=courier_type)
+        self.assertEqual(self.assigned_order_ids(), {3})
+
+    def test_delivered_orders_stay(self):
+        courier_service.complete_order(order_id=3, complete_time=timezone.now())
+        courier_service.edit_courier(self.courier, region_ids=[1])
+        self.assertEqual(self.assigned_order_ids(), {3})
+
+
+class ShipmentCountersTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def assertCounters(self, **counters):
+        shipment = Shipment.objects.get(courier=1)
+        self.assertEqual({c: getattr(shipment, c) for c in counters}, counters)
+
+    def test_maintained(self):
+        courier_service.assign_orders(courier_id=1)
+        weights = dict(Order.objects.values_list('id', 'weight'))
+        self.assertCounters(order_count=2, remaining_count=2,
+                            total_weight=weights[1] + weights[3], remaining_weight=weights[1] + weights[3])
+
+        courier_type = CourierType.objects.create(code='scooter', capacity=Decimal('0.1'))
+        courier_service.edit_courier(Courier.objects.get(id=1), courier_type=courier_type)
+        self.assertCounters(order_count=1, remaining_count=1,
+                            total_weight=weights[3], remaining_weight=weights[3])
+
+        courier_service.complete_order(order_id=3, complete_time=timezone.now())
+        self.assertCounters(order_count=1, remaining_count=0, total_weight=weights[3], remaining_weight=0)
+
+        Order.objects.get(id=3).delete()
+        self.assertCounters(order_count=0, remaining_count=0, total_weight=0, remaining_weight=0)
+
+    def test_fitting_bag_is_not_reloaded(self):
+        courier_service.assign_orders(courier_id=1)
+        courier_type = CourierType.objects.create(code='van', capacity=Decimal('1'))
+        with CaptureQueriesContext(connection) as context:
+            courier_service.edit_courier(Courier.objects.get(id=1), courier_type=courier_type)
+        self.assertFalse([q for q in context.captured_queries if 'core_orderdeliveryinterval' in q['sql']])
+
+    def test_check_command(self):
+        courier_service.assign_orders(courier_id=1)
+        Shipment.objects.update(remaining_count=5)
+
+        out = StringIO()
+        call_command('check_shipment_counters', stdout=out)
+        self.assertIn('stored order_count=2, remaining_count=5', out.getvalue())
+        self.assertIn('drift found for 1', out.getvalue())
+
+        call_command('check_shipment_counters', '--fix', '--active', stdout=out)
+        self.assertEqual(Shipment.objects.get(courier=1).remaining_count, 2)
+        out = StringIO()
+        call_command('check_shipment_counters', stdout=out)
+        self.assertIn('drift found for 0', out.getvalue())
+
+
+class ExplainHotPathsTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def test_explain(self):
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.json') as output:
+            call_command('explain_hot_paths', '--couriers=20', '--shipments=3', '--pool=50', '--repeat=2',
+                         f'--output={output.name}', stdout=StringIO())
+            results = json.load(output)['results']
+
+        self.assertEqual([r['query'] for r in results],
+                         ['candidates', 'active_shipment', 'undelivered_orders'])
+        self.assertIn('shipment_active_idx', results[1]['plan'])
+        # The dataset is rolled back
+        self.assertEqual(Courier.objects.count(), 3)
+
+
+class BenchmarkTestCase(TestCase):
+    fixtures = ['test_set1']
+
+    def test_benchmark(self):
+        options = ['--couriers=5', '--orders=40', '--regions=3', '--reads=10', '--edits=5']
+        with tempfile.NamedTemporaryFile(mode='r+', suffix='.json') as output:
+            call_command('benchmark', *options, f'--output={output.name}', stdout=StringIO())
+            results = json.load(output)['results']
+            self.assertEqual(list(results), ['import', 'assign', 'complete', 'stats', 'edit'])
+            for result in results.values():
+                self.assertEqual(result['errors'], 0)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            # The dataset is rolled back
+            self.assertEqual(Courier.objects.count(), 3)
+
+            # Far faster baseline with fewer queries
+            for result in results.values():
+                result.update(p50_ms=0, p95_ms=0, p99_ms=0, rps=10 ** 6, queries_per_request=1, max_queries=1)
+            output.seek(0)
+            output.truncate()
+            json.dump({'results': results}, output)
+            output.flush()
+            with self.assertRaisesMessage(CommandError, 'regressions'):
+                call_command('benchmark', *options, '--scenarios', 'stats', f'--baseline={output.name}',
+                             stdout=StringIO(), stderr=StringIO())
+
+    def test_compare_percentiles(self):
+        base = {'requests': 40, 'p50_ms': 10, 'p95_ms': 12, 'p99_ms': 12, 'rps': 100,
+                'queries_per_request': 5, 'max_queries': 5}
+        thresholds = {'latency': 0.25, 'throughput': 0.25, 'queries': 0}
+        # The p95 and p99 of 40 requests are the noise of the slowest ones
+        self.assertEqual(benchmark.compare({'assign': dict(base, p95_ms=16, p99_ms=16)}, {'assign': base},
+                                           thresholds), [])
+        self.assertEqual(benchmark.compare({'assign': dict(base, p50_ms=13)}, {'assign': base}, thresholds),
+                         [('assign', 'p50_ms', 10, 13)])
+        self.assertEqual(benchmark.compare({'assign': dict(base, p95_ms=16, p99_ms=16)}, {'assign': base},
+                                           thresholds, min_tail_samples=2), [('assign', 'p95_ms', 12, 16)])
+
+        # The median of the repeated runs
+        runs = [{'assign': dict(base, p50_ms=p50, errors=errors)} for p50, errors in ((10, 0), (30, 1), (11, 0))]
+        self.assertEqual(benchmark.merge_runs(runs)['assign'], dict(base, p50_ms=11, errors=1))
+
+@skipUnless(connection.features.has_select_for_update_skip_locked,
+            'Requires SELECT ... FOR UPDATE SKIP LOCKED')
+class AssignOrdersConcurrencyTestCase(TransactionTestCase):
+    n_couriers = 30
+    n_orders = 300
+
+    def setUp(self):
+        region = Region.objects.create(id=1)
+        for i in range(1, self.n_couriers + 1):
+            courier = Courier.objects.create(id=i, type_id='foot')
+            courier.courier_regions.create(region=region)
+            courier.work_shifts.create(start=time(9), end=time(18))
+        Order.objects.bulk_create(
+                Order(id=i, weight=Decimal('0.5') + i % 7, region=region)
+                for i in range(1, self.n_orders + 1))
+        OrderDeliveryInterval.objects.bulk_create(
+                OrderDeliveryInterval(order_id=i, start=time(10), end=time(12))
+                for i in range(1, self.n_orders + 1))
+
+    @staticmethod
+    def assign(courier_id):
+        try:
+            order_ids, _ = courier_service.assign_orders(courier_id=courier_id)
+            return courier_id, order_ids
+        finally:
+            connection.close()
+
+    def test_no_double_assignment(self):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = dict(executor.map(self.assign, range(1, self.n_couriers + 1)))
+
+        assigned = [order_id for order_ids in results.values() for order_id in order_ids]
+        self.assertEqual(len(assigned), len(set(assigned)))
+        for courier_id, order_ids in results.items():
+            self.assertEqual(
+                    sorted(Order.objects.assigned_to_courier(courier_id).values_list('id', flat=True)),
+                    order_ids)
@@ -0,0 +1,77 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import Client, LiveServerTestCase
+
+from core.services.traffic import read_records, sanitize_body
+
+
+class TrafficCaptureTestCase(LiveServerTestCase):
+    fixtures = ['test_set1']
+    serialized_rollback = True
+
+    def capture(self, directory, **settings):
+        with self.settings(TRAFFIC_CAPTURE_ENABLED=True, TRAFFIC_CAPTURE_DIR=directory, **settings):
+            # The middleware is configured when the client's handler is built
+            client = Client()
+            client.get('/couriers/1')
+            client.get('/couriers/70')
+            client.get('/orders/1')
+            client.post('/orders/assign', {'courier_id': 1}, content_type='application/json')
+            client.get('/metrics')
+        return read_records([directory])
+
+    def test_capture(self):
+        with tempfile.TemporaryDirectory() as directory:
+            records = self.capture(directory)
+
+        self.assertEqual([(r['method'], r['path'], r['status']) for r in records], [
+                ('GET', '/couriers/1', 200), ('GET', '/couriers/70', 404), ('GET', '/orders/1', 200),
+                ('POST', '/orders/assign', 200)])
+        self.assertEqual(records[0]['response_body']['courier_id'], 1)
+        self.assertEqual(records[3]['request_body'], {'courier_id': 1})
+        self.assertFalse(records[3]['request_body_truncated'])
+        self.assertLessEqual(records[0]['ts'], records[1]['ts'])
+
+    def test_sampling_and_limits(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(self.capture(directory, TRAFFIC_CAPTURE_SAMPLE_RATE=0), [])
+        with tempfile.TemporaryDirectory() as directory:
+            records = self.capture(directory, TRAFFIC_CAPTURE_MAX_BODY_BYTES=5)
+        self.assertTrue(all(r['response_body'] is None and r['response_body_truncated'] for r in records))
+        self.assertTrue(records[3]['request_body_truncated'])
+
+    def test_unknown_length(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(TRAFFIC_CAPTURE_ENABLED=True, TRAFFIC_CAPTURE_DIR=directory):
+                Client().generic('POST', '/orders/assign', '{"courier_id": 1}', 'application/json',
+                                 HTTP_TRANSFER_ENCODING='chunked')
+            records = read_records([directory])
+        self.assertIsNone(records[0]['request_body'])
+        self.assertTrue(records[0]['request_body_truncated'])
+
+    def test_redaction(self):
+        body = json.dumps({'login': 'a', 'password': 'b', 'data': [{'token': 'c'}]}).encode()
+        self.assertEqual(sanitize_body(body, 'application/json; charset=utf-8'),
+                         {'login': 'a', 'password': '***', 'data': [{'token': '***'}]})
+        self.assertEqual(sanitize_body(b'text', 'text/plain'), 'text')
+        self.assertIsNone(sanitize_body(b'', 'application/json'))
+
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                tempfile.NamedTemporaryFile(mode='r', suffix='.json') as output:
+            self.capture(directory)
+            out = StringIO()
+            call_command('replay_traffic', directory, f'--url={self.live_server_url}', '--read-only',
+                         '--speed=0', '--concurrency=2', f'--output={output.name}', stdout=out)
+            report = json.load(output)
+
+        self.assertEqual((report['replayed'], report['skipped']), (3, 1))
+        self.assertEqual(set(report['routes']), {'GET /couriers/{id}', 'GET /orders/{id}'})
+        for route in report['routes'].values():
+            self.assertEqual((route['errors'], route['status_diverged'], route['body_diverged']), (0, 0, 0))
+            self.assertLessEqual(route['replayed_p50_ms'], route['replayed_p99_ms'])
+        self.assertEqual(report['examples'], [])
+        self.assertIn('3 requests replayed', out.getvalue())
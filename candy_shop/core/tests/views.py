@@ -0,0 +1,221 @@
+import json
+from datetime import datetime, time, timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.db import IntegrityError
+from rest_framework.test import APITestCase
+
+from core.models import Courier, Order, OrderDeliveryInterval, Region
+from core.services import courier as courier_service
+from core.services.response_cache import get_response_cache
+
+
+class OrderImportTestCase(APITestCase):
+    fixtures = ['test_set1']
+
+    @staticmethod
+    def order_data(order_id, region=1):
+        return {'order_id': order_id, 'weight': 0.5, 'region': region,
+                'delivery_hours': ['09:00-12:00', '16:00-21:30', '09:00-12:00']}
+
+    def test_import(self):
+        data = [self.order_data(i, region=100 + i % 3) for i in range(10, 40)]
+        # Existing orders and regions, regions, orders, intervals (+ savepoint)
+        with self.assertNumQueries(6):
+            response = self.client.post('/orders', {'data': data}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'orders': [{'id': i} for i in range(10, 40)]})
+        self.assertEqual(Region.objects.filter(id__gte=100).count(), 3)
+        order = Order.objects.get(id=10)
+        self.assertEqual((order.weight, order.region_id), (Decimal('0.5'), 101))
+        self.assertEqual(
+                list(order.delivery_intervals.order_by('start').values_list('start', 'end')),
+                [(time(9), time(12)), (time(16), time(21, 30))])
+
+    def test_validation_error(self):
+        data = [self.order_data(10), {'order_id': 11, 'weight': 0}, self.order_data(12), {}]
+        response = self.client.post('/orders', {'data': data}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'validation_error': [{'id': '11'}, {'id': '-1'}]})
+        self.assertFalse(Order.objects.filter(id__gte=10).exists())
+
+    def test_existing_orders(self):
+        data = [self.order_data(10), self.order_data(1), self.order_data(10)]
+        response = self.client.post('/orders', {'data': data}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ['Order(1) already exists.', 'Order(10) already exists.'])
+        self.assertFalse(OrderDeliveryInterval.objects.filter(order_id=10).exists())
+
+
+class CourierImportTestCase(APITestCase):
+    fixtures = ['test_set1']
+
+    @staticmethod
+    def courier_data(courier_id, courier_type='foot'):
+        return {'courier_id': courier_id, 'courier_type': courier_type, 'regions': [1, 100, 1],
+                'working_hours': ['11:35-14:05', '09:00-11:00']}
+
+    def test_import(self):
+        data = [self.courier_data(i, courier_type=('foot', 'bike', 'car')[i % 3]) for i in range(10, 40)]
+        # Courier types, existing couriers, regions, couriers, their regions
+        # and work shifts (+ savepoint)
+        with self.assertNumQueries(8):
+            response = self.client.post('/couriers', {'data': data}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'couriers': [{'id': i} for i in range(10, 40)]})
+        courier = Courier.objects.get(id=10)
+        self.assertEqual(courier.type_id, 'bike')
+        self.assertEqual(list(courier.region_ids), [1, 100])
+        self.assertEqual(
+                list(courier.work_shift_intervals),
+                [{'start': time(9), 'end': time(11)}, {'start': time(11, 35), 'end': time(14, 5)}])
+
+    def test_validation_error(self):
+        data = [self.courier_data(10), self.courier_data(11, courier_type='plane'), {}]
+        response = self.client.post('/couriers', {'data': data}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'validation_error': {'couriers': [{'id': '11'}, {'id': '-1'}]}})
+        self.assertFalse(Courier.objects.filter(id=10).exists())
+
+    def test_existing_couriers(self):
+        response = self.client.post('/couriers', {'data': [self.courier_data(10), self.courier_data(1)]},
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ['Courier(1) already exists.'])
+        self.assertFalse(Courier.objects.filter(id=10).exists())
+
+
+class NDJSONImportTestCase(APITestCase):
+    fixtures = ['test_set1']
+
+    def test_import_orders(self):
+        lines = [json.dumps(OrderImportTestCase.order_data(i)) for i in range(10, 15)]
+        lines[1] = json.dumps({'order_id': 11, 'weight': 0})
+        lines += ['', 'not json', json.dumps(OrderImportTestCase.order_data(1)),
+                  json.dumps(OrderImportTestCase.order_data(10))]
+        response = self.client.post('/orders/import?chunk_size=3', '\n'.join(lines),
+                                    content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        reports = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(r['chunk'], r['records'], r['created']) for r in reports],
+                         [(1, 3, 2), (2, 3, 2), (3, 2, 0)])
+        self.assertEqual([r['failed'] for r in reports],
+                         [[{'id': 11}], [{'id': -1}], [{'id': 1}, {'id': 10}]])
+        self.assertEqual((reports[-1]['total_created'], reports[-1]['total_failed']), (4, 4))
+        self.assertEqual(set(Order.objects.filter(id__gte=10).values_list('id', flat=True)),
+                         {10, 12, 13, 14})
+
+    def test_import_couriers(self):
+        lines = [json.dumps(CourierImportTestCase.courier_data(i)) for i in range(10, 13)]
+        response = self.client.post('/couriers/import', '\n'.join(lines),
+                                    content_type='application/x-ndjson')
+
+        reports = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(reports[-1]['total_created'], 3)
+        self.assertEqual(Courier.objects.filter(id__gte=10).count(), 3)
+
+    def test_chunk_failed(self):
+        lines = [json.dumps(OrderImportTestCase.order_data(i)) for i in range(10, 15)]
+        with mock.patch('core.serializers.order.bulk_insert', side_effect=[[], [], IntegrityError, [], []]):
+            response = self.client.post('/orders/import?chunk_size=2', '\n'.join(lines),
+                                        content_type='application/x-ndjson')
+            reports = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual([(r['created'], r['failed']) for r in reports],
+                         [(2, []), (0, [{'id': 12}, {'id': 13}]), (1, [])])
+        self.assertEqual((reports[-1]['total_created'], reports[-1]['total_failed']), (3, 2))
+
+    def test_unsupported_media_type(self):
+        response = self.client.post('/orders/import', {'data': []}, format='json')
+        self.assertEqual(response.status_code, 415)
+
+
+class ListPaginationTestCase(APITestCase):
+    fixtures = ['test_set1']
+
+    def walk(self, url, n_queries):
+        results = []
+        while url:
+            with self.assertNumQueries(n_queries):
+                page = self.client.get(url).json()
+            results += page['results']
+            url = page['next']
+        return results
+
+    def test_orders(self):
+        data = [OrderImportTestCase.order_data(i, region=100 + i % 3) for i in range(10, 40)]
+        self.client.post('/orders', {'data': data}, format='json')
+
+        # Orders and their intervals, whatever the page size
+        orders = self.walk('/orders?page_size=7', n_queries=2)
+        self.assertEqual([o['order_id'] for o in orders], [1, 2, 3] + list(range(10, 40)))
+        self.assertEqual(orders[2], {'order_id': 3, 'weight': 0.01, 'region': 22,
+                                     'delivery_hours': ['09:00-12:00', '16:00-21:30']})
+        self.assertEqual(orders[-1], self.client.get('/orders/39').json())
+
+    def test_couriers(self):
+        data = [CourierImportTestCase.courier_data(i) for i in range(10, 40)]
+        self.client.post('/couriers', {'data': data}, format='json')
+
+        # Couriers, their regions and work shifts, whatever the page size
+        couriers = self.walk('/couriers?page_size=11', n_queries=3)
+        self.assertEqual([c['courier_id'] for c in couriers], [1, 2, 3] + list(range(10, 40)))
+        self.assertEqual(couriers[0], {'courier_id': 1, 'courier_type': 'foot', 'regions': [1, 12, 22],
+                                       'working_hours': ['09:00-11:00', '11:35-14:05']})
+
+
+class ConditionalGetTestCase(APITestCase):
+    fixtures = ['test_set1']
+
+    def setUp(self):
+        get_response_cache().clear()
+
+    def test_courier(self):
+        version = Courier.objects.get(id=1).version
+        for url in ('/couriers/1', '/couriers/1/'):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(etag, f'"courier-1-{version}"')
+            # One version lookup, neither the related rows nor the stats
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+        courier_service.edit_courier(Courier.objects.get(id=1), region_ids=[1, 12, 22])
+        self.assertEqual(self.client.get('/couriers/1', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        courier_service.edit_courier(Courier.objects.get(id=1), region_ids=[1])
+        response = self.client.get('/couriers/1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['ETag']), (200, f'"courier-1-{version + 1}"'))
+        self.assertEqual(self.client.get('/couriers/100', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_order(self):
+        version = Order.objects.get(id=1).version
+        etag = self.client.get('/orders/1')['ETag']
+        self.assertEqual(etag, f'"order-1-{version}"')
+        courier_service.assign_orders(courier_id=1)
+        now = datetime.now(timezone.utc)
+        courier_service.complete_order(order_id=1, complete_time=now)
+        etag = self.client.get('/orders/1', HTTP_IF_NONE_MATCH=etag)['ETag']
+        self.assertEqual(etag, f'"order-1-{version + 2}"')
+        with self.assertNumQueries(1):
+            response = self.client.get('/orders/1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        courier_version = Courier.objects.get(id=1).version
+        courier_service.complete_order(order_id=3, complete_time=now)
+        self.assertEqual(Courier.objects.get(id=1).version, courier_version + 1)
+
+    def test_created_again(self):
+        etag = self.client.get('/orders/2')['ETag']
+        self.assertEqual(self.client.delete('/orders/2').status_code, 204)
+        data = OrderImportTestCase.order_data(2)
+        self.assertEqual(self.client.post('/orders', {'data': [data]}, format='json').status_code, 201)
+        response = self.client.get('/orders/2', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
@@ -1,2 +1,5 @@
 from .courier import *
 from .order import *
+from .importing import *
+from .asynchronous import *
+from .metrics import *
@@ -0,0 +1,50 @@
+"""Async variants of the read (polling) endpoints for ASGI servers.
+
+A slow client polling GET /couriers/<id> or GET /orders/<id> shouldn't hold a
+whole worker. Django 3.1 has no async ORM, so the wrapped sync view runs in a
+thread of the event loop's pool (`thread_sensitive=False`) and the worker keeps
+serving the other requests meanwhile. Writes go to the one thread Django runs
+all sync code in under ASGI (`thread_sensitive=True`), exactly as they would if
+the view wasn't wrapped.
+
+The views are only wrapped when `ASYNC_READ_VIEWS_ENABLED` is set, see
+candy_shop.urls: under WSGI every async view would get an event loop of its own.
+"""
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _in_pool_thread(view):
+    def run(request, *args, **kwargs):
+        # Django only manages the connections of the threads handling the
+        # request signals, the pool threads manage theirs the same way
+        close_old_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            # Render the DRF response here rather than in the loop's thread
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    return run
+
+
+def async_read_view(view):
+    """Return the async view running the read requests of the sync `view` in
+    the thread pool and the rest in the main sync thread.
+    """
+    read = sync_to_async(_in_pool_thread(view), thread_sensitive=False)
+    write = sync_to_async(view, thread_sensitive=True)
+
+    async def async_view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await read(request, *args, **kwargs)
+        return await write(request, *args, **kwargs)
+
+    # DRF views are CSRF exempt
+    async_view.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return async_view
@@ -1,14 +1,35 @@
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import status
 from rest_framework import viewsets, views
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from core.models import CourierType, Courier
+from core.pagination import KeysetPagination
+from core.routers import read_from_replica
 from core.serializers import (
         CourierTypeSerializer, CourierSerializer, CourierEditSerializer,
         CourierStatsSerializer,)
+from core.serializers.fast import couriers_to_dicts, is_fast_serialization_enabled
+from core.services.response_cache import get_cached_courier_response, get_response_cache_stats
+
+
+def courier_etag(request, pk, *args, **kwargs):
+    """A strong ETag of the courier found with one primary key lookup, neither
+    the related rows nor the stats are loaded. A changed courier gets a new
+    version, see `core.services.courier`. The version is kept on the request
+    for the response cache, so the body matches the ETag.
+    """
+    if not str(pk).isdigit():
+        return None
+    version = Courier.objects.filter(pk=pk).values_list('version', flat=True).first()
+    request.courier_version = version
+    if version is None:
+        return None
+    return f'courier-{pk}-{version}'
 
 
 class CourierTypeViewSet(viewsets.ModelViewSet):
@@ -17,16 +38,37 @@ class CourierTypeViewSet(viewsets.ModelViewSet):
 
 
 class CourierViewSet(viewsets.ViewSet):
+    @read_from_replica
     def list(self, request):
-        queryset = Courier.objects.all()
-        serializer = CourierSerializer(queryset, many=True)
-        return Response(serializer.data)
-
+        # A page costs three queries whatever its size: couriers, their
+        # regions and work shifts
+        paginator = KeysetPagination()
+        if is_fast_serialization_enabled():
+            rows = paginator.paginate_queryset(Courier.objects.values('id', 'type_id'), request, view=self)
+            return paginator.get_paginated_response(couriers_to_dicts(rows))
+
+        queryset = Courier.objects.prefetch_related('courier_regions', 'work_shifts')
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = CourierSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @read_from_replica
+    @method_decorator(condition(etag_func=courier_etag))
     def retrieve(self, request, pk=None):
-        queryset = Courier.objects.all()
-        courier = get_object_or_404(queryset, pk=pk)
-        serializer = CourierSerializer(courier)
-        return Response(serializer.data)
+        def build():
+            if is_fast_serialization_enabled():
+                row = get_object_or_404(Courier.objects.values('id', 'type_id'), pk=pk)
+                return couriers_to_dicts([row])[0]
+
+            queryset = Courier.objects.all()
+            courier = get_object_or_404(queryset, pk=pk)
+            return CourierSerializer(courier).data
+
+        # The versions are kept by the courier IDs, not by the URL spelling
+        if not str(pk).isdigit():
+            return Response(build())
+        return Response(get_cached_courier_response(
+                'retrieve', int(pk), build, version=getattr(request, 'courier_version', None)))
 
     def destroy(self, request, pk=None, *args, **kwargs):
         queryset = Courier.objects.all()
@@ -38,33 +80,34 @@ class CourierViewSet(viewsets.ViewSet):
         if 'data' not in request.data:
             raise ValidationError({'data': 'This field is required.'})
 
-        failed_ids = []
-        valid_ids = []
-
-        for courier_data in request.data['data']:
-            serializer = CourierSerializer(data=courier_data)
-            if not serializer.is_valid():
-                failed_ids.append(courier_data.get('courier_id', -1))
-            else:
-                valid_ids.append(courier_data.get('courier_id', -1))
-
-        if failed_ids:
+        # Validate and create all the couriers at once, the whole batch fails
+        # if any of them is invalid
+        serializer = CourierSerializer(data=request.data['data'], many=True)
+        if not serializer.is_valid():
+            if not isinstance(serializer.errors, list):
+                raise ValidationError({'data': serializer.errors})
+            failed_ids = [courier_data.get('courier_id', -1)
+                          for courier_data, errors in zip(request.data['data'], serializer.errors)
+                          if errors]
             raise ValidationError({
                     'validation_error': {
                         'couriers': [{'id': i} for i in failed_ids]}})
-
-        serializer = CourierSerializer(data=request.data['data'], many=True)
-        serializer.is_valid()
         serializer.save()
+        valid_ids = [courier_data['id'] for courier_data in serializer.validated_data]
 
         return Response({'couriers': [{'id': i} for i in valid_ids]}, status=status.HTTP_201_CREATED)
 
 
 class CourierDetailView(views.APIView):
+    @read_from_replica
+    @method_decorator(condition(etag_func=courier_etag))
     def get(self, request, pk):
-        courier = get_object_or_404(Courier.objects.all(), pk=pk)
-        serializer = CourierStatsSerializer(courier)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        def build():
+            courier = get_object_or_404(Courier.objects.all(), pk=pk)
+            return CourierStatsSerializer(courier).data
+
+        return Response(get_cached_courier_response(
+                'stats', pk, build, version=getattr(request, 'courier_version', None)), status=status.HTTP_200_OK)
 
     def patch(self, request, *args, **kwargs):
         try:
@@ -75,3 +118,8 @@ class CourierDetailView(views.APIView):
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ResponseCacheStatsView(views.APIView):
+    def get(self, request):
+        return Response(get_response_cache_stats(), status=status.HTTP_200_OK)
@@ -0,0 +1,44 @@
+import json
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework import views
+from rest_framework.exceptions import ValidationError
+
+from core.parsers import NDJSONParser
+from core.serializers.importing import import_records
+
+
+class NDJSONImportView(views.APIView):
+    """Streaming import of newline delimited JSON records. Responds with the
+    newline delimited JSON progress report of every chunk as it's imported.
+    """
+    kind = None
+    parser_classes = [NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            chunk_size = int(request.query_params.get('chunk_size', settings.NDJSON_IMPORT_CHUNK_SIZE))
+        except ValueError:
+            chunk_size = 0
+        if chunk_size < 1:
+            raise ValidationError({'chunk_size': 'A positive integer is required.'})
+
+        reports = import_records(kind=self.kind, records=request.data, chunk_size=chunk_size)
+        if isinstance(request._request, ASGIRequest):
+            # The ASGI handler iterates the response in the event loop, where
+            # the database can't be used, so the records are imported here
+            # (still read lazily) and only the reports are streamed
+            reports = list(reports)
+        return StreamingHttpResponse(
+                (json.dumps(report) + '\n' for report in reports),
+                content_type=NDJSONParser.media_type)
+
+
+class CourierImportView(NDJSONImportView):
+    kind = 'couriers'
+
+
+class OrderImportView(NDJSONImportView):
+    kind = 'orders'
@@ -0,0 +1,10 @@
+from django.http import HttpResponse
+from django.views import View
+
+from core.services.metrics import render_metrics
+
+
+class MetricsView(View):
+    """The metrics of all the workers for Prometheus to scrape."""
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
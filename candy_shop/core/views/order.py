@@ -1,20 +1,55 @@
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import status
 from rest_framework import viewsets, views
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from core.models import Order
-from core.serializers import OrderSerializer, OrdersAssignSerializer, OrderCompleteSerializer
+from core.pagination import KeysetPagination
+from core.routers import read_from_replica
+from core.serializers import (
+        OrderSerializer, OrdersAssignSerializer, OrdersAssignBatchSerializer,
+        OrderCompleteSerializer, OrdersCompleteBatchSerializer)
+from core.serializers.fast import (
+        is_fast_serialization_enabled, orders_to_dicts, shipment_to_dict, shipments_to_dict)
+
+
+def order_etag(request, pk, *args, **kwargs):
+    """A strong ETag of the order found with one primary key lookup. A changed
+    order gets a new version, see `core.services.courier`.
+    """
+    if not str(pk).isdigit():
+        return None
+    version = Order.objects.filter(pk=pk).values_list('version', flat=True).first()
+    if version is None:
+        return None
+    return f'order-{pk}-{version}'
 
 
 class OrderViewSet(viewsets.ViewSet):
+    @read_from_replica
     def list(self, request):
-        queryset = Order.objects.all()
-        serializer = OrderSerializer(queryset, many=True)
-        return Response(serializer.data)
+        # A page costs two queries whatever its size: orders and their intervals
+        paginator = KeysetPagination()
+        if is_fast_serialization_enabled():
+            rows = paginator.paginate_queryset(
+                    Order.objects.values('id', 'weight', 'region_id'), request, view=self)
+            return paginator.get_paginated_response(orders_to_dicts(rows))
+
+        queryset = Order.objects.prefetch_related('delivery_intervals')
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = OrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
+    @read_from_replica
+    @method_decorator(condition(etag_func=order_etag))
     def retrieve(self, request, pk=None):
+        if is_fast_serialization_enabled():
+            row = get_object_or_404(Order.objects.values('id', 'weight', 'region_id'), pk=pk)
+            return Response(orders_to_dicts([row])[0])
+
         queryset = Order.objects.all()
         order = get_object_or_404(queryset, pk=pk)
         serializer = OrderSerializer(order)
@@ -30,23 +65,19 @@ class OrderViewSet(viewsets.ViewSet):
         if 'data' not in request.data:
             raise ValidationError({'data': 'This field is required.'})
 
-        failed_ids = []
-        valid_ids = []
-
-        for order_data in request.data['data']:
-            serializer = OrderSerializer(data=order_data)
-            if not serializer.is_valid():
-                failed_ids.append(order_data.get('order_id', -1))
-            else:
-                valid_ids.append(order_data.get('order_id', -1))
-
-        if failed_ids:
+        # Validate and create all the orders at once, the whole batch fails
+        # if any of them is invalid
+        serializer = OrderSerializer(data=request.data['data'], many=True)
+        if not serializer.is_valid():
+            if not isinstance(serializer.errors, list):
+                raise ValidationError({'data': serializer.errors})
+            failed_ids = [order_data.get('order_id', -1)
+                          for order_data, errors in zip(request.data['data'], serializer.errors)
+                          if errors]
             raise ValidationError({
                     'validation_error': [{'id': i} for i in failed_ids]})
-
-        serializer = OrderSerializer(data=request.data['data'], many=True)
-        serializer.is_valid()
         serializer.save()
+        valid_ids = [order_data['id'] for order_data in serializer.validated_data]
 
         return Response({'orders': [{'id': i} for i in valid_ids]}, status=status.HTTP_201_CREATED)
 
@@ -55,7 +86,19 @@ class OrderAssignView(views.APIView):
     def post(self, request, *args, **kwargs):
         serializer = OrdersAssignSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        assignment = serializer.save()
+        if is_fast_serialization_enabled():
+            return Response(shipment_to_dict(assignment), status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class OrderAssignBatchView(views.APIView):
+    def post(self, request, *args, **kwargs):
+        serializer = OrdersAssignBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        assignments = serializer.save()
+        if is_fast_serialization_enabled():
+            return Response(shipments_to_dict(assignments), status=status.HTTP_200_OK)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
@@ -65,3 +108,11 @@ class OrderCompleteView(views.APIView):
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class OrderCompleteBatchView(views.APIView):
+    def post(self, request, *args, **kwargs):
+        serializer = OrdersCompleteBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_200_OK)